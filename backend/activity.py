@@ -0,0 +1,136 @@
+"""Document activity / audit log.
+
+Handlers call ``activity_log.record(...)``, which only appends to a bounded
+in-process ring buffer. A background writer group-commits the buffer into
+the ``activity`` collection with ``insert_many`` every ACTIVITY_FLUSH_MS or
+as soon as ACTIVITY_BATCH_SIZE events are waiting. When the buffer is full
+the oldest events are dropped (and counted) rather than blocking requests.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import uuid
+from collections import deque
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from pymongo.errors import BulkWriteError, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+ACTIVITY_CAPACITY = int(os.environ.get('ACTIVITY_CAPACITY', '10000'))
+ACTIVITY_BATCH_SIZE = int(os.environ.get('ACTIVITY_BATCH_SIZE', '500'))
+ACTIVITY_FLUSH_MS = int(os.environ.get('ACTIVITY_FLUSH_MS', '250'))
+
+
+def section_digests(sections: List[Dict[str, Any]]) -> Dict[str, str]:
+    """Short content hash per section_id, used to tell which sections an update changed"""
+    return {
+        s['section_id']: hashlib.sha1(json.dumps(s, sort_keys=True, default=str).encode()).hexdigest()[:16]
+        for s in sections if 'section_id' in s
+    }
+
+
+def changed_sections(before: Optional[Dict[str, str]], after: Dict[str, str]) -> List[str]:
+    before = before or {}
+    return [sid for sid, digest in after.items() if before.get(sid) != digest]
+
+
+class ActivityLog:
+    def __init__(self, get_db, capacity: int = ACTIVITY_CAPACITY, batch_size: int = ACTIVITY_BATCH_SIZE,
+                 flush_interval: float = ACTIVITY_FLUSH_MS / 1000):
+        self.get_db = get_db
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffer: deque = deque(maxlen=capacity)
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.dropped = 0
+        self.written = 0
+
+    async def ensure_indexes(self):
+        await self.get_db().activity.create_index([('document_id', 1), ('created_at', -1), ('id', -1)])
+
+    def record(self, document_id: str, type: str, actor: Optional[str] = None, **details):
+        if len(self._buffer) == self._buffer.maxlen:
+            self.dropped += 1
+        self._buffer.append({
+            'id': str(uuid.uuid4()),
+            'document_id': document_id,
+            'type': type,
+            'actor': actor,
+            'created_at': datetime.utcnow().isoformat(),
+            **details,
+        })
+        if self._wakeup and len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    def pending(self, document_id: str) -> List[Dict[str, Any]]:
+        """Events for a document that have not been written yet, newest first"""
+        return [e for e in reversed(self._buffer) if e['document_id'] == document_id]
+
+    async def page(self, document_id: str, limit: int, before: Optional[str] = None,
+                   before_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Newest events first, strictly after the (before, before_id) cursor, buffered ones included.
+
+        Events are ordered by (created_at, id) so the cursor is unique even when several
+        events share a timestamp; an event being flushed can be both buffered and stored,
+        so the two sources are merged by id.
+        """
+        def older(e):
+            return before is None or (e['created_at'], e['id']) < (before, before_id or '')
+
+        query: Dict[str, Any] = {'document_id': document_id}
+        if before is not None:
+            query['$or'] = [{'created_at': {'$lt': before}}, {'created_at': before, 'id': {'$lt': before_id or ''}}]
+        buffered = [e for e in self.pending(document_id) if older(e)]
+        stored = await self.get_db().activity.find(query, {'_id': 0}).sort(
+            [('created_at', -1), ('id', -1)]).limit(limit).to_list(None)
+        merged = {e['id']: e for e in stored}
+        merged.update((e['id'], e) for e in buffered)
+        return sorted(merged.values(), key=lambda e: (e['created_at'], e['id']), reverse=True)[:limit]
+
+    async def flush(self):
+        while self._buffer:
+            batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+            try:
+                await self.get_db().activity.insert_many(batch, ordered=False)
+                self.written += len(batch)
+            except BulkWriteError as e:
+                # Individual events were rejected; retrying them would fail the same way
+                self.written += e.details.get('nInserted', 0)
+                self.dropped += len(batch) - e.details.get('nInserted', 0)
+                logger.warning("Dropped %d rejected activity events", len(e.details.get('writeErrors', [])))
+            except PyMongoError as e:
+                # Put the batch back (as far as capacity allows) and retry on the next tick
+                logger.warning("Writing %d activity events failed: %s", len(batch), e)
+                room = self._buffer.maxlen - len(self._buffer)
+                self.dropped += max(0, len(batch) - room)
+                self._buffer.extendleft(reversed(batch[-room:] if room else []))
+                return
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the writer and drain whatever is still buffered"""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> Dict[str, int]:
+        return {'buffered': len(self._buffer), 'written': self.written, 'dropped': self.dropped}
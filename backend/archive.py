@@ -0,0 +1,246 @@
+"""Cold storage for archived documents.
+
+Documents that have sat in ``archived`` status for ARCHIVE_AFTER seconds are
+packed, together with their comments, into one compressed blob (zstd when
+the ``zstandard`` package is installed, zlib otherwise) and the document is
+replaced by a stub that keeps only the fields listings need. Blobs live in
+the ``archives`` collection or, with ARCHIVE_STORE=file, as files under
+ARCHIVE_DIR. Opening a stub restores the full document and its comments.
+"""
+import asyncio
+import json
+import logging
+import os
+import uuid
+import zlib
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from bson import Binary
+from fastapi.concurrency import run_in_threadpool
+from pymongo.errors import BulkWriteError, PyMongoError
+
+try:
+    import zstandard
+except ImportError:  # optional; zlib is used instead
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_STORE = os.environ.get('ARCHIVE_STORE', 'mongo')
+ARCHIVE_DIR = Path(os.environ.get('ARCHIVE_DIR', '/tmp/archives'))
+ARCHIVE_AFTER = float(os.environ.get('ARCHIVE_AFTER', str(7 * 24 * 3600)))
+ARCHIVE_INTERVAL = float(os.environ.get('ARCHIVE_INTERVAL', '3600'))
+ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', '50'))
+
+# Fields a stub keeps so that listings and dashboards still work
+STUB_FIELDS = ('id', 'title', 'status', 'created_by', 'created_at', 'updated_at', 'collaborators',
+               'version', 'template_id', 'template_version', 'deleted_at', 'deleted_by')
+
+ZSTD_MAGIC = b'Z'
+ZLIB_MAGIC = b'z'
+
+
+def compress(data: bytes) -> bytes:
+    if zstandard is not None:
+        return ZSTD_MAGIC + zstandard.ZstdCompressor(level=10).compress(data)
+    return ZLIB_MAGIC + zlib.compress(data, 9)
+
+
+def decompress(blob: bytes) -> bytes:
+    codec, body = blob[:1], blob[1:]
+    if codec == ZSTD_MAGIC:
+        if zstandard is None:
+            raise RuntimeError("Archive was written with zstd but zstandard is not installed")
+        return zstandard.ZstdDecompressor().decompress(body)
+    return zlib.decompress(body)
+
+
+class MongoArchiveStore:
+    def __init__(self, get_db):
+        self.get_db = get_db
+
+    async def put(self, doc_id: str, blob: bytes):
+        await self.get_db().archives.replace_one(
+            {'_id': doc_id}, {'_id': doc_id, 'blob': Binary(blob), 'size': len(blob)}, upsert=True
+        )
+
+    async def get(self, doc_id: str) -> Optional[bytes]:
+        record = await self.get_db().archives.find_one({'_id': doc_id})
+        return bytes(record['blob']) if record else None
+
+    async def delete(self, doc_id: str):
+        await self.get_db().archives.delete_one({'_id': doc_id})
+
+
+class FileArchiveStore:
+    def __init__(self, directory: Path = ARCHIVE_DIR):
+        self.directory = directory
+
+    def _path(self, doc_id: str) -> Path:
+        return self.directory / f"{doc_id}.im"
+
+    def _write(self, doc_id: str, blob: bytes):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp = self.directory / f".{uuid.uuid4().hex}.im"
+        tmp.write_bytes(blob)
+        os.replace(tmp, self._path(doc_id))
+
+    def _read(self, doc_id: str) -> Optional[bytes]:
+        path = self._path(doc_id)
+        return path.read_bytes() if path.is_file() else None
+
+    async def put(self, doc_id: str, blob: bytes):
+        await run_in_threadpool(self._write, doc_id, blob)
+
+    async def get(self, doc_id: str) -> Optional[bytes]:
+        return await run_in_threadpool(self._read, doc_id)
+
+    async def delete(self, doc_id: str):
+        await run_in_threadpool(self._path(doc_id).unlink, missing_ok=True)
+
+
+class Archiver:
+    def __init__(self, get_db, store=None, after: float = ARCHIVE_AFTER, interval: float = ARCHIVE_INTERVAL,
+                 batch_size: int = ARCHIVE_BATCH_SIZE):
+        self.get_db = get_db
+        self.store = store or (FileArchiveStore() if ARCHIVE_STORE == 'file' else MongoArchiveStore(get_db))
+        self.after = after
+        self.interval = interval
+        self.batch_size = batch_size
+        self._task = None
+        self._restoring: Dict[str, asyncio.Future] = {}
+        self.archived = 0
+        self.restored = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    async def ensure_indexes(self):
+        await self.get_db().documents.create_index([('status', 1), ('updated_at', 1)])
+        # Lets a restore that was interrupted re-insert the same comments safely
+        await self.get_db().comments.create_index('id', unique=True)
+
+    async def archive(self, doc_id: str) -> bool:
+        """Move a document and its comments into the store, leaving a stub behind"""
+        db = self.get_db()
+        doc = await db.documents.find_one({'id': doc_id, 'archived': {'$exists': False}}, {'_id': 0})
+        if not doc:
+            return False
+        comments = await db.comments.find({'document_id': doc_id}, {'_id': 0}).to_list(None)
+        raw = json.dumps({'document': doc, 'comments': comments}, default=str).encode()
+        blob = await run_in_threadpool(compress, raw)
+        await self.store.put(doc_id, blob)
+
+        stub = {k: doc[k] for k in STUB_FIELDS if k in doc}
+        stub.update({'archived': True, 'archived_at': datetime.utcnow().isoformat(), 'sections': []})
+        # Only replace the revision that was packed; an edit in between keeps the document hot
+        result = await db.documents.replace_one({'id': doc_id, 'updated_at': doc.get('updated_at'),
+                                                 'archived': {'$exists': False}}, stub)
+        if not result.modified_count:
+            # Edited meanwhile, or another worker archived it first (and owns the blob now)
+            if not await db.documents.find_one({'id': doc_id, 'archived': True}, {'_id': 1}):
+                await self.store.delete(doc_id)
+            return False
+        if comments:
+            await db.comments.delete_many({'document_id': doc_id, 'id': {'$in': [c['id'] for c in comments]}})
+        self.archived += 1
+        self.bytes_in += len(raw)
+        self.bytes_out += len(blob)
+        return True
+
+    async def restore(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        """Bring an archived document back; concurrent callers share one restore"""
+        pending = self._restoring.get(doc_id)
+        if pending is not None:
+            return await asyncio.shield(pending)
+        future = asyncio.get_running_loop().create_future()
+        self._restoring[doc_id] = future
+        try:
+            doc = await self._restore(doc_id)
+            future.set_result(doc)
+            return doc
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # mark retrieved when nobody else is waiting
+            raise
+        finally:
+            del self._restoring[doc_id]
+
+    async def _restore(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        db = self.get_db()
+        blob = await self.store.get(doc_id)
+        if blob is None:
+            return await db.documents.find_one({'id': doc_id}, {'_id': 0})
+        payload = json.loads(await run_in_threadpool(decompress, blob))
+        doc = payload['document']
+        # The stub is authoritative for the fields it kept (e.g. collaborators added while archived)
+        stub = await db.documents.find_one({'id': doc_id, 'archived': True}, {'_id': 0})
+        if stub:
+            doc.update({k: stub[k] for k in STUB_FIELDS if k in stub})
+            # Comments first, then the stub, then the blob: a restore interrupted at any
+            # point leaves the blob in place and the next one finishes the job
+            if payload['comments']:
+                try:
+                    await db.comments.insert_many(payload['comments'], ordered=False)
+                except BulkWriteError as e:
+                    if any(err.get('code') != 11000 for err in e.details.get('writeErrors', [])):
+                        raise
+            doc['restored_at'] = datetime.utcnow().isoformat()
+            result = await db.documents.replace_one({'id': doc_id, 'archived': True}, doc)
+            if result.modified_count:
+                self.restored += 1
+        await self.store.delete(doc_id)
+        return await db.documents.find_one({'id': doc_id}, {'_id': 0})
+
+    async def sweep(self) -> int:
+        """Archive documents that have been in archived status (and untouched) long enough"""
+        cutoff = (datetime.utcnow() - timedelta(seconds=self.after)).isoformat()
+        candidates = await self.get_db().documents.find(
+            {
+                'status': 'archived',
+                'updated_at': {'$lt': cutoff},
+                'archived': {'$exists': False},
+                'deleted_at': {'$exists': False},
+                '$or': [{'restored_at': {'$exists': False}}, {'restored_at': {'$lt': cutoff}}],
+            },
+            {'_id': 0, 'id': 1},
+        ).limit(self.batch_size).to_list(None)
+        count = 0
+        for candidate in candidates:
+            if await self.archive(candidate['id']):
+                count += 1
+        return count
+
+    async def _run(self):
+        while True:
+            try:
+                while await self.sweep() == self.batch_size:
+                    pass
+            except PyMongoError as e:
+                logger.warning("Archiving documents failed: %s", e)
+            except Exception:
+                logger.exception("Archiving documents failed")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'codec': 'zstd' if zstandard is not None else 'zlib',
+            'store': type(self.store).__name__,
+            'archived': self.archived,
+            'restored': self.restored,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+        }
@@ -0,0 +1,214 @@
+"""Binary attachments per document section, stored in GridFS.
+
+File bytes live in the ``blobs`` GridFS bucket and never inside the document.
+Each attachment is a small record in ``attachments`` (document, section,
+filename, content type, size, sha256) that references a GridFS file by id.
+Uploads are streamed into GridFS chunk by chunk while being hashed; when
+another file with the same sha256 already exists, the new copy is dropped
+and the record points at the existing file, so identical annexures are
+stored once. A GridFS file is deleted with the last record referencing it.
+Downloads read GridFS chunks on demand, from any byte offset, and export
+bundles copy attachments into the zip the same way.
+"""
+import hashlib
+import logging
+import os
+import json
+import uuid
+import zipfile
+from datetime import datetime
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from fastapi.concurrency import run_in_threadpool
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+
+logger = logging.getLogger(__name__)
+
+BUCKET = 'blobs'
+ATTACHMENT_MAX_BYTES = int(os.environ.get('ATTACHMENT_MAX_BYTES', str(100 * 1024 * 1024)))
+ATTACHMENT_CHUNK_BYTES = int(os.environ.get('ATTACHMENT_CHUNK_BYTES', str(255 * 1024)))
+DEFAULT_CONTENT_TYPE = 'application/octet-stream'
+
+# Fields exports and listings get; file_id stays internal
+LISTED = {'_id': 0, 'id': 1, 'document_id': 1, 'section_id': 1, 'filename': 1, 'content_type': 1,
+          'length': 1, 'sha256': 1, 'uploaded_by': 1, 'created_at': 1}
+
+
+class AttachmentTooLarge(Exception):
+    pass
+
+
+class AttachmentStore:
+    def __init__(self, get_db, max_bytes: int = ATTACHMENT_MAX_BYTES, chunk_bytes: int = ATTACHMENT_CHUNK_BYTES):
+        self.get_db = get_db
+        self.max_bytes = max_bytes
+        self.chunk_bytes = chunk_bytes
+        self.uploaded = 0
+        self.deduplicated = 0
+        self.bytes_stored = 0
+
+    def bucket(self) -> AsyncIOMotorGridFSBucket:
+        return AsyncIOMotorGridFSBucket(self.get_db(), bucket_name=BUCKET, chunk_size_bytes=self.chunk_bytes)
+
+    async def ensure_indexes(self):
+        db = self.get_db()
+        await db.attachments.create_index('id', unique=True)
+        await db.attachments.create_index([('document_id', 1), ('section_id', 1), ('created_at', 1)])
+        await db.attachments.create_index('file_id')
+        await db[f'{BUCKET}.files'].create_index([('metadata.sha256', 1), ('uploadDate', 1)])
+
+    async def upload(self, document_id: str, section_id: str, filename: str, content_type: Optional[str],
+                     body: AsyncIterator[bytes], uploaded_by: Optional[str] = None) -> Dict[str, Any]:
+        """Stream body into GridFS and record it; raises AttachmentTooLarge past max_bytes"""
+        db = self.get_db()
+        digest = hashlib.sha256()
+        length = 0
+        grid_in = self.bucket().open_upload_stream(filename, metadata={'content_type': content_type})
+        try:
+            async for chunk in body:
+                length += len(chunk)
+                if length > self.max_bytes:
+                    raise AttachmentTooLarge(f"Attachments are limited to {self.max_bytes} bytes")
+                digest.update(chunk)
+                await grid_in.write(chunk)
+            await grid_in.close()
+        except BaseException:
+            await grid_in.abort()
+            raise
+        sha256 = digest.hexdigest()
+        file_id = grid_in._id
+        await db[f'{BUCKET}.files'].update_one({'_id': file_id}, {'$set': {'metadata.sha256': sha256}})
+
+        record = {
+            'id': str(uuid.uuid4()),
+            'document_id': document_id,
+            'section_id': section_id,
+            'file_id': file_id,
+            'filename': filename,
+            'content_type': content_type or DEFAULT_CONTENT_TYPE,
+            'length': length,
+            'sha256': sha256,
+            'uploaded_by': uploaded_by,
+            'created_at': datetime.utcnow().isoformat(),
+        }
+        # Concurrent uploads of the same bytes all settle on the oldest copy
+        canonical = await db[f'{BUCKET}.files'].find_one(
+            {'metadata.sha256': sha256, 'length': length}, {'_id': 1}, sort=[('uploadDate', 1), ('_id', 1)]
+        )
+        if canonical and canonical['_id'] != file_id:
+            record['file_id'] = canonical['_id']
+            await db.attachments.insert_one(record)
+            # The canonical copy may have lost its last reference meanwhile; keep ours then
+            if await db[f'{BUCKET}.files'].find_one({'_id': canonical['_id']}, {'_id': 1}):
+                await self.bucket().delete(file_id)
+                self.deduplicated += 1
+            else:
+                await db.attachments.update_one({'id': record['id']}, {'$set': {'file_id': file_id}})
+                record['file_id'] = file_id
+                self.bytes_stored += length
+        else:
+            await db.attachments.insert_one(record)
+            self.bytes_stored += length
+        self.uploaded += 1
+        return {k: v for k, v in record.items() if k in LISTED}
+
+    async def get(self, attachment_id: str) -> Optional[Dict[str, Any]]:
+        return await self.get_db().attachments.find_one({'id': attachment_id}, {'_id': 0})
+
+    async def list_for_document(self, document_id: str, section_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        query = {'document_id': document_id}
+        if section_id is not None:
+            query['section_id'] = section_id
+        return await self.get_db().attachments.find(query, LISTED).sort([('section_id', 1), ('created_at', 1)]).to_list(None)
+
+    async def chunks(self, record: Dict[str, Any], start: int, end: int) -> AsyncIterator[bytes]:
+        """Bytes start..end (inclusive) of an attachment, one GridFS chunk at a time"""
+        grid_out = await self.bucket().open_download_stream(record['file_id'])
+        grid_out.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            data = await grid_out.read(min(self.chunk_bytes, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+    async def _release(self, file_ids):
+        db = self.get_db()
+        for file_id in set(file_ids):
+            if not await db.attachments.find_one({'file_id': file_id}, {'_id': 1}):
+                try:
+                    await self.bucket().delete(file_id)
+                except Exception as e:  # gridfs.NoFile: already released by a concurrent delete
+                    logger.debug("Releasing blob %s: %s", file_id, e)
+
+    async def delete(self, attachment_id: str) -> Optional[Dict[str, Any]]:
+        record = await self.get_db().attachments.find_one_and_delete({'id': attachment_id}, projection={'_id': 0})
+        if record:
+            await self._release([record['file_id']])
+        return record
+
+    async def purge_document(self, document_id: str):
+        """Drop every attachment of a document (reaper hook)"""
+        db = self.get_db()
+        records = await db.attachments.find({'document_id': document_id}, {'_id': 0, 'file_id': 1}).to_list(None)
+        if records:
+            await db.attachments.delete_many({'document_id': document_id})
+            await self._release(r['file_id'] for r in records)
+
+    async def copy_document(self, source_id: str, target_id: str, skip_sections: List[str] = ()):
+        """Reference source's attachments from target too (e.g. a clone); no bytes are copied"""
+        await self.get_db().attachments.aggregate([
+            {'$match': {'document_id': source_id, 'section_id': {'$nin': list(skip_sections)}}},
+            {'$set': {'id': {'$concat': [target_id, ':', '$id']}, 'document_id': target_id}},
+            {'$unset': '_id'},
+            {'$merge': {'into': 'attachments', 'whenMatched': 'fail', 'whenNotMatched': 'insert'}},
+        ]).to_list(None)
+
+    async def annotate(self, doc: Dict[str, Any]) -> Dict[str, Any]:
+        """Copy of doc with each section's attachment manifest under ``attachments`` (metadata only)"""
+        by_section: Dict[str, List[Dict[str, Any]]] = {}
+        for record in await self.list_for_document(doc['id']):
+            by_section.setdefault(record['section_id'], []).append(
+                {k: record[k] for k in ('id', 'filename', 'content_type', 'length', 'sha256')}
+            )
+        if not by_section:
+            return doc
+        sections = [{**s, 'attachments': by_section[s['section_id']]} if s.get('section_id') in by_section else s
+                    for s in doc.get('sections', [])]
+        return {**doc, 'sections': sections}
+
+    async def write_bundle(self, doc: Dict[str, Any], export_path: Path, export_name: str, output: Path) -> Path:
+        """Zip a rendered export with every attachment of doc, copying GridFS chunks one at a time"""
+        records = await self.get_db().attachments.find({'document_id': doc['id']}, {'_id': 0}).sort(
+            [('section_id', 1), ('created_at', 1)]).to_list(None)
+        numbers = {s['section_id']: s.get('section_number', '') for s in doc.get('sections', [])}
+        bundle = await run_in_threadpool(zipfile.ZipFile, output, 'w', zipfile.ZIP_STORED)
+        try:
+            await run_in_threadpool(bundle.write, export_path, export_name)
+            names = set()
+            manifest = []
+            for record in records:
+                section = record['section_id']
+                folder = f"attachments/{numbers[section]}-{section}" if numbers.get(section) else f"attachments/{section}"
+                name = f"{folder}/{Path(record['filename']).name}"
+                if name in names:
+                    name = f"{folder}/{record['id'][:8]}-{Path(record['filename']).name}"
+                names.add(name)
+                # Attachments are mostly compressed formats already, so they are stored as-is
+                entry = await run_in_threadpool(bundle.open, name, 'w', force_zip64=record['length'] >= 2 ** 31)
+                try:
+                    async for chunk in self.chunks(record, 0, record['length'] - 1):
+                        await run_in_threadpool(entry.write, chunk)
+                finally:
+                    await run_in_threadpool(entry.close)
+                manifest.append({'path': name, **{k: record[k] for k in ('id', 'section_id', 'filename', 'content_type', 'length', 'sha256')}})
+            await run_in_threadpool(bundle.writestr, 'manifest.json', json.dumps(
+                {'document_id': doc['id'], 'title': doc['title'], 'export': export_name, 'attachments': manifest}, indent=2))
+        finally:
+            await run_in_threadpool(bundle.close)
+        return output
+
+    def stats(self) -> Dict[str, int]:
+        return {'uploaded': self.uploaded, 'deduplicated': self.deduplicated, 'bytes_stored': self.bytes_stored}
@@ -0,0 +1,159 @@
+"""Firebase ID token verification for API requests.
+
+Tokens are verified locally: the securetoken signing certificates are
+fetched once and kept until their Cache-Control max-age runs out, so a
+request normally costs one RS256 check. Decoded tokens are additionally
+kept in a short-TTL LRU keyed by the token's hash, and each uid's role is
+cached from ``users`` (invalidated through the ``users`` cache bus).
+
+With AUTH_REQUIRED=0 (the default while clients roll out) requests without
+a bearer token are still accepted and handlers fall back to the user ids
+they are sent; a token that is present is always verified.
+"""
+import asyncio
+import hashlib
+import os
+import re
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+import httpx
+import jwt
+from cryptography.x509 import load_pem_x509_certificate
+from fastapi import HTTPException, Request
+
+import cache
+
+FIREBASE_PROJECT_ID = os.environ.get('FIREBASE_PROJECT_ID', 'im-b169f')
+AUTH_REQUIRED = os.environ.get('AUTH_REQUIRED', '0') == '1'
+AUTH_TOKEN_CACHE_TTL = float(os.environ.get('AUTH_TOKEN_CACHE_TTL', '60'))
+CERTS_URL = "https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com"
+ADMIN_ROLE = "admin"
+_UNKNOWN = object()
+
+
+@dataclass(frozen=True)
+class Principal:
+    uid: str
+    email: Optional[str]
+    role: Optional[str]
+
+    @property
+    def is_admin(self) -> bool:
+        return self.role == ADMIN_ROLE
+
+
+class SigningKeys:
+    """Google's token signing keys, refreshed according to their cache headers"""
+
+    def __init__(self, url: str = CERTS_URL, min_refresh: float = 60.0):
+        self.url = url
+        self.min_refresh = min_refresh
+        self._keys: Dict[str, object] = {}
+        self._expires_at = 0.0
+        self._fetched_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def get(self, kid: str):
+        now = time.monotonic()
+        stale = now >= self._expires_at
+        # An unknown kid may mean the keys rotated early; refetch, but not on every bad token
+        rotated = kid not in self._keys and now - self._fetched_at > self.min_refresh
+        if stale or rotated:
+            async with self._lock:
+                if time.monotonic() >= self._expires_at or (kid not in self._keys and rotated):
+                    await self._fetch()
+        return self._keys.get(kid)
+
+    async def _fetch(self):
+        async with httpx.AsyncClient(timeout=10) as client:
+            response = await client.get(self.url)
+            response.raise_for_status()
+        self._keys = {
+            kid: load_pem_x509_certificate(pem.encode()).public_key()
+            for kid, pem in response.json().items()
+        }
+        match = re.search(r'max-age=(\d+)', response.headers.get('cache-control', ''))
+        self._fetched_at = time.monotonic()
+        self._expires_at = self._fetched_at + (int(match.group(1)) if match else 3600)
+
+
+class TokenVerifier:
+    def __init__(self, project_id: str = FIREBASE_PROJECT_ID, keys: Optional[SigningKeys] = None,
+                 token_ttl: float = AUTH_TOKEN_CACHE_TTL):
+        self.project_id = project_id
+        self.keys = keys or SigningKeys()
+        self.token_ttl = token_ttl
+        self.tokens = cache.LocalCache(maxsize=10_000, ttl=token_ttl)
+
+    async def verify(self, token: str) -> Dict[str, object]:
+        """Decoded claims of a valid Firebase ID token; raises 401 otherwise"""
+        token_hash = hashlib.sha256(token.encode()).hexdigest()
+        claims = self.tokens.get(token_hash)
+        if claims is not None and claims['exp'] > time.time():
+            return claims
+        try:
+            kid = jwt.get_unverified_header(token).get('kid')
+            key = await self.keys.get(kid) if kid else None
+            if key is None:
+                raise HTTPException(status_code=401, detail="Unknown token signing key")
+            claims = jwt.decode(
+                token,
+                key,
+                algorithms=['RS256'],
+                audience=self.project_id,
+                issuer=f"https://securetoken.google.com/{self.project_id}",
+                options={'require': ['exp', 'iat', 'sub']},
+                leeway=5,
+            )
+        except jwt.PyJWTError as e:
+            raise HTTPException(status_code=401, detail=f"Invalid token: {e}")
+        except httpx.HTTPError:
+            raise HTTPException(status_code=503, detail="Token signing keys unavailable")
+        if not claims['sub']:
+            raise HTTPException(status_code=401, detail="Invalid token: empty subject")
+        self.tokens.set(token_hash, claims, ttl=min(self.token_ttl, claims['exp'] - time.time()))
+        return claims
+
+
+class Authenticator:
+    def __init__(self, get_db, verifier: Optional[TokenVerifier] = None, required: bool = AUTH_REQUIRED):
+        self.get_db = get_db
+        self.verifier = verifier or TokenVerifier()
+        self.required = required
+        self.roles = cache.LocalCache(maxsize=10_000, ttl=300)
+        cache.subscribe('users', self.roles.invalidate)
+
+    async def role(self, uid: str) -> Optional[str]:
+        role = self.roles.get(uid, _UNKNOWN)
+        if role is _UNKNOWN:
+            user = await self.get_db().users.find_one({'uid': uid}, {'_id': 0, 'role': 1})
+            role = user.get('role') if user else None
+            self.roles.set(uid, role)
+        return role
+
+    async def principal(self, authorization: Optional[str]) -> Optional[Principal]:
+        scheme, _, token = (authorization or '').partition(' ')
+        if scheme.lower() != 'bearer' or not token:
+            if self.required:
+                raise HTTPException(status_code=401, detail="Authentication required",
+                                    headers={'WWW-Authenticate': 'Bearer'})
+            return None
+        claims = await self.verifier.verify(token.strip())
+        return Principal(uid=claims['sub'], email=claims.get('email'), role=await self.role(claims['sub']))
+
+    async def __call__(self, request: Request) -> Optional[Principal]:
+        """FastAPI dependency; the principal is also left on request.state"""
+        principal = await self.principal(request.headers.get('authorization'))
+        request.state.principal = principal
+        return principal
+
+
+def acting_user(principal: Optional[Principal], claimed: Optional[str]) -> Optional[str]:
+    """The user a request acts as: the verified uid, or the claimed one when unauthenticated"""
+    if principal is None:
+        return claimed
+    if claimed and claimed != principal.uid and not principal.is_admin:
+        raise HTTPException(status_code=403, detail="Cannot act on behalf of another user")
+    return claimed or principal.uid
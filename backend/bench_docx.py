@@ -0,0 +1,127 @@
+"""Benchmark DOCX export: fresh docx.Document() per export vs the cached base template.
+
+    python bench_docx.py --runs 20
+
+Prints JSON with setup time (template load and styling), total export
+time and output size for a typical and an annexure-heavy memorandum. The
+base template is parsed once per thread and copied, and style ids are
+resolved once per document (export_docx.StyledDocument).
+"""
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+
+from docx import Document
+from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
+from docx.shared import Inches, Pt, RGBColor
+
+import export_docx
+from im_templates import BUILTIN_TEMPLATES, DEFAULT_TEMPLATE_ID
+
+
+def sample_document(annexure_fields: int, paragraph_words: int):
+    sections = BUILTIN_TEMPLATES[DEFAULT_TEMPLATE_ID].instantiate()
+    text = " ".join(["investment"] * paragraph_words)
+    for section in sections:
+        is_annexure = section['section_id'].startswith('annexure_')
+        fields = annexure_fields if is_annexure else 4
+        section['content'] = {f"field_{i}": f"{text} {i}" for i in range(fields)}
+    return {
+        'title': "Benchmark IM", 'status': "draft", 'sections': sections,
+        'created_at': "2025-01-01T00:00:00", 'updated_at': "2025-01-01T00:00:00",
+    }
+
+
+def legacy_setup():
+    document = Document()
+    style = document.styles['Normal']
+    style.font.name = 'IBM Plex Sans'
+    style.font.size = Pt(11)
+    return document
+
+
+def legacy_generate_docx(doc_data, output_path):
+    """The exporter as it was before the base template: per-run styling on a fresh Document()"""
+    document = legacy_setup()
+    title = document.add_heading('Redwood Partners Investment Memorandum', 0)
+    title.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
+    info = document.add_paragraph()
+    info.add_run(f"Title: {doc_data['title']}\n").bold = True
+    info.add_run(f"Status: {doc_data['status'].upper()}\n")
+    info.add_run(f"Created: {doc_data['created_at']}\n")
+    info.add_run(f"Last Updated: {doc_data['updated_at']}\n")
+    document.add_paragraph()
+    document.add_page_break()
+    document.add_heading('Table of Contents', 1)
+    for section in doc_data['sections']:
+        toc_entry = document.add_paragraph()
+        toc_entry.add_run(f"{section['section_number']}. {section['title']}")
+        toc_entry.paragraph_format.left_indent = Inches(0.25)
+    document.add_page_break()
+    for section in doc_data['sections']:
+        heading = document.add_heading(f"{section['section_number']}. {section['title']}", 1)
+        heading.runs[0].font.color.rgb = RGBColor(6, 78, 59)
+        if section.get('show_instructions', True) and section.get('instructions'):
+            instructions = document.add_paragraph()
+            instructions.add_run('Instructions: ').bold = True
+            instructions.add_run(section['instructions'])
+            instructions.runs[1].font.italic = True
+            instructions.runs[1].font.color.rgb = RGBColor(100, 116, 139)
+        for key, value in section['content'].items():
+            if value:
+                field_para = document.add_paragraph()
+                field_para.add_run(f"{key.replace('_', ' ').title()}: ").bold = True
+                field_para.add_run(str(value))
+        document.add_paragraph()
+    document.save(output_path)
+    return output_path
+
+
+def timed(fn, runs):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return round(statistics.median(samples), 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    export_docx.new_document()  # build and parse once, as a long-lived worker would
+    cases = {
+        'typical': sample_document(annexure_fields=1, paragraph_words=60),
+        'annexure_heavy': sample_document(annexure_fields=40, paragraph_words=120),
+    }
+    report = {
+        'setup_ms': {
+            'legacy': timed(legacy_setup, args.runs),
+            'base_template': timed(export_docx.new_document, args.runs),
+        },
+        'cases': {},
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, doc in cases.items():
+            legacy_path = os.path.join(tmp, f"{name}-legacy.docx")
+            new_path = os.path.join(tmp, f"{name}-template.docx")
+            report['cases'][name] = {
+                'legacy': {
+                    'total_ms': timed(lambda: legacy_generate_docx(doc, legacy_path), args.runs),
+                    'bytes': os.path.getsize(legacy_path),
+                },
+                'base_template': {
+                    'total_ms': timed(lambda: export_docx.generate_docx(doc, new_path), args.runs),
+                    'bytes': os.path.getsize(new_path),
+                },
+            }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
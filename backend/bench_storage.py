@@ -0,0 +1,123 @@
+"""Run the same workload against each storage engine.
+
+    python bench_storage.py --engines memory,sqlite --documents 200 --saves 20
+    python bench_storage.py --engines mongo --mongo-url mongodb://localhost:27017
+
+The workload creates documents for a handful of users, autosaves every
+document --saves times with filled sections, lists each user's documents,
+adds comments and notifications and reads them back. Prints JSON with
+latency percentiles per operation and engine.
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List
+
+from im_templates import BUILTIN_TEMPLATES, DEFAULT_TEMPLATE_ID
+from loadtest import percentile
+from storage import StorageEngine, open_storage
+
+
+def new_document(i: int, owner: str, collaborators: List[str]):
+    now = datetime.utcnow().isoformat()
+    return {
+        'id': str(uuid.uuid4()), 'title': f"Bench IM {i}", 'status': 'draft', 'created_by': owner,
+        'created_at': now, 'updated_at': now, 'version': 1,
+        'sections': BUILTIN_TEMPLATES[DEFAULT_TEMPLATE_ID].instantiate(),
+        'collaborators': [owner, *collaborators],
+    }
+
+
+async def workload(store: StorageEngine, args) -> Dict[str, List[float]]:
+    timings: Dict[str, List[float]] = defaultdict(list)
+
+    async def timed(name, coro):
+        start = time.perf_counter()
+        result = await coro
+        timings[name].append((time.perf_counter() - start) * 1000)
+        return result
+
+    users = [f"bench-user-{i}" for i in range(args.users)]
+    docs = [new_document(i, users[i % len(users)], users[(i + 1) % len(users):][:1]) for i in range(args.documents)]
+    for doc in docs:
+        await timed('insert_document', store.insert_documents([doc]))
+
+    filler = "lorem ipsum dolor sit amet " * (args.content_kb * 40)
+    for tick in range(args.saves):
+        for doc in docs:
+            sections = [{**s, 'content': {'summary': f"{filler} {tick}"}} for s in doc['sections']]
+            await timed('autosave', store.update_document(
+                doc['id'], {'sections': sections, 'updated_at': datetime.utcnow().isoformat()}
+            ))
+
+    for user in users:
+        await timed('list_documents', store.list_documents(user))
+    for doc in docs:
+        await timed('get_document', store.get_document(doc['id']))
+        comment = {'id': str(uuid.uuid4()), 'document_id': doc['id'], 'user_id': doc['created_by'],
+                   'text': "Looks good", 'created_at': datetime.utcnow().isoformat()}
+        await timed('insert_comment', store.insert_comment(comment))
+        await timed('list_comments', store.list_comments(doc['id']))
+        notification = {'id': str(uuid.uuid4()), 'user_id': doc['collaborators'][-1], 'type': 'comment',
+                        'title': 'New Comment', 'message': 'Bench', 'document_id': doc['id'], 'read': False,
+                        'created_at': datetime.utcnow().isoformat()}
+        await timed('insert_notifications', store.insert_notifications([notification]))
+    for user in users:
+        await timed('list_notifications', store.list_notifications(user))
+    return timings
+
+
+def summarize(timings: Dict[str, List[float]]):
+    summary = {}
+    for name, samples in timings.items():
+        samples = sorted(samples)
+        summary[name] = {
+            'count': len(samples),
+            'p50_ms': round(percentile(samples, 50), 3),
+            'p95_ms': round(percentile(samples, 95), 3),
+            'p99_ms': round(percentile(samples, 99), 3),
+            'total_ms': round(sum(samples), 1),
+        }
+    return summary
+
+
+async def run_engine(engine: str, args):
+    get_db = None
+    client = None
+    if engine == 'mongo':
+        from motor.motor_asyncio import AsyncIOMotorClient
+        client = AsyncIOMotorClient(args.mongo_url)
+        db = client[f"bench_storage_{uuid.uuid4().hex[:8]}"]
+        get_db = lambda: db
+    with tempfile.TemporaryDirectory() as tmp:
+        store = open_storage(engine, get_db=get_db, path=os.path.join(tmp, 'bench.sqlite3'))
+        try:
+            return summarize(await workload(store, args))
+        finally:
+            await store.close()
+            if client is not None:
+                await client.drop_database(db.name)
+                client.close()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--engines', default='memory,sqlite')
+    parser.add_argument('--documents', type=int, default=200)
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--saves', type=int, default=10)
+    parser.add_argument('--content-kb', type=int, default=2)
+    parser.add_argument('--mongo-url', default=os.environ.get('MONGO_URL', 'mongodb://localhost:27017'))
+    args = parser.parse_args()
+    results = {engine: await run_engine(engine, args) for engine in args.engines.split(',')}
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
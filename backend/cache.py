@@ -0,0 +1,137 @@
+"""In-process caches and cross-worker invalidation.
+
+Each worker keeps its own ``LocalCache`` instances. Writers call
+``publish(collection, key)`` so the local worker drops stale entries
+straight away; ``watch_invalidations`` tails a MongoDB change stream so
+every other worker sees the same invalidations. Only collections with
+subscribers are watched. Change streams need a replica set (see replset.py
+for a local one). gunicorn.conf.py lists the per-worker state these
+invalidations do not cover.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger(__name__)
+
+CHANGE_STREAMS_ENABLED = os.environ.get('CACHE_CHANGE_STREAMS', '0') == '1'
+
+
+def default_workers() -> int:
+    """WEB_CONCURRENCY, else one worker per CPU with change streams and a single worker without"""
+    workers = int(os.environ.get('WEB_CONCURRENCY') or (os.cpu_count() or 1 if CHANGE_STREAMS_ENABLED else 1))
+    if workers > 1 and not CHANGE_STREAMS_ENABLED:
+        raise RuntimeError(
+            f"WEB_CONCURRENCY={workers} needs CACHE_CHANGE_STREAMS=1; without it each worker's caches go stale"
+        )
+    return workers
+
+# Field that identifies a record in each collection that can be subscribed to
+KEY_FIELDS = {
+    'users': 'uid',
+    'templates': 'template_id',
+    'document_members': 'user_id',
+}
+
+_MISSING = object()
+
+
+class LocalCache:
+    """LRU cache with a per-entry TTL"""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key, _MISSING)
+        if entry is _MISSING or entry[0] < time.monotonic():
+            if entry is not _MISSING:
+                del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key: Optional[Hashable] = None):
+        """Drop one key, or everything when key is None"""
+        if key is None:
+            self._data.clear()
+        else:
+            self._data.pop(key, None)
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> Dict[str, int]:
+        return {'size': len(self._data), 'hits': self.hits, 'misses': self.misses}
+
+
+_subscribers: Dict[str, List[Callable[[Optional[str]], None]]] = {}
+
+
+def subscribe(collection: str, callback: Callable[[Optional[str]], None]):
+    """Call callback(key) whenever a record in collection changes (key None = unknown)"""
+    if collection not in KEY_FIELDS:
+        # Other workers would never hear about changes to it
+        raise ValueError(f"{collection!r} is not watched for invalidations; add it to KEY_FIELDS")
+    _subscribers.setdefault(collection, []).append(callback)
+
+
+def publish(collection: str, key: Optional[str] = None):
+    for callback in _subscribers.get(collection, ()):
+        try:
+            callback(key)
+        except Exception:
+            logger.exception("Cache invalidation for %s failed", collection)
+
+
+async def watch_invalidations(db, collections: Optional[Dict[str, str]] = None):
+    """Publish invalidations for changes made by any worker; runs until cancelled"""
+    if collections is None:
+        # updateLookup costs a read per change, so only watch what someone listens to
+        collections = {coll: KEY_FIELDS[coll] for coll in _subscribers}
+    if not collections:
+        return
+    projection = {'ns.coll': 1, 'operationType': 1}
+    projection.update({f"fullDocument.{field}": 1 for field in set(collections.values())})
+    pipeline = [
+        {'$match': {'ns.coll': {'$in': list(collections)}}},
+        {'$project': projection},
+    ]
+    resume_token = None
+    delay = 1.0
+    while True:
+        try:
+            async with db.watch(pipeline, full_document='updateLookup', resume_after=resume_token) as stream:
+                delay = 1.0
+                async for change in stream:
+                    resume_token = stream.resume_token
+                    coll = change['ns']['coll']
+                    full = change.get('fullDocument') or {}
+                    # Deletes carry no full document, so the whole collection is dropped
+                    publish(coll, full.get(collections[coll]))
+        except asyncio.CancelledError:
+            raise
+        except PyMongoError as e:
+            logger.warning("Change stream interrupted (%s); retrying in %.0fs", e, delay)
+            # Anything may have changed while we were not listening
+            for coll in collections:
+                publish(coll, None)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30.0)
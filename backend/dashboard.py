@@ -0,0 +1,83 @@
+"""Per-user dashboard summary.
+
+One aggregation over the user's live documents, split with ``$facet`` into
+status counts, the most recently updated documents, documents other people
+have put in review, and overall section completion. A section counts as
+complete once its content has any field. Summaries are cached per user and
+invalidated whenever that user's ``document_members`` records change, and
+after every save of a document the user collaborates on (saves move it in
+``recent`` and change its completion without touching ``document_members``;
+other workers see those within DASHBOARD_CACHE_TTL).
+"""
+import os
+from datetime import datetime
+from typing import Any, Dict, Iterable
+
+import cache
+
+DASHBOARD_CACHE_TTL = float(os.environ.get('DASHBOARD_CACHE_TTL', '30'))
+DASHBOARD_RECENT = int(os.environ.get('DASHBOARD_RECENT', '5'))
+
+summaries = cache.LocalCache(maxsize=4096, ttl=DASHBOARD_CACHE_TTL)
+cache.subscribe('document_members', summaries.invalidate)
+
+
+def invalidate(user_ids: Iterable[str]):
+    """Drop the cached summaries of the collaborators of a document that was saved"""
+    for user_id in user_ids:
+        summaries.invalidate(user_id)
+
+_sections = {'$ifNull': ['$sections', []]}
+_filled = {'$size': {'$filter': {
+    'input': _sections,
+    'as': 's',
+    'cond': {'$gt': [{'$size': {'$objectToArray': {'$ifNull': ['$$s.content', {}]}}}, 0]},
+}}}
+# Fraction of sections with content; null for documents without sections (e.g. archive stubs)
+COMPLETION = {'$cond': [{'$gt': [{'$size': _sections}, 0]}, {'$divide': [_filled, {'$size': _sections}]}, None]}
+LISTED = {'_id': 0, 'id': 1, 'title': 1, 'status': 1, 'updated_at': 1, 'created_by': 1, 'completion': COMPLETION}
+
+
+def pipeline(user_id: str, recent: int = DASHBOARD_RECENT):
+    return [
+        {'$match': {'collaborators': user_id, 'deleted_at': {'$exists': False}}},
+        {'$facet': {
+            'counts': [{'$group': {'_id': '$status', 'count': {'$sum': 1}}}],
+            'recent': [{'$sort': {'updated_at': -1}}, {'$limit': recent}, {'$project': LISTED}],
+            'needs_review': [
+                {'$match': {'status': 'in_review', 'created_by': {'$ne': user_id}}},
+                {'$sort': {'updated_at': -1}},
+                {'$limit': recent},
+                {'$project': LISTED},
+            ],
+            'completion': [
+                {'$project': {'completion': COMPLETION}},
+                {'$group': {
+                    '_id': None,
+                    'average': {'$avg': '$completion'},
+                    'complete': {'$sum': {'$cond': [{'$eq': ['$completion', 1]}, 1, 0]}},
+                }},
+            ],
+        }},
+    ]
+
+
+async def summary(db, user_id: str) -> Dict[str, Any]:
+    cached = summaries.get(user_id)
+    if cached is not None:
+        return cached
+    facets = (await db.documents.aggregate(pipeline(user_id)).to_list(None))[0]
+    counts = {row['_id']: row['count'] for row in facets['counts'] if row['_id']}
+    completion = facets['completion'][0] if facets['completion'] else {}
+    result = {
+        'user_id': user_id,
+        'total': sum(counts.values()),
+        'counts': counts,
+        'recent': facets['recent'],
+        'needs_review': facets['needs_review'],
+        'average_completion': completion.get('average'),
+        'complete_documents': completion.get('complete', 0),
+        'generated_at': datetime.utcnow(),
+    }
+    summaries.set(user_id, result)
+    return result
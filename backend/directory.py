@@ -0,0 +1,153 @@
+"""In-memory user directory for mention lookup and user search.
+
+The directory loads every user once (uid, email, display name, avatar) and
+keeps two sorted arrays of ``(key, uid)`` pairs: lowercased emails, and each
+word of the lowercased display name. A prefix query is a bisect plus a short
+forward scan. Changes arrive through the ``users`` invalidation bus (and the
+change stream when enabled): a uid marks just that user dirty and it is
+re-read on the next lookup; a full reload happens on unknown changes or
+every DIRECTORY_REFRESH_SECONDS.
+"""
+import asyncio
+import os
+import time
+from bisect import bisect_left, insort
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+DIRECTORY_REFRESH_SECONDS = float(os.environ.get('DIRECTORY_REFRESH_SECONDS', '600'))
+PROJECTION = {'_id': 0, 'uid': 1, 'email': 1, 'display_name': 1, 'avatar_url': 1}
+
+
+def name_keys(entry: Dict[str, Any]) -> Set[str]:
+    name = (entry.get('display_name') or '').lower()
+    keys = set(name.split())
+    if name:
+        keys.add(name)
+    return keys
+
+
+class UserDirectory:
+    def __init__(self, get_db, refresh_interval: float = DIRECTORY_REFRESH_SECONDS):
+        self.get_db = get_db
+        self.refresh_interval = refresh_interval
+        self.users: Dict[str, Dict[str, Any]] = {}
+        self.by_email: Dict[str, str] = {}
+        self._emails: List[Tuple[str, str]] = []
+        self._names: List[Tuple[str, str]] = []
+        self._dirty: Set[str] = set()
+        self._loaded_at: Optional[float] = None
+        self._lock = asyncio.Lock()
+
+    def invalidate(self, uid: Optional[str] = None):
+        if uid is None:
+            self._loaded_at = None
+        else:
+            self._dirty.add(uid)
+
+    async def _ensure_fresh(self):
+        stale = self._loaded_at is None or time.monotonic() - self._loaded_at > self.refresh_interval
+        if not stale and not self._dirty:
+            return
+        async with self._lock:
+            if self._loaded_at is None or time.monotonic() - self._loaded_at > self.refresh_interval:
+                self._dirty.clear()
+                await self._load()
+            elif self._dirty:
+                uids, self._dirty = self._dirty, set()
+                await self._reload(uids)
+
+    async def _load(self):
+        users = await self.get_db().users.find({}, PROJECTION).to_list(None)
+        self.users = {u['uid']: u for u in users}
+        self.by_email = {u['email'].lower(): u['uid'] for u in users if u.get('email')}
+        self._emails = sorted((email, uid) for email, uid in self.by_email.items())
+        self._names = sorted((key, u['uid']) for u in users for key in name_keys(u))
+        self._loaded_at = time.monotonic()
+
+    async def _reload(self, uids: Set[str]):
+        fresh = await self.get_db().users.find({'uid': {'$in': list(uids)}}, PROJECTION).to_list(None)
+        for uid in uids:
+            self._remove(uid)
+        for user in fresh:
+            self._add(user)
+
+    def _remove(self, uid: str):
+        old = self.users.pop(uid, None)
+        if not old:
+            return
+        email = (old.get('email') or '').lower()
+        if email and self.by_email.get(email) == uid:
+            del self.by_email[email]
+            self._discard(self._emails, (email, uid))
+        for key in name_keys(old):
+            self._discard(self._names, (key, uid))
+
+    def _add(self, user: Dict[str, Any]):
+        uid = user['uid']
+        self.users[uid] = user
+        email = (user.get('email') or '').lower()
+        if email:
+            previous = self.by_email.get(email)
+            if previous is not None:
+                self._discard(self._emails, (email, previous))
+            self.by_email[email] = uid
+            insort(self._emails, (email, uid))
+        for key in name_keys(user):
+            insort(self._names, (key, uid))
+
+    @staticmethod
+    def _discard(index: List[Tuple[str, str]], item: Tuple[str, str]):
+        i = bisect_left(index, item)
+        if i < len(index) and index[i] == item:
+            del index[i]
+
+    @staticmethod
+    def _prefix(index: List[Tuple[str, str]], prefix: str, limit: int) -> List[Tuple[str, str]]:
+        matches = []
+        for i in range(bisect_left(index, (prefix, '')), len(index)):
+            key, uid = index[i]
+            if not key.startswith(prefix) or len(matches) >= limit:
+                break
+            matches.append((key, uid))
+        return matches
+
+    async def search(self, query: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """Users whose email or any word of their display name starts with query"""
+        query = query.strip().lower()
+        if not query:
+            return []
+        await self._ensure_fresh()
+        # Take a few extra per index so the merge can rank exact matches first
+        candidates = self._prefix(self._emails, query, limit * 2) + self._prefix(self._names, query, limit * 2)
+        candidates.sort(key=lambda m: (m[0] != query, len(m[0]), m[0]))
+        results, seen = [], set()
+        for _, uid in candidates:
+            if uid not in seen and uid in self.users:
+                seen.add(uid)
+                results.append(self.users[uid])
+                if len(results) == limit:
+                    break
+        return results
+
+    async def resolve(self, emails: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """Map each known email (case-insensitive) to its user; unknown emails are left out"""
+        await self._ensure_fresh()
+        resolved = {}
+        for email in emails:
+            uid = self.by_email.get(email.strip().lower())
+            if uid is not None:
+                resolved[email] = self.users[uid]
+        return resolved
+
+    async def display_names(self, uids: Iterable[str]) -> Dict[str, str]:
+        """Map each known uid to its display name (else its email); unknown uids are left out"""
+        await self._ensure_fresh()
+        names = {}
+        for uid in uids:
+            user = self.users.get(uid)
+            if user and (user.get('display_name') or user.get('email')):
+                names[uid] = user.get('display_name') or user['email']
+        return names
+
+    def stats(self) -> Dict[str, int]:
+        return {'users': len(self.users), 'email_keys': len(self._emails), 'name_keys': len(self._names)}
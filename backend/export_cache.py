@@ -0,0 +1,224 @@
+"""On-disk cache of rendered exports, plus background pre-rendering.
+
+Artifacts are stored per document under EXPORT_CACHE_DIR and keyed by the
+document's ``updated_at``, so any edit makes the old artifact unreachable.
+When a document enters one of PRERENDER_STATUSES the configured formats
+are rendered in the background so the first download is served from disk.
+Bundles (the PDF zipped with the document's attachments) are cached the
+same way, and redlines (see redline.py) go under ``redline/`` keyed by the
+two versions they compare. A cached artifact never changes once written, so it is served
+under a strong ETag (the sha256 of its bytes) and marked immutable.
+
+Publishing a new revision removes the older ones of the same format, except
+those written or linked within the last DOWNLOAD_URL_TTL seconds (issuing a
+signed link bumps the file's mtime through ``mark_linked``). Those stay until
+a later publish or purge finds them past that age, so a link outlives the
+next edit.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import shutil
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from fastapi.concurrency import run_in_threadpool
+
+import cache
+from profiling import profiled
+from signed_urls import DOWNLOAD_URL_TTL
+from export_docx import generate_docx, generate_redline_docx
+from export_pdf import generate_pdf, generate_redline_pdf
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = Path(os.environ.get('EXPORT_CACHE_DIR', '/tmp/exports/cache'))
+PRERENDER_FORMATS = [f for f in os.environ.get('PRERENDER_FORMATS', 'pdf').split(',') if f]
+PRERENDER_STATUSES = set(os.environ.get('PRERENDER_STATUSES', 'in_review,approved').split(','))
+PRERENDER_DELAY = float(os.environ.get('PRERENDER_DELAY', '5'))
+
+RENDERERS = {
+    'pdf': generate_pdf,
+    'docx': generate_docx,
+}
+REDLINE_RENDERERS = {
+    'pdf': generate_redline_pdf,
+    'docx': generate_redline_docx,
+}
+MEDIA_TYPES = {
+    'pdf': "application/pdf",
+    'docx': "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    'zip': "application/zip",
+}
+
+
+ARTIFACT_NAME = re.compile(r'[0-9a-f]{16}\.(pdf|docx|zip)')
+HASH_CHUNK_BYTES = 1024 * 1024
+
+_digests = cache.LocalCache(maxsize=4096, ttl=24 * 3600)
+
+
+def revision_key(doc: Dict[str, Any]) -> str:
+    return hashlib.sha256(f"{doc['id']}:{doc['updated_at']}".encode()).hexdigest()[:16]
+
+
+def artifact_path(doc: Dict[str, Any], fmt: str) -> Path:
+    return CACHE_DIR / doc['id'] / f"{revision_key(doc)}.{fmt}"
+
+
+def lookup(doc: Dict[str, Any], fmt: str) -> Optional[Path]:
+    path = artifact_path(doc, fmt)
+    return path if path.is_file() else None
+
+
+def redline_path(doc_id: str, base_id: str, target_key: str, fmt: str) -> Path:
+    key = hashlib.sha256(f"{base_id}:{target_key}".encode()).hexdigest()[:16]
+    return CACHE_DIR / doc_id / 'redline' / f"{key}.{fmt}"
+
+
+def find_artifact(doc_id: str, name: str) -> Optional[Path]:
+    """A cached artifact by the file name a download URL carries, if it is still on disk"""
+    if not ARTIFACT_NAME.fullmatch(name) or '/' in doc_id or doc_id in ('.', '..'):
+        return None
+    path = CACHE_DIR / doc_id / name
+    return path if path.is_file() else None
+
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as handle:
+        while chunk := handle.read(HASH_CHUNK_BYTES):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+async def content_etag(path: Path) -> str:
+    """Strong ETag from the artifact's bytes, hashed once per file"""
+    stat = path.stat()
+    key = (str(path), stat.st_mtime_ns, stat.st_size)
+    digest = _digests.get(key)
+    if digest is None:
+        digest = await run_in_threadpool(_sha256, path)
+        _digests.set(key, digest)
+    return f'"{digest}"'
+
+
+def _staging_path(path: Path, fmt: str) -> Path:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return path.with_name(f".{uuid.uuid4().hex}.{fmt}")
+
+
+def mark_linked(path: Path):
+    """Record that a download link for path was just issued, so _publish keeps it until the link expires"""
+    os.utime(path)
+
+
+def _publish(tmp: Path, path: Path, fmt: str) -> Path:
+    """Move a finished artifact into place and drop older revisions of the same format with no live links"""
+    os.replace(tmp, path)
+    linked_since = time.time() - DOWNLOAD_URL_TTL
+    for old in path.parent.glob(f"*.{fmt}"):
+        if old != path and not old.name.startswith('.'):
+            try:
+                if old.stat().st_mtime < linked_since:
+                    old.unlink()
+            except FileNotFoundError:
+                pass
+    return path
+
+
+def render(doc: Dict[str, Any], fmt: str, **kwargs) -> Path:
+    """Render into the cache (blocking) and drop older revisions of the same format"""
+    path = artifact_path(doc, fmt)
+    tmp = _staging_path(path, fmt)
+    try:
+        RENDERERS[fmt](doc, str(tmp), **kwargs)
+        return _publish(tmp, path, fmt)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+def render_redline(redline: Dict[str, Any], path: Path) -> Path:
+    """Render a computed redline to its redline_path (blocking), replacing older redlines of the format"""
+    fmt = path.suffix[1:]
+    tmp = _staging_path(path, fmt)
+    try:
+        REDLINE_RENDERERS[fmt](redline, str(tmp))
+        return _publish(tmp, path, fmt)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+async def render_bundle(doc: Dict[str, Any], write_bundle) -> Path:
+    """Zip the (cached) PDF with the document's attachments; write_bundle streams the attachments in"""
+    pdf = lookup(doc, 'pdf') or await run_in_threadpool(profiled(render), doc, 'pdf')
+    path = artifact_path(doc, 'zip')
+    tmp = _staging_path(path, 'zip')
+    try:
+        await write_bundle(doc, pdf, f"{doc['title']}.pdf", tmp)
+        return await run_in_threadpool(_publish, tmp, path, 'zip')
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+def purge(doc_id: str) -> int:
+    """Remove every cached artifact of a document; returns the number removed"""
+    directory = CACHE_DIR / doc_id
+    if not directory.is_dir():
+        return 0
+    removed = sum(1 for path in directory.rglob('*') if path.is_file())
+    shutil.rmtree(directory, ignore_errors=True)
+    return removed
+
+
+class PrerenderScheduler:
+    """Debounced per-document background rendering"""
+
+    def __init__(self, delay: float = PRERENDER_DELAY):
+        self.delay = delay
+        self._pending: Dict[str, asyncio.Task] = {}
+        self.rendered = 0
+        self.superseded = 0
+
+    def schedule(self, doc_id: str, load: Callable[[], Awaitable[Optional[Dict[str, Any]]]], formats=None):
+        """(Re)start the countdown for doc_id; quick successive transitions render once"""
+        existing = self._pending.get(doc_id)
+        if existing and not existing.done():
+            existing.cancel()
+            self.superseded += 1
+        self._pending[doc_id] = asyncio.create_task(self._run(doc_id, load, formats or PRERENDER_FORMATS))
+
+    async def _run(self, doc_id, load, formats):
+        try:
+            await asyncio.sleep(self.delay)
+            doc = await load()
+            if not doc:
+                return
+            for fmt in formats:
+                if fmt in RENDERERS and not lookup(doc, fmt):
+                    await run_in_threadpool(render, doc, fmt)
+                    self.rendered += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Pre-rendering %s failed", doc_id)
+        finally:
+            if self._pending.get(doc_id) is asyncio.current_task():
+                del self._pending[doc_id]
+
+    async def shutdown(self):
+        tasks = list(self._pending.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._pending.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {'pending': len(self._pending), 'rendered': self.rendered, 'superseded': self.superseded}
+
+
+prerender = PrerenderScheduler()
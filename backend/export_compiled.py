@@ -0,0 +1,193 @@
+"""Compiled HTML/TXT export.
+
+The page templates are compiled once at import. ``iter_html`` and
+``iter_txt`` yield the output section by section, so the caller can hand
+them straight to a StreamingResponse. Section content is rendered as
+labelled fields, and lists of records become tables. Section attachments
+(see attachments.py) are listed by name, type and size, with a download link
+in HTML; the files themselves are not embedded.
+"""
+from html import escape
+from string import Template
+from typing import Any, Dict, Iterator, List
+
+HTML_HEAD = Template("""<!DOCTYPE html>
+<html>
+<head>
+<meta charset="UTF-8">
+<title>$title</title>
+<style>
+body { font-family: Arial, sans-serif; max-width: 800px; margin: 0 auto; padding: 20px; color: #1E293B; }
+h1 { color: #064E3B; }
+h2 { border-bottom: 1px solid #ccc; padding-bottom: 8px; }
+section { margin-bottom: 32px; }
+dt { font-weight: bold; margin-top: 8px; }
+dd { margin-left: 16px; }
+table { border-collapse: collapse; width: 100%; margin: 8px 0; }
+th, td { border: 1px solid #ccc; padding: 4px 8px; text-align: left; vertical-align: top; }
+th { background: #F1F5F9; }
+.empty { color: #64748B; font-style: italic; }
+</style>
+</head>
+<body>
+<h1>$title</h1>
+<p>Status: $status</p>
+<p>Created: $created_at</p>
+""")
+HTML_SECTION = Template('<section id="$section_id">\n<h2>$number. $title</h2>\n')
+HTML_SECTION_END = "</section>\n"
+HTML_TAIL = "</body>\n</html>\n"
+EMPTY_HTML = '<p class="empty">[Content to be added]</p>\n'
+
+TXT_HEAD = Template("""REDWOOD INVESTMENT MEMORANDUM
+$rule
+Title: $title
+Status: $status
+Created: $created_at
+
+$rule
+""")
+TXT_SECTION = Template("\n$number. $title\n$rule\n")
+EMPTY_TXT = "[Content to be added]\n"
+RULE = "=" * 60
+
+
+def label(key: str) -> str:
+    return key.replace('_', ' ').title()
+
+
+def format_size(length: int) -> str:
+    size = float(length)
+    for unit in ("bytes", "KB", "MB"):
+        if size < 1024 or unit == "MB":
+            return f"{int(size)} {unit}" if unit == "bytes" else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def describe_attachment(attachment: Dict[str, Any]) -> str:
+    """Filename, type and size, as every export format lists an attachment"""
+    return f"{attachment['filename']} ({attachment['content_type']}, {format_size(attachment['length'])})"
+
+
+def _is_table(value: Any) -> bool:
+    return isinstance(value, list) and bool(value) and all(isinstance(row, dict) for row in value)
+
+
+def _columns(rows: List[Dict[str, Any]]) -> List[str]:
+    columns: Dict[str, None] = {}
+    for row in rows:
+        columns.update(dict.fromkeys(row))
+    return list(columns)
+
+
+def _scalar(value: Any) -> str:
+    if isinstance(value, bool):
+        return "Yes" if value else "No"
+    return str(value)
+
+
+def _html_value(value: Any) -> str:
+    if isinstance(value, dict):
+        return _html_fields(value)
+    if _is_table(value):
+        columns = _columns(value)
+        head = "".join(f"<th>{escape(label(c))}</th>" for c in columns)
+        body = "".join(
+            "<tr>" + "".join(f"<td>{_html_value(row.get(c, ''))}</td>" for c in columns) + "</tr>"
+            for row in value
+        )
+        return f"<table><thead><tr>{head}</tr></thead><tbody>{body}</tbody></table>"
+    if isinstance(value, list):
+        return "<ul>" + "".join(f"<li>{_html_value(item)}</li>" for item in value) + "</ul>"
+    return escape(_scalar(value)).replace("\n", "<br>")
+
+
+def _html_fields(content: Dict[str, Any]) -> str:
+    items = "".join(
+        f"<dt>{escape(label(key))}</dt><dd>{_html_value(value)}</dd>"
+        for key, value in content.items() if value not in (None, "", [], {})
+    )
+    return f"<dl>{items}</dl>\n" if items else ""
+
+
+CHANGE_LABELS = {'added': 'New section', 'removed': 'Section removed', 'changed': 'Changed'}
+
+
+def version_label(version: Dict[str, Any]) -> str:
+    """How a redline names one side of the comparison (see redline.py)"""
+    if version.get('revision_id') is None:
+        return f"current version ({version.get('created_at')})"
+    return f"{str(version.get('reason') or 'revision').replace('_', ' ')} snapshot of {version.get('created_at')}"
+
+
+def _html_attachments(attachments) -> str:
+    if not attachments:
+        return ""
+    items = "".join(
+        f'<li><a href="/api/attachments/{escape(str(a["id"]))}">{escape(describe_attachment(a))}</a></li>'
+        for a in attachments
+    )
+    return f"<h3>Attachments</h3>\n<ul>{items}</ul>\n"
+
+
+def iter_html(doc_data: Dict[str, Any]) -> Iterator[str]:
+    yield HTML_HEAD.substitute(
+        title=escape(str(doc_data['title'])),
+        status=escape(str(doc_data['status'])),
+        created_at=escape(str(doc_data['created_at'])),
+    )
+    for section in doc_data.get('sections', []):
+        body = _html_fields(section.get('content') or {})
+        yield HTML_SECTION.substitute(
+            section_id=escape(str(section['section_id'])),
+            number=escape(str(section['section_number'])),
+            title=escape(str(section['title'])),
+        ) + (body or EMPTY_HTML) + _html_attachments(section.get('attachments')) + HTML_SECTION_END
+    yield HTML_TAIL
+
+
+def _txt_table(rows: List[Dict[str, Any]], indent: str) -> List[str]:
+    columns = _columns(rows)
+    cells = [[label(c) for c in columns]] + [[_scalar(row.get(c, '')).replace("\n", " ") for c in columns] for row in rows]
+    widths = [max(len(r[i]) for r in cells) for i in range(len(columns))]
+    lines = [indent + " | ".join(cell.ljust(w) for cell, w in zip(r, widths)).rstrip() for r in cells]
+    lines.insert(1, indent + "-+-".join("-" * w for w in widths))
+    return lines
+
+
+def _txt_fields(content: Dict[str, Any], indent: str = "") -> List[str]:
+    lines = []
+    for key, value in content.items():
+        if value in (None, "", [], {}):
+            continue
+        if isinstance(value, dict):
+            lines.append(f"{indent}{label(key)}:")
+            lines += _txt_fields(value, indent + "  ")
+        elif _is_table(value):
+            lines.append(f"{indent}{label(key)}:")
+            lines += _txt_table(value, indent + "  ")
+        elif isinstance(value, list):
+            lines.append(f"{indent}{label(key)}:")
+            lines += [f"{indent}  - {_scalar(item)}" for item in value]
+        else:
+            text = _scalar(value).replace("\n", "\n" + indent + "  ")
+            lines.append(f"{indent}{label(key)}: {text}")
+    return lines
+
+
+def iter_txt(doc_data: Dict[str, Any]) -> Iterator[str]:
+    yield TXT_HEAD.substitute(
+        rule=RULE,
+        title=doc_data['title'],
+        status=doc_data['status'],
+        created_at=doc_data['created_at'],
+    )
+    for section in doc_data.get('sections', []):
+        lines = _txt_fields(section.get('content') or {})
+        attachments = [f"  - {describe_attachment(a)}" for a in section.get('attachments') or []]
+        yield TXT_SECTION.substitute(
+            number=section['section_number'],
+            title=section['title'],
+            rule="-" * 60,
+        ) + ("\n".join(lines) + "\n" if lines else EMPTY_TXT) + (
+            "Attachments:\n" + "\n".join(attachments) + "\n" if attachments else "")
@@ -1,70 +1,229 @@
 from docx import Document
+from docx.enum.style import WD_STYLE_TYPE
 from docx.shared import Inches, Pt, RGBColor
 from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
-from typing import Dict, Any, List
-import json
+from typing import Dict, Any, List, Optional
+from io import BytesIO
+import copy
+import os
+import threading
+
+from export_compiled import CHANGE_LABELS, describe_attachment, version_label
+
+REDWOOD_GREEN = RGBColor(6, 78, 59)
+MUTED = RGBColor(100, 116, 139)
+DELETED = RGBColor(185, 28, 28)
+INSERTED = RGBColor(4, 120, 87)
+
+# Optional house-style .docx; styles missing from it are added on load
+TEMPLATE_PATH = os.environ.get('DOCX_TEMPLATE_PATH')
+
+_base_template: Optional[bytes] = None
+_base_lock = threading.Lock()
+# Parsed copies of the base template, one per export thread (lxml trees are not shared across threads)
+_parsed = threading.local()
+
+
+def _apply_house_style(document):
+    """Define every style generate_docx uses, so exports never restyle runs"""
+    styles = document.styles
+    names = {s.name for s in styles}
+
+    normal = styles['Normal']
+    normal.font.name = 'IBM Plex Sans'
+    normal.font.size = Pt(11)
+
+    styles['Title'].font.color.rgb = REDWOOD_GREEN
+    styles['Heading 1'].font.color.rgb = REDWOOD_GREEN
+
+    if 'IM Instructions' not in names:
+        inst = styles.add_style('IM Instructions', WD_STYLE_TYPE.PARAGRAPH)
+        inst.base_style = normal
+        inst.font.italic = True
+        inst.font.color.rgb = MUTED
+
+    if 'IM Label' not in names:
+        label = styles.add_style('IM Label', WD_STYLE_TYPE.CHARACTER)
+        label.font.bold = True
+        label.font.italic = False
+
+    if 'IM TOC Entry' not in names:
+        toc = styles.add_style('IM TOC Entry', WD_STYLE_TYPE.PARAGRAPH)
+        toc.base_style = normal
+        toc.paragraph_format.left_indent = Inches(0.25)
+        toc.paragraph_format.space_after = Pt(2)
+
+    if 'IM Deleted' not in names:
+        deleted = styles.add_style('IM Deleted', WD_STYLE_TYPE.CHARACTER)
+        deleted.font.strike = True
+        deleted.font.color.rgb = DELETED
+
+    if 'IM Inserted' not in names:
+        inserted = styles.add_style('IM Inserted', WD_STYLE_TYPE.CHARACTER)
+        inserted.font.underline = True
+        inserted.font.color.rgb = INSERTED
+
+    if 'IM Attachment' not in names:
+        attachment = styles.add_style('IM Attachment', WD_STYLE_TYPE.PARAGRAPH)
+        attachment.base_style = normal
+        attachment.paragraph_format.left_indent = Inches(0.25)
+        attachment.paragraph_format.space_after = Pt(2)
+
+
+def build_base_template(path: Optional[str] = TEMPLATE_PATH) -> bytes:
+    document = Document(path) if path else Document()
+    _apply_house_style(document)
+    buffer = BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+
+def base_template() -> bytes:
+    """House-style template as .docx bytes, built once per process"""
+    global _base_template
+    if _base_template is None:
+        with _base_lock:
+            if _base_template is None:
+                _base_template = build_base_template()
+    return _base_template
+
+
+def new_document():
+    """A fresh document on the house style: a deep copy of this thread's parsed base template"""
+    prototype = getattr(_parsed, 'document', None)
+    if prototype is None:
+        prototype = _parsed.document = Document(BytesIO(base_template()))
+    return copy.deepcopy(prototype)
+
+
+class StyledDocument:
+    """Adds paragraphs and runs by style name, resolving each style id once per document.
+
+    python-docx looks a style name up in styles.xml (and compares it with the
+    type's default style) for every styled paragraph and run; on exports with
+    many fields that lookup dominated the render.
+    """
+
+    def __init__(self, document):
+        self.document = document
+        self._style_ids: Dict[str, Optional[str]] = {}
+
+    def style_id(self, name: str) -> Optional[str]:
+        if name not in self._style_ids:
+            styles = self.document.styles
+            style = styles[name]
+            self._style_ids[name] = styles.get_style_id(style, style.type)
+        return self._style_ids[name]
+
+    def heading(self, text: str, level: int):
+        return self.paragraph(text, 'Title' if level == 0 else f'Heading {level}')
+
+    def paragraph(self, text: str = '', style: Optional[str] = None):
+        paragraph = self.document.add_paragraph(text)
+        if style:
+            paragraph._p.style = self.style_id(style)
+        return paragraph
+
+    def run(self, paragraph, text: str, style: Optional[str] = None):
+        run = paragraph.add_run(text)
+        if style:
+            run._r.style = self.style_id(style)
+        return run
+
 
 def generate_docx(doc_data: Dict[str, Any], output_path: str):
     """Generate a formatted Word document from IM data"""
-    document = Document()
-    
-    # Set document styles
-    style = document.styles['Normal']
-    font = style.font
-    font.name = 'IBM Plex Sans'
-    font.size = Pt(11)
-    
+    document = new_document()
+    doc = StyledDocument(document)
+
     # Title
-    title = document.add_heading('Redwood Partners Investment Memorandum', 0)
+    title = doc.heading('Redwood Partners Investment Memorandum', 0)
     title.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
-    
+
     # Document metadata
-    info = document.add_paragraph()
-    info.add_run(f"Title: {doc_data['title']}\n").bold = True
+    info = doc.paragraph()
+    doc.run(info, f"Title: {doc_data['title']}\n", 'IM Label')
     info.add_run(f"Status: {doc_data['status'].upper()}\n")
     info.add_run(f"Created: {doc_data['created_at']}\n")
     info.add_run(f"Last Updated: {doc_data['updated_at']}\n")
-    
-    document.add_paragraph()  # Spacing
+
+    doc.paragraph()  # Spacing
     document.add_page_break()
-    
+
     # Table of Contents
-    toc_heading = document.add_heading('Table of Contents', 1)
+    doc.heading('Table of Contents', 1)
     for section in doc_data.get('sections', []):
-        if not section.get('show_instructions', True):  # Skip instructions if hidden
-            toc_entry = document.add_paragraph()
-            toc_entry.add_run(f"{section['section_number']}. {section['title']}")
-            toc_entry.paragraph_format.left_indent = Inches(0.25)
-    
+        doc.paragraph(f"{section['section_number']}. {section['title']}", 'IM TOC Entry')
+
     document.add_page_break()
-    
+
     # Sections
     for section in doc_data.get('sections', []):
-        # Section heading
-        heading = document.add_heading(f"{section['section_number']}. {section['title']}", 1)
-        heading.runs[0].font.color.rgb = RGBColor(6, 78, 59)  # Redwood green
-        
+        doc.heading(f"{section['section_number']}. {section['title']}", 1)
+
         # Only show instructions if enabled
         if section.get('show_instructions', True) and section.get('instructions'):
-            instructions = document.add_paragraph()
-            instructions.add_run('Instructions: ').bold = True
-            instructions.add_run(section['instructions'])
-            instructions.runs[1].font.italic = True
-            instructions.runs[1].font.color.rgb = RGBColor(100, 116, 139)  # Muted
-        
+            instructions = doc.paragraph(style='IM Instructions')
+            doc.run(instructions, 'Instructions: ', 'IM Label')
+            instructions.add_run(str(section['instructions']))
+
         # Section content
         content = section.get('content', {})
         if content:
             for key, value in content.items():
                 if value:
-                    field_para = document.add_paragraph()
-                    field_para.add_run(f"{key.replace('_', ' ').title()}: ").bold = True
+                    field_para = doc.paragraph()
+                    doc.run(field_para, f"{key.replace('_', ' ').title()}: ", 'IM Label')
                     field_para.add_run(str(value))
         else:
-            document.add_paragraph('[Content to be added]')
-        
-        document.add_paragraph()  # Spacing between sections
-    
+            doc.paragraph('[Content to be added]')
+
+        # Attachments are listed, not embedded
+        if section.get('attachments'):
+            listing = doc.paragraph()
+            doc.run(listing, 'Attachments:', 'IM Label')
+            for attachment in section['attachments']:
+                doc.paragraph(f"\u2022 {describe_attachment(attachment)}", 'IM Attachment')
+
+        doc.paragraph()  # Spacing between sections
+
     # Save document
     document.save(output_path)
     return output_path
+
+
+REDLINE_STYLES = {'equal': None, 'delete': 'IM Deleted', 'insert': 'IM Inserted'}
+
+
+def generate_redline_docx(redline: Dict[str, Any], output_path: str):
+    """Word redline with only the changed sections (see redline.py for the diff)"""
+    document = new_document()
+    doc = StyledDocument(document)
+
+    title = doc.heading('Investment Memorandum Redline', 0)
+    title.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
+
+    info = doc.paragraph()
+    doc.run(info, f"Title: {redline['title']}\n", 'IM Label')
+    if redline.get('previous_title'):
+        info.add_run(f"Previous title: {redline['previous_title']}\n")
+    info.add_run(f"From: {version_label(redline['base'])}\n")
+    info.add_run(f"To: {version_label(redline['target'])}\n")
+    info.add_run(f"{len(redline['sections'])} section(s) changed, {redline['unchanged_sections']} unchanged")
+
+    if not redline['sections']:
+        doc.paragraph('No changes.')
+    for section in redline['sections']:
+        doc.heading(f"{section['section_number']}. {section['title']}", 1)
+        note = CHANGE_LABELS[section['change']]
+        if section.get('previous_title'):
+            note += f'; renamed from "{section["previous_title"]}"'
+        doc.paragraph(note, 'IM Instructions')
+        for field in section['fields']:
+            paragraph = doc.paragraph()
+            doc.run(paragraph, f"{field['label']}: ", 'IM Label')
+            for op, text in field['segments']:
+                doc.run(paragraph, text, REDLINE_STYLES[op])
+
+    document.save(output_path)
+    return output_path
@@ -4,100 +4,483 @@ from reportlab.lib.units import inch
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, PageBreak, Table, TableStyle
 from reportlab.lib import colors
 from reportlab.lib.enums import TA_CENTER, TA_LEFT
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
+from collections import OrderedDict
+from xml.sax.saxutils import escape
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+import copy
+import hashlib
 import json
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
 
-def generate_pdf(doc_data: Dict[str, Any], output_path: str):
-    """Generate a formatted PDF from IM data"""
-    doc = SimpleDocTemplate(output_path, pagesize=letter,
-                           rightMargin=72, leftMargin=72,
-                           topMargin=72, bottomMargin=18)
-    
+from export_compiled import CHANGE_LABELS, describe_attachment, version_label
+
+logger = logging.getLogger(__name__)
+
+# Documents with at least this much section content are rendered in parallel
+PARALLEL_MIN_BYTES = int(os.environ.get('PDF_PARALLEL_MIN_BYTES', str(256 * 1024)))
+# Every web worker has its own pool, so the CPUs are split between them
+PARALLEL_WORKERS = int(os.environ.get('PDF_PARALLEL_WORKERS', '0')) or max(
+    1, (os.cpu_count() or 2) // max(1, int(os.environ.get('WEB_CONCURRENCY') or 1)))
+# A parallel render taking longer than this is abandoned and rendered serially
+PARALLEL_TIMEOUT = float(os.environ.get('PDF_PARALLEL_TIMEOUT', '120'))
+ANNEXURES_PER_CHUNK = int(os.environ.get('PDF_ANNEXURES_PER_CHUNK', '4'))
+
+# Styles are built once per process; STYLE_KEY changes whenever they do
+_base = getSampleStyleSheet()
+
+title_style = ParagraphStyle(
+    'CustomTitle',
+    parent=_base['Heading1'],
+    fontSize=24,
+    textColor=colors.HexColor('#064E3B'),
+    spaceAfter=30,
+    alignment=TA_CENTER,
+    fontName='Helvetica-Bold'
+)
+
+heading_style = ParagraphStyle(
+    'CustomHeading',
+    parent=_base['Heading2'],
+    fontSize=16,
+    textColor=colors.HexColor('#064E3B'),
+    spaceAfter=12,
+    spaceBefore=12,
+    fontName='Helvetica-Bold'
+)
+
+body_style = ParagraphStyle(
+    'CustomBody',
+    parent=_base['Normal'],
+    fontSize=11,
+    leading=14,
+    fontName='Helvetica'
+)
+
+inst_style = ParagraphStyle(
+    'Instructions',
+    parent=body_style,
+    fontSize=10,
+    textColor=colors.grey,
+    fontName='Helvetica-Oblique'
+)
+
+page_number_style = ParagraphStyle(
+    'TocPage',
+    parent=body_style,
+    alignment=2  # right
+)
+
+STYLE_KEY = hashlib.sha256(json.dumps(
+    [(s.name, sorted((k, repr(v)) for k, v in s.__dict__.items() if k != 'parent'))
+     for s in (heading_style, body_style, inst_style)]
+).encode()).hexdigest()[:16]
+
+
+class SectionFragmentCache:
+    """LRU of rendered section flowables keyed by section content and style"""
+
+    def __init__(self, maxsize: int = 2048):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[str, List]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(section: Dict[str, Any], style_key: str = STYLE_KEY) -> str:
+        payload = json.dumps(section, sort_keys=True, default=str)
+        return hashlib.sha256(f"{style_key}:{payload}".encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[List]:
+        with self._lock:
+            flowables = self._entries.get(key)
+            if flowables is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        # Layout state lives on the flowable, so each build gets its own copies
+        return [copy.copy(f) for f in flowables]
+
+    def put(self, key: str, flowables: List):
+        with self._lock:
+            self._entries[key] = flowables
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+fragment_cache = SectionFragmentCache()
+
+
+def render_section(section: Dict[str, Any]) -> List:
+    """Flowables for one section, from its heading to the trailing spacer"""
+    flowables = []
+    heading_text = f"{escape(str(section['section_number']))}. {escape(str(section['title']))}"
+    heading = Paragraph(heading_text, heading_style)
+    heading._im_section_id = section['section_id']  # lets a chunk report where each section starts
+    flowables.append(heading)
+    flowables.append(Spacer(1, 0.1*inch))
+
+    # Instructions (only if enabled)
+    if section.get('show_instructions', True) and section.get('instructions'):
+        flowables.append(Paragraph(f"<i>Instructions: {escape(str(section['instructions']))}</i>", inst_style))
+        flowables.append(Spacer(1, 0.1*inch))
+
+    # Content
+    content = section.get('content', {})
+    if content:
+        for key, value in content.items():
+            if value:
+                field_text = f"<b>{escape(key.replace('_', ' ').title())}:</b> {escape(str(value))}"
+                flowables.append(Paragraph(field_text, body_style))
+                flowables.append(Spacer(1, 0.05*inch))
+    else:
+        flowables.append(Paragraph('[Content to be added]', body_style))
+
+    # Attachments are listed, not embedded (they ship alongside in bundle exports)
+    if section.get('attachments'):
+        flowables.append(Paragraph('<b>Attachments:</b>', body_style))
+        for attachment in section['attachments']:
+            flowables.append(Paragraph(f"&bull; {escape(describe_attachment(attachment))}", body_style))
+
+    flowables.append(Spacer(1, 0.2*inch))
+    return flowables
+
+
+def section_flowables(section: Dict[str, Any], cache: Optional[SectionFragmentCache], stats: Dict[str, int]) -> List:
+    if cache is None:
+        return render_section(section)
+    key = cache.key(section)
+    flowables = cache.get(key)
+    if flowables is not None:
+        stats['hits'] += 1
+        return flowables
+    stats['misses'] += 1
+    flowables = render_section(section)
+    cache.put(key, flowables)
+    return [copy.copy(f) for f in flowables]
+
+
+def front_matter(doc_data: Dict[str, Any], toc_pages: Optional[Dict[str, int]] = None) -> List:
+    """Title page and table of contents; page numbers are listed when toc_pages is given"""
     story = []
-    styles = getSampleStyleSheet()
-    
-    # Custom styles
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=24,
-        textColor=colors.HexColor('#064E3B'),
-        spaceAfter=30,
-        alignment=TA_CENTER,
-        fontName='Helvetica-Bold'
-    )
-    
-    heading_style = ParagraphStyle(
-        'CustomHeading',
-        parent=styles['Heading2'],
-        fontSize=16,
-        textColor=colors.HexColor('#064E3B'),
-        spaceAfter=12,
-        spaceBefore=12,
-        fontName='Helvetica-Bold'
-    )
-    
-    body_style = ParagraphStyle(
-        'CustomBody',
-        parent=styles['Normal'],
-        fontSize=11,
-        leading=14,
-        fontName='Helvetica'
-    )
-    
+
     # Title
     story.append(Paragraph('Redwood Partners Investment Memorandum', title_style))
     story.append(Spacer(1, 0.2*inch))
-    
+
     # Document info
-    story.append(Paragraph(f"<b>Title:</b> {doc_data['title']}", body_style))
+    story.append(Paragraph(f"<b>Title:</b> {escape(str(doc_data['title']))}", body_style))
     story.append(Paragraph(f"<b>Status:</b> {doc_data['status'].upper()}", body_style))
     story.append(Paragraph(f"<b>Created:</b> {doc_data['created_at']}", body_style))
     story.append(Spacer(1, 0.3*inch))
     story.append(PageBreak())
-    
+
     # Table of Contents
     story.append(Paragraph('Table of Contents', heading_style))
     story.append(Spacer(1, 0.1*inch))
-    
-    for section in doc_data.get('sections', []):
-        toc_text = f"{section['section_number']}. {section['title']}"
-        story.append(Paragraph(toc_text, body_style))
-    
+
+    sections = doc_data.get('sections', [])
+    if toc_pages is None:
+        for section in sections:
+            toc_text = f"{escape(str(section['section_number']))}. {escape(str(section['title']))}"
+            story.append(Paragraph(toc_text, body_style))
+    elif sections:
+        # Fixed column widths keep the layout identical whatever the numbers are
+        rows = [[Paragraph(f"{escape(str(section['section_number']))}. {escape(str(section['title']))}", body_style),
+                 Paragraph(str(toc_pages.get(section['section_id'], '')), page_number_style)]
+                for section in sections]
+        table = Table(rows, colWidths=[5.5*inch, 0.9*inch])
+        table.setStyle(TableStyle([('LEFTPADDING', (0, 0), (-1, -1), 0), ('VALIGN', (0, 0), (-1, -1), 'TOP')]))
+        story.append(table)
+
     story.append(PageBreak())
-    
+    return story
+
+
+def _draw_page_number(canvas, page_number: int):
+    canvas.saveState()
+    canvas.setFont('Helvetica', 8)
+    canvas.setFillColor(colors.grey)
+    canvas.drawCentredString(letter[0] / 2, 6, f"Page {page_number}")
+    canvas.restoreState()
+
+
+def _number_page(canvas, doc):
+    _draw_page_number(canvas, canvas.getPageNumber())
+
+
+def _doc_template(output_path: str, cls=SimpleDocTemplate):
+    return cls(output_path, pagesize=letter,
+               rightMargin=72, leftMargin=72,
+               topMargin=72, bottomMargin=18)
+
+
+def generate_pdf(doc_data: Dict[str, Any], output_path: str,
+                 cache: Optional[SectionFragmentCache] = fragment_cache, stats: Optional[Dict[str, int]] = None,
+                 parallel: Optional[bool] = None):
+    """Generate a formatted PDF from IM data, re-rendering only sections not in the cache.
+
+    Large documents (or parallel=True) are split into chunks rendered in a process pool;
+    if the pool breaks or times out the document is rendered serially instead. Either
+    way the TOC lists page numbers (serially they are filled in the same way as for a
+    single chunk); only without pypdf is it rendered without them.
+    """
+    if stats is None:
+        stats = {}
+    stats.update(hits=0, misses=0)
+    if parallel is None:
+        parallel = content_size(doc_data) >= PARALLEL_MIN_BYTES
+    if parallel and PARALLEL_WORKERS > 1:
+        try:
+            return generate_pdf_parallel(doc_data, output_path, stats)
+        except ImportError:
+            pass  # pypdf not installed; render serially
+        except (BrokenProcessPool, FutureTimeout) as e:
+            logger.warning("Parallel PDF render failed (%s); rendering serially", type(e).__name__)
+            stats.update(hits=0, misses=0)
+    try:
+        return generate_pdf_serial(doc_data, output_path, cache, stats)
+    except ImportError:
+        pass  # pypdf not installed; no page numbers in the TOC
+
+    doc = _doc_template(output_path)
+    story = front_matter(doc_data)
+
     # Sections
     for section in doc_data.get('sections', []):
-        # Section heading
-        heading_text = f"{section['section_number']}. {section['title']}"
-        story.append(Paragraph(heading_text, heading_style))
-        story.append(Spacer(1, 0.1*inch))
-        
-        # Instructions (only if enabled)
-        if section.get('show_instructions', True) and section.get('instructions'):
-            inst_style = ParagraphStyle(
-                'Instructions',
-                parent=body_style,
-                fontSize=10,
-                textColor=colors.grey,
-                fontName='Helvetica-Oblique'
-            )
-            story.append(Paragraph(f"<i>Instructions: {section['instructions']}</i>", inst_style))
-            story.append(Spacer(1, 0.1*inch))
-        
-        # Content
-        content = section.get('content', {})
-        if content:
-            for key, value in content.items():
-                if value:
-                    field_text = f"<b>{key.replace('_', ' ').title()}:</b> {str(value)}"
-                    story.append(Paragraph(field_text, body_style))
-                    story.append(Spacer(1, 0.05*inch))
-        else:
-            story.append(Paragraph('[Content to be added]', body_style))
-        
-        story.append(Spacer(1, 0.2*inch))
-    
+        story.extend(section_flowables(section, cache, stats))
+
     # Build PDF
-    doc.build(story)
+    doc.build(story, onFirstPage=_number_page, onLaterPages=_number_page)
+    return output_path
+
+
+# Parallel rendering
+
+class _ChunkDocTemplate(SimpleDocTemplate):
+    """Records the page on which each section heading lands"""
+
+    def afterFlowable(self, flowable):
+        section_id = getattr(flowable, '_im_section_id', None)
+        if section_id and section_id not in self.section_pages:
+            self.section_pages[section_id] = self.page
+
+
+def content_size(doc_data: Dict[str, Any]) -> int:
+    return sum(len(json.dumps(s.get('content') or {}, default=str)) for s in doc_data.get('sections', []))
+
+
+def plan_chunks(sections: List[Dict[str, Any]], annexures_per_chunk: int = ANNEXURES_PER_CHUNK) -> List[List[Dict[str, Any]]]:
+    """Core sections form one chunk; annexures are grouped after it"""
+    core = [s for s in sections if not s['section_id'].startswith('annexure_')]
+    annexures = [s for s in sections if s['section_id'].startswith('annexure_')]
+    chunks = [core] if core else []
+    chunks += [annexures[i:i + annexures_per_chunk] for i in range(0, len(annexures), annexures_per_chunk)]
+    return chunks
+
+
+def _footer(first_page: Optional[int]):
+    """Page callback numbering a chunk that starts on first_page (None: stamped after merging)"""
+    if first_page is None:
+        return lambda canvas, doc: None
+    return lambda canvas, doc: _draw_page_number(canvas, first_page + canvas.getPageNumber() - 1)
+
+
+def _render_chunk(sections: List[Dict[str, Any]], output_path: str,
+                  cache: Optional[SectionFragmentCache] = fragment_cache, first_page: Optional[int] = None):
+    """Worker entry point: render sections to their own PDF"""
+    doc = _doc_template(output_path, _ChunkDocTemplate)
+    doc.section_pages = {}
+    stats = {'hits': 0, 'misses': 0}
+    story = []
+    for section in sections:
+        story.extend(section_flowables(section, cache, stats))
+    doc.build(story, onFirstPage=_footer(first_page), onLaterPages=_footer(first_page))
+    return doc.page, doc.section_pages, stats
+
+
+def _render_front(doc_data: Dict[str, Any], toc_pages: Dict[str, int], output_path: str, numbered: bool = False) -> int:
+    doc = _doc_template(output_path)
+    # Drop the trailing page break; the first chunk starts on a fresh page anyway
+    footer = _footer(1 if numbered else None)
+    doc.build(front_matter(doc_data, toc_pages)[:-1], onFirstPage=footer, onLaterPages=footer)
+    return doc.page
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: the server process has Mongo client threads that must not be forked
+            _pool = ProcessPoolExecutor(PARALLEL_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+
+def _discard_pool(pool: ProcessPoolExecutor):
+    """Drop a broken or stuck pool and kill its workers; the next render starts a fresh one"""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    # shutdown() leaves a worker that is stuck in a render running, so terminate them
+    processes = list((pool._processes or {}).values())
+    pool.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        process.terminate()
+
+
+def generate_pdf_parallel(doc_data: Dict[str, Any], output_path: str, stats: Optional[Dict[str, int]] = None,
+                          timeout: float = PARALLEL_TIMEOUT):
+    """Render chunks concurrently, then merge them and fix up TOC and page numbers.
+
+    Raises BrokenProcessPool or concurrent.futures.TimeoutError (after discarding the
+    pool) when the workers fail. Each spawned worker has its own fragment_cache, so
+    hits only come from sections that worker rendered before; the server process's
+    cache is not consulted or filled.
+    """
+    import pypdf  # noqa: F401  (fail before rendering when it is missing)
+
+    if stats is None:
+        stats = {'hits': 0, 'misses': 0}
+    chunks = plan_chunks(doc_data.get('sections', []))
+    with tempfile.TemporaryDirectory(prefix="im-pdf-") as tmp:
+        pool = _get_pool()
+        deadline = time.monotonic() + timeout
+        chunk_paths = [os.path.join(tmp, f"chunk-{i}.pdf") for i in range(len(chunks))]
+        try:
+            futures = [pool.submit(_render_chunk, chunk, path) for chunk, path in zip(chunks, chunk_paths)]
+        except BrokenProcessPool:
+            _discard_pool(pool)
+            raise
+
+        # The TOC layout does not depend on the numbers, so its length is known up front
+        front_path = os.path.join(tmp, "front.pdf")
+        front_pages = _render_front(doc_data, {}, front_path)
+
+        results = []
+        try:
+            for future in futures:
+                results.append(future.result(timeout=max(0.0, deadline - time.monotonic())))
+        except (BrokenProcessPool, FutureTimeout):
+            _discard_pool(pool)
+            raise
+        _assemble(doc_data, front_path, front_pages, results, chunk_paths, output_path, stats)
+    return output_path
+
+
+def generate_pdf_serial(doc_data: Dict[str, Any], output_path: str,
+                        cache: Optional[SectionFragmentCache] = fragment_cache, stats: Optional[Dict[str, int]] = None):
+    """Render every section as one chunk in this process, then fix up TOC and page numbers.
+
+    The front matter's length is known before the sections are rendered, so pages are
+    numbered while rendering and only the TOC is rendered again.
+    """
+    import pypdf  # noqa: F401  (fail before rendering when it is missing)
+
+    if stats is None:
+        stats = {'hits': 0, 'misses': 0}
+    with tempfile.TemporaryDirectory(prefix="im-pdf-") as tmp:
+        chunk_path = os.path.join(tmp, "chunk-0.pdf")
+        front_path = os.path.join(tmp, "front.pdf")
+        front_pages = _render_front(doc_data, {}, front_path)
+        results = [_render_chunk(doc_data.get('sections', []), chunk_path, cache, first_page=front_pages + 1)]
+        _assemble(doc_data, front_path, front_pages, results, [chunk_path], output_path, stats, stamped=False)
+    return output_path
+
+
+def _assemble(doc_data: Dict[str, Any], front_path: str, front_pages: int, results: List, chunk_paths: List[str],
+              output_path: str, stats: Dict[str, int], stamped: bool = True):
+    """Merge the front matter and rendered chunks with TOC page numbers; stamped adds the page footers"""
+    from pypdf import PdfReader, PdfWriter
+    from reportlab.pdfgen.canvas import Canvas
+
+    tmp = os.path.dirname(front_path)
+    toc_pages = {}
+    offset = front_pages
+    for page_count, section_pages, chunk_stats in results:
+        for section_id, page in section_pages.items():
+            toc_pages[section_id] = offset + page
+        offset += page_count
+        stats['hits'] += chunk_stats['hits']
+        stats['misses'] += chunk_stats['misses']
+
+    # Final pass: TOC with real page numbers, then stamp every page
+    _render_front(doc_data, toc_pages, front_path, numbered=not stamped)
+    writer = PdfWriter()
+    for path in [front_path] + chunk_paths:
+        writer.append(path)
+    if stamped:
+        numbers_path = os.path.join(tmp, "numbers.pdf")
+        canvas = Canvas(numbers_path, pagesize=letter)
+        for page_number in range(1, offset + 1):
+            _draw_page_number(canvas, page_number)
+            canvas.showPage()
+        canvas.save()
+        numbers = PdfReader(numbers_path)
+        for page, overlay in zip(writer.pages, numbers.pages):
+            page.merge_page(overlay)
+    with open(output_path, 'wb') as f:
+        writer.write(f)
+
+
+# Redline (see redline.py for the diff)
+
+DELETED_COLOR = '#B91C1C'
+INSERTED_COLOR = '#047857'
+REDLINE_MARKUP = {
+    'equal': '{}',
+    'delete': f'<font color="{DELETED_COLOR}"><strike>{{}}</strike></font>',
+    'insert': f'<font color="{INSERTED_COLOR}"><u>{{}}</u></font>',
+}
+
+
+def _redline_markup(segments) -> str:
+    return ''.join(REDLINE_MARKUP[op].format(escape(text).replace('\n', '<br/>')) for op, text in segments)
+
+
+def generate_redline_pdf(redline: Dict[str, Any], output_path: str):
+    """Compact PDF with only the changed sections, deletions struck through and insertions underlined"""
+    doc = _doc_template(output_path)
+    story = [Paragraph('Investment Memorandum Redline', title_style)]
+    story.append(Paragraph(f"<b>Title:</b> {escape(str(redline['title']))}", body_style))
+    if redline.get('previous_title'):
+        story.append(Paragraph(f"<b>Previous title:</b> {escape(str(redline['previous_title']))}", body_style))
+    story.append(Paragraph(f"<b>From:</b> {escape(version_label(redline['base']))}", body_style))
+    story.append(Paragraph(f"<b>To:</b> {escape(version_label(redline['target']))}", body_style))
+    story.append(Paragraph(
+        f"{len(redline['sections'])} section(s) changed, {redline['unchanged_sections']} unchanged", body_style
+    ))
+    story.append(Spacer(1, 0.3*inch))
+
+    if not redline['sections']:
+        story.append(Paragraph('No changes.', body_style))
+    for section in redline['sections']:
+        story.append(Paragraph(f"{escape(str(section['section_number']))}. {escape(str(section['title']))}", heading_style))
+        note = CHANGE_LABELS[section['change']]
+        if section.get('previous_title'):
+            note += f"; renamed from \"{escape(str(section['previous_title']))}\""
+        story.append(Paragraph(f"<i>{note}</i>", inst_style))
+        story.append(Spacer(1, 0.05*inch))
+        for field in section['fields']:
+            story.append(Paragraph(f"<b>{escape(field['label'])}:</b> {_redline_markup(field['segments'])}", body_style))
+            story.append(Spacer(1, 0.05*inch))
+        story.append(Spacer(1, 0.2*inch))
+
+    doc.build(story, onFirstPage=_number_page, onLaterPages=_number_page)
     return output_path
@@ -0,0 +1,42 @@
+"""Gunicorn settings for multi-worker deployments.
+
+    gunicorn -c gunicorn.conf.py server:app
+
+The app is imported once in the master (preload_app) and forked into
+WEB_CONCURRENCY uvicorn workers. Each worker opens its own Mongo client
+after the fork. More than one worker needs CACHE_CHANGE_STREAMS=1 (replica
+set required) so the in-process caches stay coherent across workers: with it
+the default is one worker per CPU, without it a single worker, and asking
+for more refuses to start.
+
+Other state stays per worker even then:
+
+- rate limit buckets with the default RATE_LIMIT_BACKEND=memory, so each
+  worker allows the full RATE_LIMITS (set RATE_LIMIT_BACKEND=mongo to share
+  them); CONCURRENCY_LIMITS are always per worker;
+- the export prerender debounce (export_cache.prerender): a document's
+  status changes are debounced by the worker that handled them, so two
+  workers may both render it, which only rewrites the same cached file;
+- buffered activity events, update notifications and Firestore mirror
+  writes, which reach Mongo/Firestore on each worker's next flush; until
+  then only that worker's reads (e.g. the activity feed) include them.
+"""
+import os
+
+from cache import default_workers
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = default_workers()
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+graceful_timeout = int(os.environ.get('GRACEFUL_TIMEOUT', '30'))
+timeout = int(os.environ.get('WORKER_TIMEOUT', '120'))
+keepalive = 5
+max_requests = int(os.environ.get('MAX_REQUESTS', '0'))
+max_requests_jitter = max_requests // 10
+
+
+def post_fork(server, worker):
+    # Motor clients must not be shared across a fork
+    import server as app_module
+    app_module.connect_mongo()
@@ -0,0 +1,88 @@
+"""HTTP Range support for streamed downloads.
+
+Only single ``bytes=`` ranges are honoured (``start-end``, ``start-`` and
+the ``-suffix`` form); multi-range requests are answered with the whole body,
+which RFC 9110 allows. ``If-Range`` is compared against the response's ETag,
+so a client resuming a download of content that has since changed gets the
+new body in full instead of a mismatched tail, and a matching
+``If-None-Match`` is answered with 304.
+"""
+from pathlib import Path
+from typing import AsyncIterator, Callable, Dict, Optional, Tuple
+
+from fastapi import HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response, StreamingResponse
+
+Chunks = Callable[[int, int], AsyncIterator[bytes]]  # (start, end inclusive) -> body
+FILE_CHUNK_BYTES = 256 * 1024
+
+
+def file_chunks(path: Path, chunk_bytes: int = FILE_CHUNK_BYTES) -> Chunks:
+    """Chunks reading a file from disk in a worker thread"""
+    async def read(start: int, end: int) -> AsyncIterator[bytes]:
+        handle = await run_in_threadpool(open, path, 'rb')
+        try:
+            await run_in_threadpool(handle.seek, start)
+            remaining = end - start + 1
+            while remaining > 0:
+                data = await run_in_threadpool(handle.read, min(chunk_bytes, remaining))
+                if not data:
+                    break
+                remaining -= len(data)
+                yield data
+        finally:
+            await run_in_threadpool(handle.close)
+    return read
+
+
+def byte_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """(start, end) inclusive for a Range header, None to send everything; 416 if unsatisfiable"""
+    if not header:
+        return None
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in spec:
+        return None
+    first, sep, last = spec.strip().partition('-')
+    if not sep:
+        return None
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else size - 1
+            if start < 0 or (last and end < start):
+                return None  # malformed, so ignored
+        else:
+            suffix = int(last)
+            if suffix < 0:
+                return None
+            start, end = max(size - suffix, 0), size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        raise HTTPException(status_code=416, detail="Requested range not satisfiable",
+                            headers={'Content-Range': f"bytes */{size}"})
+    return start, min(end, size - 1)
+
+
+def ranged_response(request: Request, size: int, chunks: Chunks, media_type: str,
+                    etag: Optional[str] = None, headers: Optional[Dict[str, str]] = None) -> Response:
+    """Stream the whole body (200) or the requested range (206)"""
+    headers = {**(headers or {}), 'Accept-Ranges': 'bytes'}
+    if etag:
+        headers['ETag'] = etag
+        if_none_match = request.headers.get('if-none-match')
+        if if_none_match and (if_none_match.strip() == '*' or etag in [t.strip().removeprefix('W/') for t in if_none_match.split(',')]):
+            return Response(status_code=304, headers={k: v for k, v in headers.items() if k != 'Content-Disposition'})
+    requested = request.headers.get('range')
+    if_range = request.headers.get('if-range')
+    if if_range is not None and if_range != etag:
+        requested = None
+    span = byte_range(requested, size) if size else None
+    if span is None:
+        headers['Content-Length'] = str(size)
+        return StreamingResponse(chunks(0, size - 1), media_type=media_type, headers=headers)
+    start, end = span
+    headers['Content-Range'] = f"bytes {start}-{end}/{size}"
+    headers['Content-Length'] = str(end - start + 1)
+    return StreamingResponse(chunks(start, end), status_code=206, media_type=media_type, headers=headers)
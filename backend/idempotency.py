@@ -0,0 +1,101 @@
+"""Idempotency-Key handling for create endpoints.
+
+The first request with a key claims it by inserting a pending record into
+``idempotency_keys``; the stored response is replayed for every retry until
+the TTL index expires the record. Completed responses are also kept in a
+small in-process cache so replays usually skip Mongo. Reusing a key with a
+different payload is rejected with 422; a retry that races the original
+request gets 409. A pending claim is a lease that runs out IDEMPOTENCY_LEASE
+seconds after it was taken (the worker timeout plus a margin), so a retry
+after a request that crashed mid-way takes the key over instead of getting
+409 until the record expires.
+"""
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from pymongo.errors import DuplicateKeyError
+
+from cache import LocalCache
+
+IDEMPOTENCY_TTL = int(os.environ.get('IDEMPOTENCY_TTL', str(24 * 3600)))
+IDEMPOTENCY_LEASE = int(os.environ.get('IDEMPOTENCY_LEASE', str(int(os.environ.get('WORKER_TIMEOUT', '120')) + 30)))
+
+
+def fingerprint(payload: Any) -> str:
+    body = json.dumps(jsonable_encoder(payload), sort_keys=True, default=str)
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+class IdempotencyStore:
+    def __init__(self, get_db, ttl: int = IDEMPOTENCY_TTL, lease: int = IDEMPOTENCY_LEASE):
+        self.get_db = get_db
+        self.ttl = ttl
+        self.lease = timedelta(seconds=lease)
+        self.front = LocalCache(maxsize=4096, ttl=min(ttl, 600))
+
+    async def ensure_indexes(self):
+        await self.get_db().idempotency_keys.create_index('created_at', expireAfterSeconds=self.ttl)
+
+    async def begin(self, record_id: str, print_: str, lease: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Claim record_id (as lease, if given); returns the stored response if the key was already used"""
+        cached = self.front.get(record_id)
+        if cached is not None:
+            return self._replay(cached, print_)
+        collection = self.get_db().idempotency_keys
+        now = datetime.utcnow()
+        try:
+            await collection.insert_one({
+                '_id': record_id,
+                'fingerprint': print_,
+                'state': 'pending',
+                'lease': lease,
+                'pending_until': now + self.lease,
+                'created_at': now,
+            })
+            return None
+        except DuplicateKeyError:
+            record = await collection.find_one({'_id': record_id})
+        if record is None:
+            # Expired between the insert and the read; treat as a fresh request
+            return await self.begin(record_id, print_, lease)
+        if record['state'] != 'done':
+            if record['fingerprint'] != print_:
+                raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request")
+            pending_until = record.get('pending_until') or record['created_at'] + self.lease
+            if pending_until > now:
+                raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress")
+            # The request holding the key died without completing or releasing it
+            taken = await collection.update_one(
+                {'_id': record_id, 'state': 'pending', 'lease': record.get('lease'), 'pending_until': record.get('pending_until')},
+                {'$set': {'lease': lease, 'pending_until': now + self.lease, 'created_at': now}},
+            )
+            if taken.modified_count:
+                return None
+            return await self.begin(record_id, print_, lease)
+        self.front.set(record_id, record)
+        return self._replay(record, print_)
+
+    @staticmethod
+    def _replay(record: Dict[str, Any], print_: str) -> Dict[str, Any]:
+        if record['fingerprint'] != print_:
+            raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request")
+        return record['response']
+
+    async def complete(self, record_id: str, print_: str, response: Any):
+        body = jsonable_encoder(response)
+        await self.get_db().idempotency_keys.update_one(
+            {'_id': record_id}, {'$set': {'state': 'done', 'response': body}}
+        )
+        self.front.set(record_id, {'fingerprint': print_, 'state': 'done', 'response': body})
+
+    async def abandon(self, record_id: str, lease: Optional[str] = None):
+        """Release the key after a failed request so the client can retry it"""
+        query = {'_id': record_id, 'state': 'pending'}
+        if lease is not None:
+            query['lease'] = lease  # unless another request has taken it over since
+        await self.get_db().idempotency_keys.delete_one(query)
@@ -0,0 +1,165 @@
+"""Document templates.
+
+Templates are versioned records in the ``templates`` collection. Each
+version is immutable, so once loaded it is kept in memory as a prebuilt
+section skeleton and new documents are stamped from it without touching
+Mongo. The built-in Redwood IM is version 1 of ``redwood_im`` unless a
+stored version replaces it.
+"""
+import copy
+from dataclasses import dataclass
+from datetime import datetime
+from types import MappingProxyType
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+from pymongo.errors import DuplicateKeyError
+
+from cache import LocalCache
+
+DEFAULT_TEMPLATE_ID = "redwood_im"
+
+_REDWOOD_CORE = (
+    ("exec_summary", "1", "Executive Summary & Investment Highlights"),
+    ("opportunity", "2", "Opportunity Analysis & Investment Rationale"),
+    ("journey", "3", "Applicant's Journey in this Program"),
+    ("business_overview", "4", "Business Overview"),
+    ("financial", "5", "Financial Overview"),
+    ("market", "6", "Market & Industry Analysis"),
+    ("positioning", "7", "Strategic Positioning"),
+    ("management", "8", "Management & Governance"),
+    ("risk", "9", "Risk Analysis"),
+    ("transaction", "10", "Transaction Details"),
+)
+
+
+def _redwood_sections() -> List[Dict[str, Any]]:
+    sections = [
+        {'section_id': sid, 'section_number': snum, 'title': title, 'content': {},
+         'instructions': f"Complete {title}", 'show_instructions': True}
+        for sid, snum, title in _REDWOOD_CORE
+    ]
+    sections += [
+        {'section_id': f"annexure_{i}", 'section_number': str(10 + i), 'title': f"Annexure {i}", 'content': {},
+         'instructions': f"Add annexure {i}", 'show_instructions': True}
+        for i in range(1, 14)
+    ]
+    return sections
+
+
+@dataclass(frozen=True)
+class Template:
+    template_id: str
+    version: int
+    name: str
+    description: Optional[str]
+    sections: Tuple[Mapping[str, Any], ...]
+
+    @classmethod
+    def from_record(cls, record: Dict[str, Any]) -> "Template":
+        sections = tuple(
+            MappingProxyType({**s, 'content': MappingProxyType(dict(s.get('content') or {}))})
+            for s in record['sections']
+        )
+        return cls(record['template_id'], record['version'], record['name'], record.get('description'), sections)
+
+    def instantiate(self) -> List[Dict[str, Any]]:
+        """Fresh, mutable section list for a new document"""
+        return [
+            {**s, 'content': copy.deepcopy(dict(s['content'])) if s['content'] else {}}
+            for s in self.sections
+        ]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'template_id': self.template_id,
+            'version': self.version,
+            'name': self.name,
+            'description': self.description,
+            'sections': self.instantiate(),
+        }
+
+
+BUILTIN_TEMPLATES = {
+    DEFAULT_TEMPLATE_ID: Template.from_record({
+        'template_id': DEFAULT_TEMPLATE_ID,
+        'version': 1,
+        'name': "Redwood Investment Memorandum",
+        'sections': _redwood_sections(),
+    }),
+}
+
+
+class TemplateRegistry:
+    """Loads templates from Mongo once and serves them from memory"""
+
+    def __init__(self, latest_ttl: float = 60.0):
+        self._versions: Dict[Tuple[str, int], Template] = {}
+        # Only the "latest version" pointer can go stale
+        self._latest = LocalCache(maxsize=256, ttl=latest_ttl)
+
+    def invalidate(self, template_id: Optional[str] = None):
+        self._latest.invalidate(template_id)
+
+    async def get(self, db, template_id: Optional[str] = None, version: Optional[int] = None) -> Optional[Template]:
+        template_id = template_id or DEFAULT_TEMPLATE_ID
+        if version is None:
+            version = self._latest.get(template_id)
+            if version is None:
+                record = await db.templates.find_one(
+                    {'template_id': template_id}, {'_id': 0, 'version': 1}, sort=[('version', -1)]
+                )
+                if record:
+                    version = record['version']
+                elif template_id in BUILTIN_TEMPLATES:
+                    version = BUILTIN_TEMPLATES[template_id].version
+                else:
+                    return None
+                self._latest.set(template_id, version)
+        template = self._versions.get((template_id, version))
+        if template is None:
+            record = await db.templates.find_one({'template_id': template_id, 'version': version}, {'_id': 0})
+            if record:
+                template = Template.from_record(record)
+            else:
+                builtin = BUILTIN_TEMPLATES.get(template_id)
+                if not builtin or builtin.version != version:
+                    return None
+                template = builtin
+            self._versions[(template_id, version)] = template
+        return template
+
+    async def list_latest(self, db) -> List[Template]:
+        records = await db.templates.aggregate([
+            {'$sort': {'template_id': 1, 'version': -1}},
+            {'$group': {'_id': '$template_id', 'version': {'$first': '$version'}}},
+        ]).to_list(1000)
+        latest = {r['_id']: r['version'] for r in records}
+        for template_id, builtin in BUILTIN_TEMPLATES.items():
+            latest.setdefault(template_id, builtin.version)
+        templates = [await self.get(db, tid, version) for tid, version in sorted(latest.items())]
+        return [t for t in templates if t]
+
+    async def publish(self, db, template_id: str, name: str, sections: List[Dict[str, Any]],
+                      description: Optional[str] = None) -> Template:
+        """Store a new version of a template"""
+        while True:
+            current = await self.get(db, template_id)
+            record = {
+                'template_id': template_id,
+                'version': (current.version + 1) if current else 1,
+                'name': name,
+                'description': description,
+                'sections': sections,
+                'created_at': datetime.utcnow().isoformat(),
+            }
+            try:
+                await db.templates.insert_one(record)
+            except DuplicateKeyError:
+                # Someone else published the same version number first
+                self.invalidate(template_id)
+                continue
+            self.invalidate(template_id)
+            return Template.from_record(record)
+
+
+template_registry = TemplateRegistry()
@@ -0,0 +1,298 @@
+"""Load-testing harness for the IM API.
+
+Runs scripted scenarios against the FastAPI app in-process and reports
+latency percentiles and throughput as JSON, so runs can be diffed across
+commits:
+
+    python loadtest.py --scenario all --editors 20 --duration 30 -o run.json
+    python loadtest.py --scenario autosave --compare baseline.json
+
+By default the app talks to mongomock-motor (pip install mongomock-motor);
+pass --mongo-url to run against a throwaway mongod instead.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+ROOT_DIR = Path(__file__).parent
+SCENARIOS = ("autosave", "dashboard", "comments", "export")
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not samples:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100.0 * len(samples)))
+    return samples[rank - 1]
+
+
+class Recorder:
+    """Collects per-request latencies for one scenario"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.latencies: List[float] = []
+        self.errors = 0
+        self.started = 0.0
+        self.finished = 0.0
+
+    async def call(self, fn: Callable, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = await fn(*args, **kwargs)
+        except Exception:
+            self.errors += 1
+            return None
+        self.latencies.append((time.perf_counter() - start) * 1000)
+        if response.status_code >= 400:
+            self.errors += 1
+        return response
+
+    def summary(self) -> Dict[str, Any]:
+        samples = sorted(self.latencies)
+        elapsed = max(self.finished - self.started, 1e-9)
+        return {
+            'requests': len(samples) + self.errors,
+            'errors': self.errors,
+            'duration_s': round(elapsed, 3),
+            'throughput_rps': round(len(samples) / elapsed, 2),
+            'latency_ms': {
+                'p50': round(percentile(samples, 50), 3),
+                'p95': round(percentile(samples, 95), 3),
+                'p99': round(percentile(samples, 99), 3),
+                'max': round(samples[-1], 3) if samples else 0.0,
+                'mean': round(sum(samples) / len(samples), 3) if samples else 0.0,
+            },
+        }
+
+
+def _filled_sections(sections: List[Dict[str, Any]], content_kb: int, tick: int) -> List[Dict[str, Any]]:
+    """Return the document sections with every field filled, as an editor would send them"""
+    filler = ("lorem ipsum dolor sit amet " * (content_kb * 40))[:content_kb * 1024]
+    filled = []
+    for section in sections:
+        section = dict(section)
+        section['content'] = {
+            'summary': f"{filler} rev {tick}",
+            'notes': f"autosave {tick} for {section['section_id']}",
+        }
+        filled.append(section)
+    return filled
+
+
+async def _create_documents(client, user_id: str, count: int) -> List[Dict[str, Any]]:
+    docs = []
+    for i in range(count):
+        response = await client.post("/api/documents", json={'title': f"Load IM {i}", 'created_by': user_id})
+        response.raise_for_status()
+        docs.append(response.json())
+    return docs
+
+
+async def scenario_autosave(client, args) -> Recorder:
+    """N editors each autosave a full document every --interval seconds"""
+    recorder = Recorder("autosave")
+    docs = await _create_documents(client, "load-editor", args.editors)
+
+    async def editor(doc):
+        tick = 0
+        deadline = recorder.started + args.duration
+        next_save = time.perf_counter()
+        while next_save < deadline:
+            await asyncio.sleep(max(0.0, next_save - time.perf_counter()))
+            payload = {'title': doc['title'], 'sections': _filled_sections(doc['sections'], args.content_kb, tick)}
+            await recorder.call(client.patch, f"/api/documents/{doc['id']}", json=payload)
+            tick += 1
+            next_save += args.interval
+
+    recorder.started = time.perf_counter()
+    await asyncio.gather(*(editor(doc) for doc in docs))
+    recorder.finished = time.perf_counter()
+    return recorder
+
+
+async def scenario_dashboard(client, args) -> Recorder:
+    """Concurrent dashboard loads for a user with --documents documents"""
+    recorder = Recorder("dashboard")
+    await _create_documents(client, "load-dashboard", args.documents)
+
+    async def viewer():
+        deadline = recorder.started + args.duration
+        while time.perf_counter() < deadline:
+            await recorder.call(client.get, "/api/documents", params={'user_id': "load-dashboard"})
+
+    recorder.started = time.perf_counter()
+    await asyncio.gather(*(viewer() for _ in range(args.editors)))
+    recorder.finished = time.perf_counter()
+    return recorder
+
+
+async def scenario_comments(client, args) -> Recorder:
+    """Bursts of comments, each mentioning --mentions users"""
+    recorder = Recorder("comments")
+    doc = (await _create_documents(client, "load-commenter", 1))[0]
+    mentions = [f"reviewer{i}@example.com" for i in range(args.mentions)]
+
+    async def commenter(n):
+        for i in range(args.burst):
+            payload = {
+                'document_id': doc['id'],
+                'section_id': doc['sections'][i % len(doc['sections'])]['section_id'],
+                'user_id': f"load-commenter-{n}",
+                'user_name': f"Commenter {n}",
+                'text': f"Comment {i} from {n}",
+                'mentions': mentions,
+            }
+            await recorder.call(client.post, "/api/comments", json=payload)
+
+    recorder.started = time.perf_counter()
+    await asyncio.gather(*(commenter(n) for n in range(args.editors)))
+    recorder.finished = time.perf_counter()
+    return recorder
+
+
+async def scenario_export(client, args) -> Recorder:
+    """Bursts of exports of a fully populated document"""
+    recorder = Recorder("export")
+    doc = (await _create_documents(client, "load-exporter", 1))[0]
+    payload = {'sections': _filled_sections(doc['sections'], args.content_kb, 0)}
+    (await client.patch(f"/api/documents/{doc['id']}", json=payload)).raise_for_status()
+
+    async def exporter():
+        for _ in range(args.burst):
+            await recorder.call(client.post, f"/api/export/{doc['id']}", params={'format': args.export_format})
+
+    recorder.started = time.perf_counter()
+    await asyncio.gather(*(exporter() for _ in range(args.editors)))
+    recorder.finished = time.perf_counter()
+    return recorder
+
+
+SCENARIO_FUNCS = {
+    'autosave': scenario_autosave,
+    'dashboard': scenario_dashboard,
+    'comments': scenario_comments,
+    'export': scenario_export,
+}
+
+
+def _load_app(args):
+    """Import the app and point it at the selected database"""
+    os.environ.setdefault('MONGO_URL', args.mongo_url or "mongodb://localhost:27017")
+    os.environ.setdefault('DB_NAME', args.db_name)
+    # Measure raw capacity unless limits are asked for explicitly
+    os.environ.setdefault('RATE_LIMITS', args.rate_limits)
+    sys.path.insert(0, str(ROOT_DIR))
+    import server
+    from mirror import MemoryFirestore
+
+    if args.mongo_url:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        server.mongo_db = AsyncIOMotorClient(args.mongo_url)[args.db_name]
+        backend = "mongod"
+    else:
+        from mongomock_motor import AsyncMongoMockClient
+        server.mongo_db = AsyncMongoMockClient()[args.db_name]
+        backend = "mongomock-motor"
+
+    async def _no_email(*_args, **_kwargs):
+        return None
+
+    # Mention emails would otherwise go out through Resend
+    server.send_comment_notification = _no_email
+    # Mirror to an in-process Firestore (the real one needs credentials)
+    server.firestore_mirror.client_factory = MemoryFirestore
+    return server, backend
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+
+async def run(args) -> Dict[str, Any]:
+    import httpx
+
+    server, backend = _load_app(args)
+    names = SCENARIOS if args.scenario == "all" else (args.scenario,)
+    transport = httpx.ASGITransport(app=server.app)
+    results = {}
+    # ASGITransport does not send lifespan events, so run the app's hooks here
+    await server.app.router.startup()
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=None) as client:
+            for name in names:
+                recorder = await SCENARIO_FUNCS[name](client, args)
+                results[name] = recorder.summary()
+    finally:
+        await server.app.router.shutdown()
+    if args.mongo_url and not args.keep_data:
+        await server.mongo_db.client.drop_database(args.db_name)
+    return {
+        'commit': _git_commit(),
+        'timestamp': datetime.utcnow().isoformat(),
+        'backend': backend,
+        'params': {k: getattr(args, k) for k in ('editors', 'documents', 'duration', 'interval', 'content_kb', 'burst', 'mentions', 'export_format')},
+        'scenarios': results,
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any]) -> Dict[str, Any]:
+    """Percent change of throughput and latency percentiles against a baseline run"""
+    deltas = {}
+    for name, result in current['scenarios'].items():
+        base = baseline.get('scenarios', {}).get(name)
+        if not base:
+            continue
+        entry = {}
+        pairs = [('throughput_rps', result['throughput_rps'], base['throughput_rps'])]
+        pairs += [(f"latency_{p}", result['latency_ms'][p], base['latency_ms'][p]) for p in ('p50', 'p95', 'p99')]
+        for key, new, old in pairs:
+            entry[key] = round((new - old) / old * 100, 1) if old else None
+        deltas[name] = entry
+    return {'baseline_commit': baseline.get('commit'), 'pct_change': deltas}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the IM API in-process")
+    parser.add_argument("--scenario", choices=SCENARIOS + ("all",), default="all")
+    parser.add_argument("--editors", type=int, default=10, help="concurrent clients per scenario")
+    parser.add_argument("--documents", type=int, default=200, help="documents on the dashboard")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds for timed scenarios")
+    parser.add_argument("--interval", type=float, default=2.0, help="autosave interval in seconds")
+    parser.add_argument("--content-kb", type=int, default=2, help="KB of content per section")
+    parser.add_argument("--burst", type=int, default=20, help="requests per client in burst scenarios")
+    parser.add_argument("--mentions", type=int, default=3, help="mentions per comment")
+    parser.add_argument("--export-format", default="json")
+    parser.add_argument("--mongo-url", help="use a real mongod instead of mongomock-motor")
+    parser.add_argument("--db-name", default=f"im_loadtest_{uuid.uuid4().hex[:8]}")
+    parser.add_argument("--rate-limits", default="", help="RATE_LIMITS spec to apply (default: none)")
+    parser.add_argument("--keep-data", action="store_true", help="do not drop the database afterwards")
+    parser.add_argument("-o", "--output", help="write the JSON report to this file")
+    parser.add_argument("--compare", help="baseline JSON report to diff against")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(run(args))
+    if args.compare:
+        report['comparison'] = compare(report, json.loads(Path(args.compare).read_text()))
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""Document membership index (``document_members``).
+
+One small record per (user, document) with the user's role, pinned flag and
+last-opened time, plus the document's title and status copied over so that
+dashboard lists never read document bodies. ``MEMBER_FIELDS`` are exactly
+the keys of the two list indexes, so those queries are covered index scans.
+Writes to ``documents.collaborators`` go through ``$addToSet``/``$pull`` and
+the matching membership upsert/delete. Every change publishes the affected
+user ids on the ``document_members`` cache bus.
+
+Memberships for documents that predate this collection are built once with
+
+    python members.py backfill
+
+which is safe to re-run (existing memberships are kept).
+"""
+import argparse
+import asyncio
+import os
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+
+import cache
+
+MEMBER_FIELDS = ['document_id', 'title', 'status', 'role', 'pinned', 'last_opened']
+PROJECTION = {'_id': 0, 'user_id': 1, **{f: 1 for f in MEMBER_FIELDS}}
+RECENT_INDEX = [('user_id', ASCENDING), ('last_opened', DESCENDING)] + \
+    [(f, ASCENDING) for f in MEMBER_FIELDS if f != 'last_opened']
+PINNED_INDEX = [('user_id', ASCENDING), ('pinned', ASCENDING), ('last_opened', DESCENDING)] + \
+    [(f, ASCENDING) for f in MEMBER_FIELDS if f not in ('pinned', 'last_opened')]
+
+
+async def ensure_indexes(db):
+    await db.document_members.create_index([('user_id', 1), ('document_id', 1)], unique=True)
+    await db.document_members.create_index('document_id')
+    await db.document_members.create_index(RECENT_INDEX, name='member_recent')
+    await db.document_members.create_index(PINNED_INDEX, name='member_pinned')
+
+
+async def backfill(db):
+    """Build memberships for existing documents from their collaborators arrays"""
+    await db.documents.aggregate([
+        {'$project': {'_id': 0, 'document_id': '$id', 'title': 1, 'status': 1, 'created_by': 1,
+                      'last_opened': {'$ifNull': ['$updated_at', '$created_at']},
+                      'user_id': {'$setUnion': [{'$ifNull': ['$collaborators', []]}, ['$created_by']]}}},
+        {'$unwind': '$user_id'},
+        {'$match': {'user_id': {'$ne': None}}},
+        {'$set': {
+            'role': {'$cond': [{'$eq': ['$user_id', '$created_by']}, 'owner', 'editor']},
+            'pinned': False,
+        }},
+        {'$unset': 'created_by'},
+        {'$merge': {'into': 'document_members', 'on': ['user_id', 'document_id'],
+                    'whenMatched': 'keepExisting', 'whenNotMatched': 'insert'}},
+    ]).to_list(None)
+
+
+def _upsert(user_id: str, doc: Dict[str, Any], role: str, now: str) -> UpdateOne:
+    return UpdateOne(
+        {'user_id': user_id, 'document_id': doc['id']},
+        {
+            '$set': {'title': doc.get('title', ''), 'status': doc.get('status', 'draft')},
+            '$setOnInsert': {'role': role, 'pinned': False, 'last_opened': now},
+        },
+        upsert=True,
+    )
+
+
+async def sync_documents(db, docs: Iterable[Dict[str, Any]]):
+    """Upsert memberships for the owner and collaborators of newly created documents"""
+    now = datetime.utcnow().isoformat()
+    operations, users = [], set()
+    for doc in docs:
+        owner = doc.get('created_by')
+        for user_id in {owner, *doc.get('collaborators', [])} - {None}:
+            operations.append(_upsert(user_id, doc, 'owner' if user_id == owner else 'editor', now))
+            users.add(user_id)
+    if operations:
+        await db.document_members.bulk_write(operations, ordered=False)
+    _publish(users)
+
+
+def _publish(user_ids: Iterable[str]):
+    for user_id in user_ids:
+        cache.publish('document_members', user_id)
+
+
+async def add(db, doc_id: str, user_id: str, role: str) -> Optional[Dict[str, Any]]:
+    doc = await db.documents.find_one_and_update(
+        {'id': doc_id, 'deleted_at': {'$exists': False}}, {'$addToSet': {'collaborators': user_id}},
+        projection={'_id': 0, 'id': 1, 'title': 1, 'status': 1, 'created_by': 1},
+    )
+    if doc:
+        await db.document_members.update_one(
+            {'user_id': user_id, 'document_id': doc_id},
+            {
+                '$set': {'title': doc.get('title', ''), 'status': doc.get('status', 'draft'),
+                         'role': 'owner' if user_id == doc.get('created_by') else role},
+                '$setOnInsert': {'pinned': False, 'last_opened': datetime.utcnow().isoformat()},
+            },
+            upsert=True,
+        )
+        _publish([user_id])
+    return doc
+
+
+async def remove(db, doc_id: str, user_id: str) -> bool:
+    result = await db.documents.update_one(
+        {'id': doc_id, 'created_by': {'$ne': user_id}, 'deleted_at': {'$exists': False}}, {'$pull': {'collaborators': user_id}}
+    )
+    if result.matched_count:
+        await db.document_members.delete_one({'user_id': user_id, 'document_id': doc_id, 'role': {'$ne': 'owner'}})
+        _publish([user_id])
+    return bool(result.matched_count)
+
+
+async def update_document_fields(db, doc_id: str, fields: Dict[str, Any], user_ids: Iterable[str] = ()):
+    """Carry title/status changes over to every membership of the document"""
+    copied = {k: v for k, v in fields.items() if k in ('title', 'status')}
+    if copied:
+        await db.document_members.update_many({'document_id': doc_id}, {'$set': copied})
+        _publish(user_ids)
+
+
+async def remove_document(db, doc_id: str):
+    users = await db.document_members.find({'document_id': doc_id}, {'_id': 0, 'user_id': 1}).to_list(None)
+    await db.document_members.delete_many({'document_id': doc_id})
+    _publish(u['user_id'] for u in users)
+
+
+async def touch(db, doc_id: str, user_id: str, pinned: Optional[bool] = None, opened: bool = False) -> bool:
+    changes: Dict[str, Any] = {}
+    if opened:
+        changes['last_opened'] = datetime.utcnow().isoformat()
+    if pinned is not None:
+        changes['pinned'] = pinned
+    if not changes:
+        return True
+    result = await db.document_members.update_one({'user_id': user_id, 'document_id': doc_id}, {'$set': changes})
+    return bool(result.matched_count)
+
+
+async def list_for_user(db, user_id: str, view: str = 'recent', limit: int = 20) -> List[Dict[str, Any]]:
+    """Covered by member_recent / member_pinned: the projection only names index keys"""
+    query: Dict[str, Any] = {'user_id': user_id}
+    hint = 'member_recent'
+    if view == 'pinned':
+        query['pinned'] = True
+        hint = 'member_pinned'
+    cursor = db.document_members.find(query, PROJECTION).sort('last_opened', DESCENDING).hint(hint).limit(limit)
+    return await cursor.to_list(None)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['backfill'])
+    parser.add_argument('--mongo-url', default=os.environ.get('MONGO_URL', 'mongodb://localhost:27017'))
+    parser.add_argument('--db-name', default=os.environ.get('DB_NAME'))
+    args = parser.parse_args()
+    if not args.db_name:
+        parser.error("--db-name (or DB_NAME) is required")
+    from motor.motor_asyncio import AsyncIOMotorClient
+    client = AsyncIOMotorClient(args.mongo_url)
+    try:
+        db = client[args.db_name]
+        await ensure_indexes(db)
+        await backfill(db)
+        print(f"{await db.document_members.count_documents({})} memberships")
+    finally:
+        client.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,257 @@
+"""Backend-owned Firestore mirror of documents for the editor's realtime view.
+
+Saves call ``firestore_mirror.note(...)`` with the changed top-level fields and
+only the sections whose content changed. Notes for the same document are
+merged until the next flush (MIRROR_DEBOUNCE seconds), so rapid autosaves
+become one write, and a flush sends every pending document in Firestore
+``WriteBatch``es. Sections go into the ``section_map`` map field keyed by
+section_id, written with an explicit merge field list so each changed
+section is replaced whole and unchanged ones are never re-sent. A
+failed batch is put back under any newer changes and retried with
+exponential backoff, up to MIRROR_MAX_ATTEMPTS.
+
+The Firestore client comes from ``firebase_config.db`` (which honours
+FIRESTORE_EMULATOR_HOST); ``MemoryFirestore`` is an in-process stand-in with
+the same collection/document/batch surface for tests and local runs. The
+editor no longer writes to Firestore itself, so a mirror that is on
+(FIRESTORE_MIRROR=1, the default) but cannot create its client stops the
+server at startup instead of leaving the realtime view silently stale.
+"""
+import asyncio
+import copy
+import logging
+import os
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from fastapi.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+MIRROR_ENABLED = os.environ.get('FIRESTORE_MIRROR', '1') == '1'
+MIRROR_DEBOUNCE = float(os.environ.get('MIRROR_DEBOUNCE', '2'))
+MIRROR_MAX_ATTEMPTS = int(os.environ.get('MIRROR_MAX_ATTEMPTS', '6'))
+MIRROR_COLLECTION = 'documents'
+BATCH_LIMIT = 500  # Firestore's maximum writes per batch
+
+
+@dataclass
+class PendingWrite:
+    fields: Dict[str, Any] = field(default_factory=dict)
+    sections: Dict[str, Any] = field(default_factory=dict)
+    attempts: int = 0
+
+    def absorb(self, newer: 'PendingWrite'):
+        self.fields.update(newer.fields)
+        self.sections.update(newer.sections)
+
+    def payload(self) -> Dict[str, Any]:
+        data = dict(self.fields)
+        if self.sections:
+            data['section_map'] = self.sections
+        return data
+
+    def merge_paths(self) -> List[str]:
+        """Field paths replaced by the write; everything else in the mirror is left alone"""
+        return list(self.fields) + [f"section_map.{quote_field(sid)}" for sid in self.sections]
+
+
+def quote_field(name: str) -> str:
+    """Backtick-quote a field path element, so ids containing dots or spaces stay one element"""
+    return '`' + name.replace('\\', '\\\\').replace('`', '\\`') + '`'
+
+
+def default_client():
+    from firebase_config import db
+    return db
+
+
+class FirestoreMirror:
+    def __init__(self, client_factory: Callable[[], Any] = default_client, debounce: float = MIRROR_DEBOUNCE,
+                 max_attempts: int = MIRROR_MAX_ATTEMPTS, enabled: bool = MIRROR_ENABLED):
+        self.client_factory = client_factory
+        self.debounce = debounce
+        self.max_attempts = max_attempts
+        self.enabled = enabled
+        self._client = None
+        self._pending: Dict[str, PendingWrite] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.notes = 0
+        self.writes = 0
+        self.batches = 0
+        self.failures = 0
+        self.dropped = 0
+
+    def client(self):
+        if self._client is None:
+            self._client = self.client_factory()
+        return self._client
+
+    def note(self, doc_id: str, fields: Optional[Dict[str, Any]] = None, sections: Optional[Dict[str, Any]] = None):
+        if not self.enabled:
+            return
+        update = PendingWrite(fields=dict(fields or {}), sections=copy.deepcopy(sections or {}))
+        pending = self._pending.get(doc_id)
+        if pending is None:
+            self._pending[doc_id] = update
+        else:
+            pending.absorb(update)
+        self.notes += 1
+
+    def _commit(self, writes: Dict[str, PendingWrite]):
+        client = self.client()
+        items = list(writes.items())
+        for start in range(0, len(items), BATCH_LIMIT):
+            batch = client.batch()
+            for doc_id, write in items[start:start + BATCH_LIMIT]:
+                batch.set(client.collection(MIRROR_COLLECTION).document(doc_id), write.payload(), merge=write.merge_paths())
+            batch.commit()
+            self.batches += 1
+            self.writes += len(items[start:start + BATCH_LIMIT])
+
+    async def flush(self) -> bool:
+        """Write everything pending; returns False if the writes have to be retried"""
+        if not self._pending or not self.enabled:
+            return True
+        writes, self._pending = self._pending, {}
+        try:
+            await run_in_threadpool(self._commit, writes)
+            return True
+        except Exception as e:
+            self.failures += 1
+            logger.warning("Mirroring %d documents to Firestore failed: %s", len(writes), e)
+            for doc_id, write in writes.items():
+                write.attempts += 1
+                if write.attempts >= self.max_attempts:
+                    self.dropped += 1
+                    continue
+                newer = self._pending.get(doc_id)
+                if newer is not None:
+                    write.absorb(newer)
+                self._pending[doc_id] = write
+            return False
+
+    async def _run(self):
+        delay = self.debounce
+        while self.enabled:
+            await asyncio.sleep(delay)
+            delay = self.debounce if await self.flush() else min(delay * 2, 60.0)
+
+    async def start(self):
+        if not self.enabled:
+            return
+        try:
+            await run_in_threadpool(self.client)
+        except Exception as e:
+            raise RuntimeError(
+                f"The Firestore mirror is on but its client could not be created ({e}); "
+                "set Firestore credentials or FIRESTORE_MIRROR=0"
+            ) from e
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'enabled': self.enabled, 'pending': len(self._pending), 'notes': self.notes, 'writes': self.writes,
+            'batches': self.batches, 'failures': self.failures, 'dropped': self.dropped,
+        }
+
+
+def _merge(target: Dict[str, Any], data: Dict[str, Any]):
+    for key, value in data.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge(target[key], value)
+        else:
+            target[key] = copy.deepcopy(value)
+
+
+def _split_path(path: str) -> List[str]:
+    parts, current, quoted, escaped = [], '', False, False
+    for char in path:
+        if escaped:
+            current += char
+            escaped = False
+        elif char == '\\' and quoted:
+            escaped = True
+        elif char == '`':
+            quoted = not quoted
+        elif char == '.' and not quoted:
+            parts.append(current)
+            current = ''
+        else:
+            current += char
+    return parts + [current]
+
+
+def _merge_paths(target: Dict[str, Any], data: Dict[str, Any], paths: List[str]):
+    """Firestore set(..., merge=[paths]): each listed field is replaced whole"""
+    for path in paths:
+        keys = _split_path(path)
+        source, node = data, target
+        for key in keys[:-1]:
+            source = source[key]
+            node = node.setdefault(key, {})
+        node[keys[-1]] = copy.deepcopy(source[keys[-1]])
+
+
+class MemoryDocumentRef:
+    def __init__(self, store: Dict[str, Dict[str, Any]], path: str):
+        self._store = store
+        self.path = path
+
+    def get(self) -> Optional[Dict[str, Any]]:
+        return copy.deepcopy(self._store.get(self.path))
+
+
+class MemoryCollection:
+    def __init__(self, store, name: str):
+        self._store = store
+        self.name = name
+
+    def document(self, doc_id: str) -> MemoryDocumentRef:
+        return MemoryDocumentRef(self._store, f"{self.name}/{doc_id}")
+
+
+class MemoryWriteBatch:
+    def __init__(self, firestore: 'MemoryFirestore'):
+        self._firestore = firestore
+        self._writes = []
+
+    def set(self, ref: MemoryDocumentRef, data: Dict[str, Any], merge=False):
+        self._writes.append((ref.path, copy.deepcopy(data), merge))
+
+    def commit(self):
+        if len(self._writes) > BATCH_LIMIT:
+            raise ValueError("A batch may hold at most 500 writes")
+        if self._firestore.fail_next > 0:
+            self._firestore.fail_next -= 1
+            raise ConnectionError("Simulated Firestore outage")
+        for path, data, merge in self._writes:
+            if isinstance(merge, list):
+                _merge_paths(self._firestore.documents.setdefault(path, {}), data, merge)
+            elif merge:
+                _merge(self._firestore.documents.setdefault(path, {}), data)
+            else:
+                self._firestore.documents[path] = data
+        self._firestore.commits += 1
+
+
+class MemoryFirestore:
+    """Stand-in for google.cloud.firestore.Client: collection().document(), batch(), merge semantics"""
+
+    def __init__(self):
+        self.documents: Dict[str, Dict[str, Any]] = {}
+        self.commits = 0
+        self.fail_next = 0
+
+    def collection(self, name: str) -> MemoryCollection:
+        return MemoryCollection(self.documents, name)
+
+    def batch(self) -> MemoryWriteBatch:
+        return MemoryWriteBatch(self)
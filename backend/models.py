@@ -8,6 +8,10 @@ class UserRole(str, Enum):
     EDITOR = "editor"
     VIEWER = "viewer"
 
+class CollaboratorRole(str, Enum):
+    EDITOR = "editor"
+    VIEWER = "viewer"
+
 class User(BaseModel):
     model_config = ConfigDict(extra="ignore")
     uid: str
@@ -17,6 +21,13 @@ class User(BaseModel):
     created_at: datetime = Field(default_factory=datetime.utcnow)
     avatar_url: Optional[str] = None
 
+class UserSummary(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    uid: str
+    email: str
+    display_name: Optional[str] = None
+    avatar_url: Optional[str] = None
+
 class DocumentStatus(str, Enum):
     DRAFT = "draft"
     IN_REVIEW = "in_review"
@@ -42,6 +53,44 @@ class Document(BaseModel):
     sections: List[IMSection] = Field(default_factory=list)
     collaborators: List[str] = Field(default_factory=list)  # list of uids
     version: int = 1
+    template_id: Optional[str] = None
+    template_version: Optional[int] = None
+
+class DocumentMembership(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    document_id: str
+    title: str = ""
+    status: DocumentStatus = DocumentStatus.DRAFT
+    role: str = "editor"  # "owner", "editor", "viewer"
+    pinned: bool = False
+    last_opened: Optional[datetime] = None
+
+class DashboardDocument(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str
+    title: str = ""
+    status: DocumentStatus = DocumentStatus.DRAFT
+    created_by: Optional[str] = None
+    updated_at: Optional[datetime] = None
+    completion: Optional[float] = None  # fraction of sections with content
+
+class DashboardSummary(BaseModel):
+    user_id: str
+    total: int
+    counts: Dict[str, int]
+    recent: List[DashboardDocument]
+    needs_review: List[DashboardDocument]
+    average_completion: Optional[float] = None
+    complete_documents: int = 0
+    generated_at: datetime
+
+class DocumentTemplate(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    template_id: str
+    version: int
+    name: str
+    description: Optional[str] = None
+    sections: List[IMSection] = Field(default_factory=list)
 
 class Comment(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -65,6 +114,19 @@ class Notification(BaseModel):
     message: str
     document_id: str
     read: bool = False
+    changed_sections: List[str] = []
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class Attachment(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str
+    document_id: str
+    section_id: str
+    filename: str
+    content_type: str
+    length: int  # bytes
+    sha256: str
+    uploaded_by: Optional[str] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 class ExportFormat(str, Enum):
@@ -72,3 +134,4 @@ class ExportFormat(str, Enum):
     DOCX = "docx"
     JSON = "json"
     COMPILED = "compiled"
+    BUNDLE = "bundle"  # PDF plus the section attachments, zipped
@@ -0,0 +1,143 @@
+"""Coalesced "document_updated" notifications.
+
+Autosaves call ``update_notifier.note(...)``, which only merges the change
+into an in-process map keyed by (document, recipient). Every
+NOTIFY_COALESCE_SECONDS the map is written with one unordered ``bulk_write``
+of upserts: a recipient's existing unread "document_updated" notification for
+that document absorbs the new sections instead of a new one being created, so
+each window costs O(collaborators) writes however often the document is saved.
+The sections and editors accumulate across windows, so the message is not
+stored; ``message()`` builds it from the accumulated fields when the
+notification is read.
+"""
+import asyncio
+import logging
+import os
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_COALESCE_SECONDS = float(os.environ.get('NOTIFY_COALESCE_SECONDS', '60'))
+UNREAD_UPDATE = {'type': 'document_updated', 'read': False}
+
+
+@dataclass
+class PendingUpdate:
+    title: str
+    sections: Set[str] = field(default_factory=set)
+    editors: Set[str] = field(default_factory=set)
+    saves: int = 0
+
+
+def summary(title: str, sections: Iterable[str], editors: Iterable[str]) -> str:
+    names = ', '.join(sorted(editors)) or 'A collaborator'
+    count = len(set(sections))
+    if not count:
+        return f"{names} updated {title}"
+    return f"{names} updated {count} section{'s' if count != 1 else ''} of {title}"
+
+
+def message(notification: Dict[str, Any], names: Optional[Dict[str, str]] = None) -> str:
+    """Message of a stored notification; coalesced updates describe everything accumulated so far.
+
+    Editors are stored as uids; names maps them to display names (unknown uids are shown as is).
+    """
+    if notification.get('type') != UNREAD_UPDATE['type'] or 'document_title' not in notification:
+        return notification.get('message', '')
+    names = names or {}
+    editors = {names.get(uid, uid) for uid in notification.get('editors', [])}
+    return summary(notification['document_title'], notification.get('changed_sections', []), editors)
+
+
+class UpdateNotifier:
+    def __init__(self, get_db, window: float = NOTIFY_COALESCE_SECONDS):
+        self.get_db = get_db
+        self.window = window
+        self._pending: Dict[Tuple[str, str], PendingUpdate] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.saves = 0
+        self.written = 0
+
+    async def ensure_indexes(self):
+        # One unread update notification per (user, document); also serves the upsert filter
+        await self.get_db().notifications.create_index(
+            [('user_id', 1), ('document_id', 1)],
+            unique=True,
+            partialFilterExpression=UNREAD_UPDATE,
+            name='unread_document_updated',
+        )
+
+    def note(self, document_id: str, title: str, recipients: Iterable[str],
+             sections: Iterable[str] = (), actor: Optional[str] = None):
+        sections = list(sections)
+        for user_id in recipients:
+            if not user_id or user_id == actor:
+                continue
+            pending = self._pending.setdefault((document_id, user_id), PendingUpdate(title=title))
+            pending.title = title
+            pending.sections.update(sections)
+            if actor:
+                pending.editors.add(actor)
+            pending.saves += 1
+        self.saves += 1
+
+    def _operations(self, batch: Dict[Tuple[str, str], PendingUpdate]) -> List[UpdateOne]:
+        now = datetime.utcnow().isoformat()
+        operations = []
+        for (document_id, user_id), update in batch.items():
+            operations.append(UpdateOne(
+                {'user_id': user_id, 'document_id': document_id, **UNREAD_UPDATE},
+                {
+                    '$setOnInsert': {'id': str(uuid.uuid4())},
+                    '$set': {'title': 'Document updated', 'document_title': update.title, 'created_at': now},
+                    '$addToSet': {
+                        'changed_sections': {'$each': sorted(update.sections)},
+                        'editors': {'$each': sorted(update.editors)},
+                    },
+                    '$inc': {'saves': update.saves},
+                },
+                upsert=True,
+            ))
+        return operations
+
+    async def flush(self):
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        operations = self._operations(batch)
+        try:
+            try:
+                await self.get_db().notifications.bulk_write(operations, ordered=False)
+            except BulkWriteError as e:
+                # Another worker inserted the same notification first; the retry updates it
+                retry = [operations[err['index']] for err in e.details.get('writeErrors', []) if err.get('code') == 11000]
+                if len(retry) != len(e.details.get('writeErrors', [])):
+                    raise
+                await self.get_db().notifications.bulk_write(retry, ordered=False)
+            self.written += len(operations)
+        except PyMongoError as e:
+            logger.warning("Writing %d update notifications failed: %s", len(operations), e)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.window)
+            await self.flush()
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    def stats(self):
+        return {'pending': len(self._pending), 'saves': self.saves, 'written': self.written}
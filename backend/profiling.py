@@ -0,0 +1,251 @@
+"""On-demand request profiling.
+
+A request carrying ``X-Profile: 1`` (or ``?profile=1``) from an admin runs
+under pyinstrument's sampling profiler. The result is stored as a
+speedscope profile with an extra lane showing every MongoDB command issued
+while the request ran, and its id is returned in ``X-Profile-Id``.
+pyinstrument only samples the event-loop thread, so blocking work handed to
+``run_in_threadpool`` is wrapped in ``profiled(...)``: during a profiled
+request it runs under its own profiler and shows up as a worker-thread lane.
+Requests without the flag pass straight through. Only the newest
+PROFILE_KEEP profiles younger than PROFILE_MAX_AGE seconds are kept.
+"""
+import contextvars
+import functools
+import json
+import os
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from pymongo import monitoring
+
+PROFILE_DIR = Path(os.environ.get('PROFILE_DIR', '/tmp/profiles'))
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL', '0.001'))
+PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', '100'))
+PROFILE_MAX_AGE = float(os.environ.get('PROFILE_MAX_AGE', str(24 * 3600)))
+
+# Commands list of the profiled request running in this context; Motor copies the
+# context into its executor threads, so command events see the request that issued them
+_session: contextvars.ContextVar[Optional[List[Dict[str, Any]]]] = contextvars.ContextVar(
+    'mongo_profile_session', default=None)
+# Worker-thread profilers of the profiled request in this context; run_in_threadpool copies it too
+_threads: contextvars.ContextVar[Optional[List[tuple]]] = contextvars.ContextVar('thread_profiles', default=None)
+
+
+def profiled(fn: Callable) -> Callable:
+    """Wrap fn for run_in_threadpool so that a profiled request samples its thread as well"""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        threads = _threads.get()
+        if threads is None:
+            return fn(*args, **kwargs)
+        from pyinstrument import Profiler
+        profiler = Profiler(interval=PROFILE_INTERVAL, async_mode='disabled')
+        profiler.start()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            profiler.stop()
+            threads.append((fn.__name__, profiler))
+    return wrapper
+
+
+class MongoCommandTimer(monitoring.CommandListener):
+    """Records command timings for the profiled request that issued each command"""
+
+    def __init__(self):
+        self._inflight: Dict[int, tuple] = {}
+
+    def collect(self, commands: List[Dict[str, Any]]) -> contextvars.Token:
+        """Record commands issued from the current context into commands until stop(token)"""
+        return _session.set(commands)
+
+    def stop(self, token: contextvars.Token):
+        _session.reset(token)
+
+    def started(self, event):
+        session = _session.get()
+        if session is None:
+            return
+        target = event.command.get(event.command_name)
+        collection = target if isinstance(target, str) else None
+        self._inflight[event.request_id] = (session, time.perf_counter(), event.command_name, collection)
+
+    def succeeded(self, event):
+        self._finish(event, ok=True)
+
+    def failed(self, event):
+        self._finish(event, ok=False)
+
+    def _finish(self, event, ok: bool):
+        inflight = self._inflight.pop(event.request_id, None)
+        if inflight is None:
+            return
+        session, started, command, collection = inflight
+        session.append({
+            'command': command,
+            'collection': collection,
+            'start': started,
+            'duration_ms': event.duration_micros / 1000,
+            'ok': ok,
+        })
+
+
+mongo_timer = MongoCommandTimer()
+
+
+def _flag_set(scope) -> bool:
+    for name, value in scope['headers']:
+        if name == b'x-profile':
+            return value == b'1'
+    return b'profile=1' in scope.get('query_string', b'').split(b'&')
+
+
+def _mongo_lanes(speedscope: Dict[str, Any], commands: List[Dict[str, Any]], started: float, elapsed_ms: float):
+    """Append evented speedscope profiles with one frame per Mongo command"""
+    frames = speedscope['shared']['frames']
+    lanes: List[List[Dict[str, Any]]] = []
+    lane_ends: List[float] = []
+    for cmd in sorted(commands, key=lambda c: c['start']):
+        begin = (cmd['start'] - started) * 1000
+        end = begin + cmd['duration_ms']
+        frames.append({'name': f"mongo {cmd['command']} {cmd['collection'] or ''}".strip()})
+        frame = len(frames) - 1
+        # Overlapping commands (asyncio.gather) go to separate lanes so events stay nested
+        for i, lane_end in enumerate(lane_ends):
+            if lane_end <= begin:
+                break
+        else:
+            lanes.append([])
+            lane_ends.append(0.0)
+            i = len(lanes) - 1
+        lanes[i] += [{'type': 'O', 'frame': frame, 'at': begin}, {'type': 'C', 'frame': frame, 'at': end}]
+        lane_ends[i] = end
+    for n, events in enumerate(lanes):
+        speedscope['profiles'].append({
+            'type': 'evented',
+            'name': f"MongoDB commands ({n + 1})",
+            'unit': 'milliseconds',
+            'startValue': 0,
+            'endValue': max(elapsed_ms, events[-1]['at']),
+            'events': events,
+        })
+
+
+def _thread_lanes(speedscope: Dict[str, Any], threads: List[tuple], started_at: float):
+    """Append the worker-thread profiles, shifted onto the request's timeline (seconds)"""
+    from pyinstrument.renderers import SpeedscopeRenderer
+
+    frames = speedscope['shared']['frames']
+    for name, profiler in threads:
+        part = json.loads(profiler.output(renderer=SpeedscopeRenderer()))
+        offset = len(frames)
+        frames.extend(part['shared']['frames'])
+        shift = profiler.last_session.start_time - started_at
+        for profile in part['profiles']:
+            profile['name'] = f"Worker thread: {name}"
+            profile['startValue'] += shift
+            profile['endValue'] += shift
+            for event in profile['events']:
+                event['frame'] += offset
+                event['at'] += shift
+            speedscope['profiles'].append(profile)
+
+
+def _rotate(keep: int = PROFILE_KEEP, max_age: float = PROFILE_MAX_AGE):
+    """Delete profiles beyond the newest keep, and any older than max_age seconds"""
+    profiles = []
+    for path in PROFILE_DIR.glob('*.speedscope.json'):
+        try:
+            profiles.append((path.stat().st_mtime, path))
+        except FileNotFoundError:
+            continue
+    profiles.sort(reverse=True)
+    cutoff = time.time() - max_age
+    for n, (mtime, path) in enumerate(profiles):
+        if n >= keep or mtime < cutoff:
+            path.unlink(missing_ok=True)
+
+
+def profile_path(profile_id: str) -> Optional[Path]:
+    """Location of a stored profile, or None if it does not exist"""
+    if not profile_id.isalnum():
+        return None
+    path = PROFILE_DIR / f"{profile_id}.speedscope.json"
+    return path if path.is_file() else None
+
+
+class ProfilingMiddleware:
+    """ASGI middleware that profiles flagged requests from admins"""
+
+    def __init__(self, app, authorize: Callable[[Dict[str, Any]], Awaitable[bool]]):
+        self.app = app
+        self.authorize = authorize
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not _flag_set(scope):
+            await self.app(scope, receive, send)
+            return
+        if not await self.authorize(scope):
+            await _send_json(send, 403, {'detail': "Profiling requires an admin user"})
+            return
+        try:
+            from pyinstrument import Profiler
+            from pyinstrument.renderers import SpeedscopeRenderer
+        except ImportError:
+            await _send_json(send, 501, {'detail': "pyinstrument is not installed"})
+            return
+
+        # Profiled responses are buffered so the timing headers can be added at the end
+        messages = []
+
+        async def buffer(message):
+            messages.append(message)
+
+        commands: List[Dict[str, Any]] = []
+        threads: List[tuple] = []
+        token = mongo_timer.collect(commands)
+        threads_token = _threads.set(threads)
+        profiler = Profiler(interval=PROFILE_INTERVAL, async_mode='enabled')
+        started = time.perf_counter()
+        profiler.start()
+        try:
+            await self.app(scope, receive, buffer)
+        finally:
+            profiler.stop()
+            _threads.reset(threads_token)
+            mongo_timer.stop(token)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        profile_id = uuid.uuid4().hex
+        speedscope = json.loads(profiler.output(renderer=SpeedscopeRenderer()))
+        speedscope['name'] = f"{scope['method']} {scope['path']}"
+        _mongo_lanes(speedscope, commands, started, elapsed_ms)
+        _thread_lanes(speedscope, threads, profiler.last_session.start_time)
+        PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+        (PROFILE_DIR / f"{profile_id}.speedscope.json").write_text(json.dumps(speedscope))
+        _rotate()
+
+        mongo_ms = sum(c['duration_ms'] for c in commands)
+        extra = [
+            (b'x-profile-id', profile_id.encode()),
+            (b'server-timing', (
+                f'total;dur={elapsed_ms:.1f}, mongo;dur={mongo_ms:.1f};desc="{len(commands)} commands"'
+            ).encode()),
+        ]
+        for message in messages:
+            if message['type'] == 'http.response.start':
+                message['headers'] = list(message.get('headers', [])) + extra
+            await send(message)
+
+
+async def _send_json(send, status: int, body: Dict[str, Any]):
+    payload = json.dumps(body).encode()
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(payload)).encode())],
+    })
+    await send({'type': 'http.response.body', 'body': payload})
@@ -0,0 +1,233 @@
+"""Per-user rate limiting and admission control for expensive routes.
+
+Each route class (export, import, update, comment) has a token bucket per
+user, configured with RATE_LIMITS, e.g. ``export=10/60,update=120/60``
+(requests per seconds; the bucket holds that many). Buckets live in
+memory, or in the ``rate_limits`` collection when RATE_LIMIT_BACKEND=mongo
+so that all workers share them. CONCURRENCY_LIMITS caps in-flight requests
+per class in this worker; extra requests wait up to RATE_LIMIT_QUEUE_TIMEOUT
+seconds and are then shed with 429.
+
+Callers are identified by their verified uid, else their address (a user id
+in the path or a header is the client's claim, so it never picks the bucket).
+Behind a load balancer set
+RATE_LIMIT_TRUSTED_PROXIES to the number of proxies that append to
+X-Forwarded-For; the address is then read from that header, counting that
+many entries from the right, since anything further left is client-supplied.
+"""
+import asyncio
+import math
+import os
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+from fastapi import HTTPException, Request
+
+ROUTE_CLASSES = ("export", "import", "update", "comment")
+
+
+@dataclass(frozen=True)
+class Limit:
+    capacity: float
+    rate: float  # tokens per second
+
+
+def parse_limits(spec: str) -> Dict[str, Limit]:
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        name, _, value = item.partition('=')
+        count, _, seconds = value.partition('/')
+        limits[name] = Limit(capacity=float(count), rate=float(count) / float(seconds or 1))
+    return limits
+
+
+def parse_caps(spec: str) -> Dict[str, int]:
+    caps = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        name, _, value = item.partition('=')
+        caps[name] = int(value)
+    return caps
+
+
+RATE_LIMITS = parse_limits(os.environ.get('RATE_LIMITS', 'export=10/60,import=10/60,update=120/60,comment=60/60'))
+CONCURRENCY_LIMITS = parse_caps(os.environ.get('CONCURRENCY_LIMITS', 'export=4,import=2'))
+QUEUE_TIMEOUT = float(os.environ.get('RATE_LIMIT_QUEUE_TIMEOUT', '2'))
+BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')
+TRUSTED_PROXIES = int(os.environ.get('RATE_LIMIT_TRUSTED_PROXIES', '0'))
+
+
+class MemoryBackend:
+    """Token buckets in this process"""
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+
+    async def take(self, key: str, limit: Limit) -> float:
+        """Consume one token; returns 0 if allowed, else seconds until one is available"""
+        now = time.monotonic()
+        tokens, stamp = self._buckets.get(key, (limit.capacity, now))
+        tokens = min(limit.capacity, tokens + (now - stamp) * limit.rate)
+        if tokens >= 1:
+            self._buckets[key] = (tokens - 1, now)
+            retry_after = 0.0
+        else:
+            self._buckets[key] = (tokens, now)
+            retry_after = (1 - tokens) / limit.rate
+        if len(self._buckets) > self.max_keys:
+            self._prune(now)
+        return retry_after
+
+    def _prune(self, now: float):
+        # A bucket idle long enough to refill completely carries no state
+        oldest = now - max((l.capacity / l.rate for l in RATE_LIMITS.values()), default=60)
+        self._buckets = {k: v for k, v in self._buckets.items() if v[1] > oldest}
+
+
+class MongoBackend:
+    """Token buckets shared by all workers, updated atomically with a pipeline upsert"""
+
+    def __init__(self, get_db):
+        self.get_db = get_db
+
+    async def take(self, key: str, limit: Limit) -> float:
+        now = '$$NOW'
+        refill_ms = int(limit.capacity / limit.rate * 1000)
+        elapsed_s = {'$divide': [{'$subtract': [now, {'$ifNull': ['$ts', now]}]}, 1000]}
+        bucket = await self.get_db().rate_limits.find_one_and_update(
+            {'_id': key},
+            [
+                {'$set': {
+                    'tokens': {'$min': [limit.capacity, {'$add': [
+                        {'$ifNull': ['$tokens', limit.capacity]}, {'$multiply': [elapsed_s, limit.rate]},
+                    ]}]},
+                    'ts': now,
+                }},
+                {'$set': {'allowed': {'$gte': ['$tokens', 1]}}},
+                {'$set': {
+                    'tokens': {'$cond': ['$allowed', {'$subtract': ['$tokens', 1]}, '$tokens']},
+                    'expires_at': {'$add': [now, refill_ms]},
+                }},
+            ],
+            upsert=True,
+            return_document=True,
+        )
+        if bucket['allowed']:
+            return 0.0
+        return (1 - bucket['tokens']) / limit.rate
+
+    async def ensure_indexes(self):
+        await self.get_db().rate_limits.create_index('expires_at', expireAfterSeconds=0)
+
+
+class ConcurrencyGate:
+    """Caps in-flight requests; waiters give up after the queue timeout"""
+
+    def __init__(self, limit: int, max_waiting: Optional[int] = None):
+        self.limit = limit
+        self.max_waiting = max_waiting if max_waiting is not None else limit * 4
+        self._semaphore = asyncio.Semaphore(limit)
+        self.waiting = 0
+        self.in_flight = 0
+
+    async def acquire(self, timeout: float) -> bool:
+        if self._semaphore.locked() and self.waiting >= self.max_waiting:
+            return False
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        return True
+
+    def release(self):
+        self.in_flight -= 1
+        self._semaphore.release()
+
+
+class RateLimiter:
+    def __init__(self, backend, limits: Dict[str, Limit], caps: Dict[str, int], queue_timeout: float):
+        self.backend = backend
+        self.limits = limits
+        self.gates = {name: ConcurrencyGate(cap) for name, cap in caps.items()}
+        self.queue_timeout = queue_timeout
+        self.counters: Dict[Tuple[str, str], int] = defaultdict(int)
+
+    async def check(self, route_class: str, identity: str):
+        limit = self.limits.get(route_class)
+        if limit is None:
+            return
+        retry_after = await self.backend.take(f"{route_class}:{identity}", limit)
+        if retry_after > 0:
+            self.counters[(route_class, 'limited')] += 1
+            raise HTTPException(
+                status_code=429,
+                detail=f"Too many {route_class} requests",
+                headers={'Retry-After': str(math.ceil(retry_after))},
+            )
+        self.counters[(route_class, 'allowed')] += 1
+
+    async def enter(self, route_class: str) -> Optional[ConcurrencyGate]:
+        gate = self.gates.get(route_class)
+        if gate is None:
+            return None
+        if gate.in_flight >= gate.limit:
+            self.counters[(route_class, 'queued')] += 1
+        if not await gate.acquire(self.queue_timeout):
+            self.counters[(route_class, 'shed')] += 1
+            raise HTTPException(
+                status_code=429,
+                detail=f"Server busy with {route_class} requests",
+                headers={'Retry-After': str(max(1, math.ceil(self.queue_timeout)))},
+            )
+        return gate
+
+    def render_metrics(self) -> str:
+        """Prometheus text exposition of the limiter counters and gate state"""
+        lines = [
+            "# HELP im_rate_limit_requests_total Requests seen by the rate limiter, by outcome",
+            "# TYPE im_rate_limit_requests_total counter",
+        ]
+        for (route_class, outcome), value in sorted(self.counters.items()):
+            lines.append(f'im_rate_limit_requests_total{{route_class="{route_class}",outcome="{outcome}"}} {value}')
+        lines += [
+            "# HELP im_rate_limit_limit_per_second Configured refill rate per user",
+            "# TYPE im_rate_limit_limit_per_second gauge",
+        ]
+        for route_class, limit in sorted(self.limits.items()):
+            lines.append(f'im_rate_limit_limit_per_second{{route_class="{route_class}"}} {limit.rate:g}')
+        lines += [
+            "# HELP im_concurrency_in_flight Requests currently holding a concurrency slot",
+            "# TYPE im_concurrency_in_flight gauge",
+        ]
+        for route_class, gate in sorted(self.gates.items()):
+            lines.append(f'im_concurrency_in_flight{{route_class="{route_class}"}} {gate.in_flight}')
+        lines += [
+            "# HELP im_concurrency_waiting Requests queued for a concurrency slot",
+            "# TYPE im_concurrency_waiting gauge",
+        ]
+        for route_class, gate in sorted(self.gates.items()):
+            lines.append(f'im_concurrency_waiting{{route_class="{route_class}"}} {gate.waiting}')
+        return "\n".join(lines) + "\n"
+
+
+def client_address(request: Request, trusted_proxies: int = TRUSTED_PROXIES) -> str:
+    """The caller's address; X-Forwarded-For is only read as far as trusted proxies wrote it"""
+    if trusted_proxies > 0:
+        forwarded = [a.strip() for a in request.headers.get('x-forwarded-for', '').split(',') if a.strip()]
+        if forwarded:
+            return forwarded[-min(trusted_proxies, len(forwarded))]
+    return request.client.host if request.client else 'unknown'
+
+
+def request_identity(request: Request) -> str:
+    """Verified uid, else the client address; never a user id the client supplies"""
+    principal = getattr(request.state, 'principal', None)
+    if principal is not None:
+        return f"user:{principal.uid}"
+    return f"ip:{client_address(request)}"
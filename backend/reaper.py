@@ -0,0 +1,129 @@
+"""Background removal of soft-deleted documents.
+
+Deleting a document only stamps ``deleted_at`` on it (a tombstone), which
+hides it from every read path, so the request costs the same however many
+comments or notifications hang off it. The reaper picks up tombstones,
+deletes their dependent records in batches of REAPER_BATCH_SIZE, recording
+progress on the tombstone under ``reap``, drops cached exports and finally
+removes the document itself. A lease on the tombstone keeps workers from
+reaping the same document concurrently; an expired lease is picked up again.
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List
+
+from fastapi.concurrency import run_in_threadpool
+from pymongo.errors import PyMongoError
+
+import export_cache
+
+logger = logging.getLogger(__name__)
+
+REAPER_INTERVAL = float(os.environ.get('REAPER_INTERVAL', '30'))
+REAPER_BATCH_SIZE = int(os.environ.get('REAPER_BATCH_SIZE', '500'))
+REAPER_GRACE = float(os.environ.get('REAPER_GRACE', '0'))
+REAPER_LEASE = float(os.environ.get('REAPER_LEASE', '300'))
+
+# Collections holding records that belong to a document, with their document field
+DEPENDENTS = {
+    'comments': 'document_id',
+    'notifications': 'document_id',
+    'revisions': 'document_id',
+    'document_members': 'document_id',
+    'activity': 'document_id',
+}
+
+
+class Reaper:
+    def __init__(self, get_db, interval: float = REAPER_INTERVAL, batch_size: int = REAPER_BATCH_SIZE,
+                 grace: float = REAPER_GRACE, lease: float = REAPER_LEASE):
+        self.get_db = get_db
+        self.interval = interval
+        self.batch_size = batch_size
+        self.grace = grace
+        self.lease = lease
+        # Extra async cleanups per document, e.g. dropping its cold-storage blob
+        self.hooks: List[Callable[[str], Awaitable[None]]] = []
+        self._task = None
+        self.documents_reaped = 0
+        self.records_removed: Dict[str, int] = {name: 0 for name in DEPENDENTS}
+
+    async def ensure_indexes(self):
+        db = self.get_db()
+        await db.documents.create_index(
+            'deleted_at', partialFilterExpression={'deleted_at': {'$exists': True}}, name='tombstones'
+        )
+        for collection, field in DEPENDENTS.items():
+            await db[collection].create_index(field)
+
+    async def claim(self):
+        """Lease the oldest tombstone that is past the grace period and not being reaped (as it was before the lease)"""
+        now = datetime.utcnow()
+        return await self.get_db().documents.find_one_and_update(
+            {
+                'deleted_at': {'$lte': (now - timedelta(seconds=self.grace)).isoformat()},
+                '$or': [{'reap.lease_until': {'$exists': False}}, {'reap.lease_until': {'$lt': now.isoformat()}}],
+            },
+            {'$set': {'reap.lease_until': (now + timedelta(seconds=self.lease)).isoformat()}},
+            projection={'_id': 0, 'id': 1, 'reap': 1},
+            sort=[('deleted_at', 1)],
+        )
+
+    async def reap(self, doc_id: str):
+        db = self.get_db()
+        for collection, field in DEPENDENTS.items():
+            while True:
+                ids = [r['_id'] for r in await db[collection].find({field: doc_id}, {'_id': 1}).limit(self.batch_size).to_list(None)]
+                if not ids:
+                    break
+                result = await db[collection].delete_many({'_id': {'$in': ids}})
+                self.records_removed[collection] += result.deleted_count
+                await db.documents.update_one(
+                    {'id': doc_id},
+                    {
+                        '$inc': {f'reap.removed.{collection}': result.deleted_count},
+                        '$set': {'reap.lease_until': (datetime.utcnow() + timedelta(seconds=self.lease)).isoformat()},
+                    },
+                )
+                if len(ids) < self.batch_size:
+                    break
+        await run_in_threadpool(export_cache.purge, doc_id)
+        for hook in self.hooks:
+            await hook(doc_id)
+        await db.documents.delete_one({'id': doc_id, 'deleted_at': {'$exists': True}})
+        self.documents_reaped += 1
+
+    async def run_once(self) -> int:
+        """Reap every tombstone that is due; returns the number of documents removed"""
+        reaped = 0
+        while True:
+            tombstone = await self.claim()
+            if not tombstone:
+                return reaped
+            await self.reap(tombstone['id'])
+            reaped += 1
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except PyMongoError as e:
+                logger.warning("Reaping deleted documents failed: %s", e)
+            except Exception:
+                logger.exception("Reaping deleted documents failed")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def stats(self):
+        pending = await self.get_db().documents.count_documents({'deleted_at': {'$exists': True}})
+        return {'pending': pending, 'documents_reaped': self.documents_reaped, 'records_removed': self.records_removed}
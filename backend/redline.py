@@ -0,0 +1,232 @@
+"""Revision snapshots and "changes since last review" redlines.
+
+Whenever a document enters ``in_review`` its title, status and sections are
+copied into ``revisions`` by a server-side ``$merge``, so the snapshot never
+travels through the app. A redline compares two versions (a revision
+against the current document, or two revisions):
+
+* sections whose content digest is unchanged are skipped without being
+  looked at, so large untouched annexures cost one hash each;
+* changed sections are compared field by field;
+* changed text is diffed line by line first, and only the replaced blocks
+  are diffed word by word (blocks over REDLINE_MAX_BLOCK_TOKENS tokens are
+  shown as a whole deletion and insertion instead);
+* unchanged runs are cut down to REDLINE_CONTEXT_WORDS words either side
+  of a change.
+
+The result is plain data; export_pdf and export_docx render it.
+"""
+import os
+import re
+import uuid
+from datetime import datetime
+from difflib import SequenceMatcher
+from typing import Any, Dict, List, Optional, Tuple
+
+from activity import section_digests
+from export_compiled import label
+
+REDLINE_CONTEXT_WORDS = int(os.environ.get('REDLINE_CONTEXT_WORDS', '12'))
+REDLINE_MAX_BLOCK_TOKENS = int(os.environ.get('REDLINE_MAX_BLOCK_TOKENS', '20000'))
+REVIEW = 'in_review'
+ELLIPSIS = '…'
+
+TOKEN = re.compile(r'\s+|\S+')
+Segment = Tuple[str, str]  # ('equal' | 'delete' | 'insert', text)
+
+
+async def ensure_indexes(db):
+    await db.revisions.create_index('id', unique=True)
+    await db.revisions.create_index([('document_id', 1), ('reason', 1), ('created_at', -1)])
+
+
+async def snapshot(db, doc_id: str, reason: str, actor: Optional[str] = None) -> Optional[str]:
+    """Copy the document's current content into ``revisions``; returns the revision id"""
+    revision_id = str(uuid.uuid4())
+    await db.documents.aggregate([
+        {'$match': {'id': doc_id, 'deleted_at': {'$exists': False}, 'archived': {'$exists': False}}},
+        {'$project': {
+            '_id': 0, 'title': 1, 'status': 1, 'sections': 1,
+            'id': {'$literal': revision_id},
+            'document_id': '$id',
+            'document_updated_at': '$updated_at',
+            'reason': {'$literal': reason},
+            'created_by': {'$literal': actor},
+            'created_at': {'$literal': datetime.utcnow().isoformat()},
+        }},
+        {'$merge': {'into': 'revisions', 'whenMatched': 'fail', 'whenNotMatched': 'insert'}},
+    ]).to_list(None)
+    return revision_id if await db.revisions.find_one({'id': revision_id}, {'_id': 1}) else None
+
+
+async def list_revisions(db, doc_id: str) -> List[Dict[str, Any]]:
+    return await db.revisions.find(
+        {'document_id': doc_id}, {'_id': 0, 'sections': 0}
+    ).sort('created_at', -1).to_list(None)
+
+
+async def get_revision(db, doc_id: str, revision_id: str) -> Optional[Dict[str, Any]]:
+    return await db.revisions.find_one({'id': revision_id, 'document_id': doc_id}, {'_id': 0})
+
+
+async def last_review(db, doc: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """The review snapshot to compare against: while a review is open that is the one before it"""
+    skip = 1 if doc.get('status') == REVIEW else 0
+    found = await db.revisions.find({'document_id': doc['id'], 'reason': REVIEW}, {'_id': 0}).sort(
+        'created_at', -1).skip(skip).limit(1).to_list(None)
+    return found[0] if found else None
+
+
+# Diffing
+
+def value_text(value: Any) -> str:
+    """Field value as text: tables become one row per line, nested fields 'Label: value' lines"""
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'Yes' if value else 'No'
+    if isinstance(value, dict):
+        return '\n'.join(f"{label(k)}: {value_text(v)}" for k, v in value.items() if not _blank(v))
+    if isinstance(value, list):
+        return '\n'.join(
+            ' | '.join(f"{label(k)}: {value_text(v)}" for k, v in item.items()) if isinstance(item, dict) else value_text(item)
+            for item in value
+        )
+    return str(value)
+
+
+def _blank(value: Any) -> bool:
+    return value in (None, '', [], {})
+
+
+def _word_ops(old: List[str], new: List[str]) -> List[Tuple[str, List[str]]]:
+    head = 0
+    while head < len(old) and head < len(new) and old[head] == new[head]:
+        head += 1
+    tail = 0
+    while tail < len(old) - head and tail < len(new) - head and old[-1 - tail] == new[-1 - tail]:
+        tail += 1
+    ops = [('equal', old[:head])]
+    middle_old, middle_new = old[head:len(old) - tail], new[head:len(new) - tail]
+    if len(middle_old) + len(middle_new) > REDLINE_MAX_BLOCK_TOKENS:
+        ops += [('delete', middle_old), ('insert', middle_new)]
+    else:
+        for tag, i1, i2, j1, j2 in SequenceMatcher(None, middle_old, middle_new, autojunk=False).get_opcodes():
+            if tag == 'equal':
+                ops.append(('equal', middle_old[i1:i2]))
+            else:
+                ops += [('delete', middle_old[i1:i2]), ('insert', middle_new[j1:j2])]
+    ops.append(('equal', old[len(old) - tail:] if tail else []))
+    return ops
+
+
+def _shorten(tokens: List[str], head: int, tail: int) -> str:
+    words = [i for i, t in enumerate(tokens) if not t.isspace()]
+    if len(words) <= head + tail + 1:
+        return ''.join(tokens)
+    first = ''.join(tokens[:words[head - 1] + 1]) if head else ''
+    last = ''.join(tokens[words[-tail]:]) if tail else ''
+    return ' '.join(part for part in (first, ELLIPSIS, last) if part)
+
+
+def diff_text(old: str, new: str, context: int = REDLINE_CONTEXT_WORDS) -> List[Segment]:
+    """Word-level redline of old -> new as (op, text) segments, unchanged stretches shortened"""
+    old_lines, new_lines = old.splitlines(keepends=True), new.splitlines(keepends=True)
+    ops: List[Tuple[str, List[str]]] = []
+    for tag, i1, i2, j1, j2 in SequenceMatcher(None, old_lines, new_lines, autojunk=False).get_opcodes():
+        before = TOKEN.findall(''.join(old_lines[i1:i2]))
+        after = TOKEN.findall(''.join(new_lines[j1:j2]))
+        if tag == 'equal':
+            ops.append(('equal', before))
+        elif tag == 'replace':
+            ops += _word_ops(before, after)
+        else:
+            ops += [('delete', before), ('insert', after)]
+
+    merged: List[Tuple[str, List[str]]] = []
+    for op, tokens in ops:
+        if not tokens:
+            continue
+        if merged and merged[-1][0] == op:
+            merged[-1][1].extend(tokens)
+        else:
+            merged.append((op, list(tokens)))
+
+    segments = []
+    for i, (op, tokens) in enumerate(merged):
+        if op == 'equal':
+            text = _shorten(tokens, context if i > 0 else 0, context if i < len(merged) - 1 else 0)
+        else:
+            text = ''.join(tokens)
+        segments.append((op, text))
+    return segments
+
+
+def diff_content(old: Dict[str, Any], new: Dict[str, Any]) -> List[Dict[str, Any]]:
+    fields = []
+    for key in list(new) + [k for k in old if k not in new]:
+        before, after = old.get(key), new.get(key)
+        if before == after or (_blank(before) and _blank(after)):
+            continue
+        change = 'added' if _blank(before) else 'removed' if _blank(after) else 'changed'
+        segments = diff_text(value_text(before), value_text(after))
+        if any(op != 'equal' for op, _ in segments):
+            fields.append({'key': key, 'label': label(key), 'change': change, 'segments': segments})
+    return fields
+
+
+def _version(doc: Dict[str, Any]) -> Dict[str, Any]:
+    if 'document_id' in doc:
+        return {'revision_id': doc['id'], 'created_at': doc.get('created_at'), 'status': doc.get('status'),
+                'reason': doc.get('reason')}
+    return {'revision_id': None, 'created_at': doc.get('updated_at'), 'status': doc.get('status'), 'reason': 'current'}
+
+
+def diff_documents(old: Dict[str, Any], new: Dict[str, Any]) -> Dict[str, Any]:
+    """Changed sections only, in the newer version's order (removed sections last)"""
+    old_sections = {s['section_id']: s for s in old.get('sections') or [] if 'section_id' in s}
+    new_sections = [s for s in new.get('sections') or [] if 'section_id' in s]
+    old_digests = section_digests(list(old_sections.values()))
+    new_digests = section_digests(new_sections)
+    new_ids = {s['section_id'] for s in new_sections}
+
+    sections = []
+    unchanged = 0
+    for section in new_sections + [s for sid, s in old_sections.items() if sid not in new_ids]:
+        sid = section['section_id']
+        if old_digests.get(sid) == new_digests.get(sid):
+            unchanged += 1
+            continue
+        previous = old_sections.get(sid)
+        if previous is None:
+            change = 'added'
+        elif sid not in new_ids:
+            change = 'removed'
+        else:
+            change = 'changed'
+        fields = diff_content(
+            (previous or {}).get('content') or {},
+            {} if change == 'removed' else section.get('content') or {},
+        )
+        renamed = previous is not None and previous.get('title') != section.get('title')
+        if not fields and not renamed and change == 'changed':
+            unchanged += 1  # only instructions or display flags differ
+            continue
+        sections.append({
+            'section_id': sid,
+            'section_number': section.get('section_number', ''),
+            'title': section.get('title', ''),
+            'previous_title': previous.get('title') if renamed else None,
+            'change': change,
+            'fields': fields,
+        })
+
+    return {
+        'document_id': new.get('document_id') or new.get('id'),
+        'title': new.get('title', ''),
+        'previous_title': old.get('title') if old.get('title') != new.get('title') else None,
+        'base': _version(old),
+        'target': _version(new),
+        'sections': sections,
+        'unchanged_sections': unchanged,
+    }
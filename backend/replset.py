@@ -0,0 +1,76 @@
+"""Throwaway single-node replica set for local testing.
+
+Change streams (cache.watch_invalidations) only work against a replica
+set. This starts a ``mongod --replSet`` in a temporary directory and
+initiates it:
+
+    python replset.py --port 27018
+    MONGO_URL=mongodb://127.0.0.1:27018/?replicaSet=rs0 CACHE_CHANGE_STREAMS=1 python server.py
+"""
+import argparse
+import shutil
+import subprocess
+import tempfile
+import time
+from typing import Optional, Tuple
+
+from pymongo import MongoClient
+from pymongo.errors import OperationFailure, PyMongoError
+
+
+def start_replset(port: int = 27018, dbpath: Optional[str] = None, name: str = "rs0",
+                  timeout: float = 30.0) -> Tuple[subprocess.Popen, str]:
+    """Start mongod as a one-member replica set; returns the process and its URL"""
+    mongod = shutil.which("mongod")
+    if not mongod:
+        raise RuntimeError("mongod not found on PATH")
+    dbpath = dbpath or tempfile.mkdtemp(prefix="im-replset-")
+    proc = subprocess.Popen(
+        [mongod, "--replSet", name, "--port", str(port), "--dbpath", dbpath, "--bind_ip", "127.0.0.1", "--quiet"],
+        stdout=subprocess.DEVNULL,
+    )
+    client = MongoClient(f"mongodb://127.0.0.1:{port}/?directConnection=true", serverSelectionTimeoutMS=1000)
+    deadline = time.monotonic() + timeout
+    initiated = False
+    try:
+        while time.monotonic() < deadline:
+            if proc.poll() is not None:
+                raise RuntimeError(f"mongod exited with {proc.returncode}")
+            try:
+                if not initiated:
+                    try:
+                        client.admin.command("replSetInitiate", {
+                            '_id': name,
+                            'members': [{'_id': 0, 'host': f"127.0.0.1:{port}"}],
+                        })
+                    except OperationFailure as e:
+                        if e.code != 23:  # AlreadyInitialized
+                            raise
+                    initiated = True
+                if client.admin.command("hello").get('isWritablePrimary'):
+                    return proc, f"mongodb://127.0.0.1:{port}/?replicaSet={name}"
+            except PyMongoError:
+                pass
+            time.sleep(0.25)
+    finally:
+        client.close()
+    proc.terminate()
+    raise RuntimeError("Replica set did not elect a primary in time")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local single-node replica set")
+    parser.add_argument("--port", type=int, default=27018)
+    parser.add_argument("--dbpath")
+    args = parser.parse_args()
+    proc, url = start_replset(args.port, args.dbpath)
+    print(url, flush=True)
+    try:
+        proc.wait()
+    except KeyboardInterrupt:
+        proc.terminate()
+        proc.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,16 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, APIRouter, HTTPException, Request, Depends, Header
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse, PlainTextResponse
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Awaitable, Callable
+from urllib.parse import quote
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import asyncio
 import uuid
 import json
+import logging
 from datetime import datetime
 from pathlib import Path
 from dotenv import load_dotenv
@@ -14,14 +18,45 @@ from dotenv import load_dotenv
 # Load environment variables
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
+logger = logging.getLogger(__name__)
+
+from profiling import ProfilingMiddleware, mongo_timer, profile_path, profiled
+import cache
+import auth
+import members
+import dashboard
+import redline
+from storage import MongoStorage
+from mirror import FirestoreMirror
+from reaper import Reaper
+from archive import Archiver
+from attachments import AttachmentStore, AttachmentTooLarge
+import http_ranges
+import signed_urls
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-mongo_client = AsyncIOMotorClient(mongo_url)
-mongo_db = mongo_client[os.environ['DB_NAME']]
+
+def connect_mongo():
+    """(Re)create the Mongo client; forked workers call this again"""
+    global mongo_client, mongo_db
+    mongo_client = AsyncIOMotorClient(mongo_url, event_listeners=[mongo_timer])
+    mongo_db = mongo_client[os.environ['DB_NAME']]
+
+connect_mongo()
 
 # Import models
-from models import User, UserRole, Document, DocumentStatus, Comment, Notification, IMSection, ExportFormat
+from models import User, UserRole, CollaboratorRole, Document, DocumentStatus, Comment, Notification, IMSection, ExportFormat, DocumentTemplate, UserSummary, DocumentMembership, DashboardSummary, Attachment
+from im_templates import template_registry
+from export_compiled import iter_html, iter_txt
+from export_pdf import fragment_cache
+import export_cache
+import ratelimit
+from idempotency import IdempotencyStore, fingerprint
+from activity import ActivityLog, section_digests, changed_sections
+import notifier
+from notifier import UpdateNotifier
+from directory import UserDirectory
 from resend_config import send_comment_notification
 
 app = FastAPI(title="Redwood IM Platform API")
@@ -35,21 +70,168 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Caches, kept coherent across workers by a change stream (CACHE_CHANGE_STREAMS=1)
+user_cache = cache.LocalCache(maxsize=2048, ttl=300)
+cache.subscribe('users', user_cache.invalidate)
+user_directory = UserDirectory(lambda: mongo_db)
+cache.subscribe('users', user_directory.invalidate)
+cache.subscribe('templates', template_registry.invalidate)
+background_tasks = []
+# Plain CRUD goes through the storage interface (storage.py); Mongo-only features use mongo_db.
+# Always Mongo: other engines would split reads from the writes that still go to mongo_db.
+store = MongoStorage(lambda: mongo_db)
+firestore_mirror = FirestoreMirror()
+activity_log = ActivityLog(lambda: mongo_db)
+update_notifier = UpdateNotifier(lambda: mongo_db)
+reaper = Reaper(lambda: mongo_db)
+archiver = Archiver(lambda: mongo_db)
+reaper.hooks.append(archiver.store.delete)
+attachment_store = AttachmentStore(lambda: mongo_db)
+reaper.hooks.append(attachment_store.purge_document)
+
+async def ensure_indexes():
+    await mongo_db.documents.create_index('id', unique=True)
+    await mongo_db.documents.create_index('collaborators')
+    await mongo_db.comments.create_index('document_id')
+    await mongo_db.templates.create_index([('template_id', 1), ('version', -1)], unique=True)
+    await members.ensure_indexes(mongo_db)
+    await redline.ensure_indexes(mongo_db)
+    await idempotency.ensure_indexes()
+    await activity_log.ensure_indexes()
+    await update_notifier.ensure_indexes()
+    await reaper.ensure_indexes()
+    await archiver.ensure_indexes()
+    await attachment_store.ensure_indexes()
+    if isinstance(rate_limiter.backend, ratelimit.MongoBackend):
+        await rate_limiter.backend.ensure_indexes()
+
+@app.on_event("startup")
+async def start_background_tasks():
+    await ensure_indexes()
+    activity_log.start()
+    update_notifier.start()
+    reaper.start()
+    archiver.start()
+    await firestore_mirror.start()
+    if cache.CHANGE_STREAMS_ENABLED:
+        background_tasks.append(asyncio.create_task(cache.watch_invalidations(mongo_db)))
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    await export_cache.prerender.shutdown()
+    await reaper.stop()
+    await archiver.stop()
+    await firestore_mirror.stop()
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
+    await activity_log.stop()
+    await update_notifier.stop()
+
+# Authentication (Firebase ID token in "Authorization: Bearer ...", see auth.py)
+authenticate = auth.Authenticator(lambda: mongo_db)
+
+# Profiling (X-Profile: 1 from an admin with a verified token, also while AUTH_REQUIRED is off)
+async def is_admin_request(scope) -> bool:
+    headers = dict(scope['headers'])
+    try:
+        principal = await authenticate.principal(headers.get(b'authorization', b'').decode() or None)
+    except HTTPException:
+        return False
+    return principal is not None and principal.is_admin
+
+app.add_middleware(ProfilingMiddleware, authorize=is_admin_request)
+
+# Every route is registered on this router, so none can skip authentication; the few
+# public ones (health, signed downloads) are registered on app directly
+api = APIRouter(dependencies=[Depends(authenticate)])
+
+# Rate limiting and admission control for expensive routes
+rate_limiter = ratelimit.RateLimiter(
+    ratelimit.MongoBackend(lambda: mongo_db) if ratelimit.BACKEND == 'mongo' else ratelimit.MemoryBackend(),
+    ratelimit.RATE_LIMITS,
+    ratelimit.CONCURRENCY_LIMITS,
+    ratelimit.QUEUE_TIMEOUT,
+)
+
+def admission(route_class: str):
+    async def dependency(request: Request, principal: Optional[auth.Principal] = Depends(authenticate)):
+        await rate_limiter.check(route_class, ratelimit.request_identity(request))
+        gate = await rate_limiter.enter(route_class)
+        try:
+            yield
+        finally:
+            if gate:
+                gate.release()
+    return Depends(dependency)
+
+# Idempotency-Key support for create/import/comment POSTs
+idempotency = IdempotencyStore(lambda: mongo_db)
+
+async def run_idempotent(key: Optional[str], scope: str, payload: Any, handler: Callable[[], Awaitable[Any]]):
+    if not key:
+        return await handler()
+    record_id = f"{scope}:{key}"
+    print_ = fingerprint(payload)
+    lease = uuid.uuid4().hex
+    replay = await idempotency.begin(record_id, print_, lease)
+    if replay is not None:
+        return JSONResponse(content=replay, headers={'Idempotent-Replayed': 'true'})
+    try:
+        result = await handler()
+    except BaseException:
+        await idempotency.abandon(record_id, lease)
+        raise
+    await idempotency.complete(record_id, print_, result)
+    return result
+
 # Create models
 class UserCreate(BaseModel):
+    """Self-registration; roles only change through PATCH /api/users/{uid}/role"""
     email: str
     display_name: str
     uid: str
-    role: UserRole = UserRole.EDITOR
 
 class DocumentCreate(BaseModel):
     title: str
     created_by: str
+    template_id: Optional[str] = None
+    template_version: Optional[int] = None
+
+class DocumentBatchCreate(BaseModel):
+    titles: List[str]
+    created_by: str
+    template_id: Optional[str] = None
+    template_version: Optional[int] = None
+
+class DocumentClone(BaseModel):
+    created_by: str
+    title: Optional[str] = None
+    reset_sections: List[str] = []  # section_ids whose content starts empty
+    keep_comments: bool = False
+    collaborator_map: Dict[str, str] = {}  # old uid -> new uid
+    keep_collaborators: bool = True
+
+class TemplateCreate(BaseModel):
+    template_id: str
+    name: str
+    description: Optional[str] = None
+    sections: List[IMSection]
 
 class DocumentUpdate(BaseModel):
     title: Optional[str] = None
     status: Optional[DocumentStatus] = None
     sections: Optional[List[Dict[str, Any]]] = None
+    updated_by: Optional[str] = None
+
+class CollaboratorAdd(BaseModel):
+    user_id: str
+    role: CollaboratorRole = CollaboratorRole.EDITOR
+
+class MembershipUpdate(BaseModel):
+    pinned: Optional[bool] = None
+    opened: bool = False
 
 class CommentCreate(BaseModel):
     document_id: str
@@ -65,87 +247,187 @@ class CommentCreate(BaseModel):
 async def health_check():
     return {"status": "healthy", "service": "Redwood IM Platform"}
 
+@api.get("/api/metrics", response_class=PlainTextResponse)
+async def metrics(principal: Optional[auth.Principal] = Depends(authenticate)):
+    # Scrapers authenticate as an admin, also while AUTH_REQUIRED is off
+    if principal is None or not principal.is_admin:
+        raise HTTPException(status_code=403, detail="Admin only")
+    return rate_limiter.render_metrics()
+
+@api.get("/api/export/stats")
+async def export_stats():
+    return {'pdf_fragments': fragment_cache.stats(), 'prerender': export_cache.prerender.stats(), 'activity': activity_log.stats(), 'update_notifications': update_notifier.stats(), 'firestore_mirror': firestore_mirror.stats(), 'attachments': attachment_store.stats()}
+
+@api.get("/api/profiles/{profile_id}")
+async def get_profile(profile_id: str, request: Request):
+    if not await is_admin_request(request.scope):
+        raise HTTPException(status_code=403, detail="Admin only")
+    path = profile_path(profile_id)
+    if not path:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path=str(path), filename=path.name, media_type="application/json")
+
 # Users
-@app.post("/api/users", response_model=User)
-async def create_user(user_data: UserCreate):
-    user_dict = user_data.model_dump()
-    user_dict['created_at'] = datetime.utcnow().isoformat()
-    await mongo_db.users.update_one({'uid': user_data.uid}, {'$set': user_dict}, upsert=True)
+@api.post("/api/users", response_model=User)
+async def create_user(user_data: UserCreate, principal: Optional[auth.Principal] = Depends(authenticate)):
+    auth.acting_user(principal, user_data.uid)
+    user_dict = await store.upsert_user(
+        user_data.model_dump(),
+        defaults={'role': UserRole.EDITOR.value, 'created_at': datetime.utcnow().isoformat()},
+    )
+    cache.publish('users', user_data.uid)
     return User(**user_dict)
 
-@app.get("/api/users/{uid}", response_model=User)
+@api.get("/api/users/search", response_model=List[UserSummary])
+async def search_users(q: str, limit: int = 10):
+    return await user_directory.search(q, max(1, min(limit, 50)))
+
+@api.get("/api/users/{uid}", response_model=User)
 async def get_user(uid: str):
-    user_doc = await mongo_db.users.find_one({'uid': uid}, {'_id': 0})
+    user = user_cache.get(uid)
+    if user is not None:
+        return user
+    user_doc = await store.get_user(uid)
     if not user_doc:
         raise HTTPException(status_code=404, detail="User not found")
-    return User(**user_doc)
+    user = User(**user_doc)
+    user_cache.set(uid, user)
+    return user
 
-@app.get("/api/users", response_model=List[User])
+@api.get("/api/users", response_model=List[User])
 async def list_users():
-    users = await mongo_db.users.find({}, {'_id': 0}).to_list(1000)
+    users = await store.list_users()
     return [User(**user) for user in users]
 
-@app.patch("/api/users/{uid}/role")
-async def update_user_role(uid: str, role: UserRole):
-    await mongo_db.users.update_one({'uid': uid}, {'$set': {'role': role.value}})
+@api.patch("/api/users/{uid}/role")
+async def update_user_role(uid: str, role: UserRole, principal: Optional[auth.Principal] = Depends(authenticate)):
+    if principal is not None and not principal.is_admin:
+        raise HTTPException(status_code=403, detail="Admin only")
+    await store.set_user_role(uid, role.value)
+    cache.publish('users', uid)
     return {"message": "Role updated successfully"}
 
+# Templates
+@api.get("/api/templates", response_model=List[DocumentTemplate])
+async def list_templates():
+    return [DocumentTemplate(**t.to_dict()) for t in await template_registry.list_latest(mongo_db)]
+
+@api.get("/api/templates/{template_id}", response_model=DocumentTemplate)
+async def get_template(template_id: str, version: Optional[int] = None):
+    template = await template_registry.get(mongo_db, template_id, version)
+    if not template:
+        raise HTTPException(status_code=404, detail="Template not found")
+    return DocumentTemplate(**template.to_dict())
+
+@api.post("/api/templates", response_model=DocumentTemplate)
+async def create_template(template_data: TemplateCreate, principal: Optional[auth.Principal] = Depends(authenticate)):
+    if principal is not None and not principal.is_admin:
+        raise HTTPException(status_code=403, detail="Admin only")
+    template = await template_registry.publish(
+        mongo_db,
+        template_data.template_id,
+        template_data.name,
+        [s.model_dump() for s in template_data.sections],
+        template_data.description,
+    )
+    cache.publish('templates', template.template_id)
+    return DocumentTemplate(**template.to_dict())
+
 # Documents
-@app.post("/api/documents", response_model=Document)
-async def create_document(doc_data: DocumentCreate):
-    doc_id = str(uuid.uuid4())
-    sections = []
-    section_defs = [
-        ("exec_summary", "1", "Executive Summary & Investment Highlights"),
-        ("opportunity", "2", "Opportunity Analysis & Investment Rationale"),
-        ("journey", "3", "Applicant's Journey in this Program"),
-        ("business_overview", "4", "Business Overview"),
-        ("financial", "5", "Financial Overview"),
-        ("market", "6", "Market & Industry Analysis"),
-        ("positioning", "7", "Strategic Positioning"),
-        ("management", "8", "Management & Governance"),
-        ("risk", "9", "Risk Analysis"),
-        ("transaction", "10", "Transaction Details"),
-    ]
-    for sid, snum, title in section_defs:
-        sections.append({
-            'section_id': sid,
-            'section_number': snum,
-            'title': title,
-            'content': {},
-            'instructions': f"Complete {title}",
-            'show_instructions': True
-        })
-    for i in range(1, 14):
-        sections.append({
-            'section_id': f"annexure_{i}",
-            'section_number': str(10 + i),
-            'title': f"Annexure {i}",
-            'content': {},
-            'instructions': f"Add annexure {i}",
-            'show_instructions': True
-        })
-    
-    doc_dict = {
-        'id': doc_id,
-        'title': doc_data.title,
+async def load_template(template_id: Optional[str], version: Optional[int]):
+    template = await template_registry.get(mongo_db, template_id, version)
+    if not template:
+        raise HTTPException(status_code=404, detail="Template not found")
+    return template
+
+# Soft-deleted documents keep a deleted_at tombstone until the reaper removes them
+LIVE = {'deleted_at': {'$exists': False}}
+# Archived documents are stubs (archived: true) until restored from cold storage
+HOT = {'archived': {'$exists': False}}
+
+async def restore_if_archived(doc_id: str) -> bool:
+    """Restore a stub before code that needs the full document; True if one was restored"""
+    if await mongo_db.documents.find_one({'id': doc_id, 'archived': True, **LIVE}, {'_id': 1}):
+        await archiver.restore(doc_id)
+        return True
+    return False
+
+# Document permissions: collaborators read and edit, the owner also deletes, archives and
+# manages collaborators. Ids that are missing or soft-deleted are 404 for everyone but admins.
+async def require_document_access(doc_id: str, principal: Optional[auth.Principal], owner: bool = False):
+    if principal is None or principal.is_admin:
+        return
+    doc = await mongo_db.documents.find_one({'id': doc_id, **LIVE}, {'_id': 0, 'created_by': 1, 'collaborators': 1})
+    if not doc:
+        raise HTTPException(status_code=404, detail="Document not found")
+    if doc.get('created_by') == principal.uid:
+        return
+    if owner:
+        raise HTTPException(status_code=403, detail="Only the document owner can do this")
+    if principal.uid not in doc.get('collaborators', []):
+        raise HTTPException(status_code=403, detail="Not a collaborator on this document")
+
+async def require_document_owner(doc_id: str, principal: Optional[auth.Principal]):
+    await require_document_access(doc_id, principal, owner=True)
+
+def new_document(title: str, created_by: str, template) -> Dict[str, Any]:
+    now = datetime.utcnow().isoformat()
+    sections = template.instantiate()
+    return {
+        'id': str(uuid.uuid4()),
+        'title': title,
         'status': 'draft',
-        'created_by': doc_data.created_by,
-        'created_at': datetime.utcnow().isoformat(),
-        'updated_at': datetime.utcnow().isoformat(),
+        'created_by': created_by,
+        'created_at': now,
+        'updated_at': now,
         'sections': sections,
-        'collaborators': [doc_data.created_by],
-        'version': 1
+        'section_digests': section_digests(sections),
+        'collaborators': [created_by],
+        'version': 1,
+        'template_id': template.template_id,
+        'template_version': template.version,
     }
-    await mongo_db.documents.insert_one(doc_dict)
-    doc_dict['created_at'] = datetime.fromisoformat(doc_dict['created_at'])
-    doc_dict['updated_at'] = datetime.fromisoformat(doc_dict['updated_at'])
-    return Document(**doc_dict)
-
-@app.get("/api/documents", response_model=List[Document])
-async def list_documents(user_id: Optional[str] = None):
-    query = {'collaborators': user_id} if user_id else {}
-    docs = await mongo_db.documents.find(query, {'_id': 0}).to_list(1000)
+
+def document_response(doc_dict: Dict[str, Any]) -> Document:
+    doc = {k: v for k, v in doc_dict.items() if k != '_id'}
+    doc['created_at'] = datetime.fromisoformat(doc['created_at'])
+    doc['updated_at'] = datetime.fromisoformat(doc['updated_at'])
+    return Document(**doc)
+
+@api.post("/api/documents", response_model=Document)
+async def create_document(doc_data: DocumentCreate, idempotency_key: Optional[str] = Header(None),
+                          principal: Optional[auth.Principal] = Depends(authenticate)):
+    auth.acting_user(principal, doc_data.created_by)
+    async def create():
+        template = await load_template(doc_data.template_id, doc_data.template_version)
+        doc_dict = new_document(doc_data.title, doc_data.created_by, template)
+        await mongo_db.documents.insert_one(doc_dict)
+        await members.sync_documents(mongo_db, [doc_dict])
+        activity_log.record(doc_dict['id'], 'document.created', doc_data.created_by, template_id=template.template_id)
+        return document_response(doc_dict)
+    return await run_idempotent(idempotency_key, f"documents:{doc_data.created_by}", doc_data, create)
+
+MAX_BATCH_DOCUMENTS = 500
+
+@api.post("/api/documents/batch", response_model=List[Document], dependencies=[admission("import")])
+async def create_documents_batch(batch: DocumentBatchCreate, principal: Optional[auth.Principal] = Depends(authenticate)):
+    auth.acting_user(principal, batch.created_by)
+    if not batch.titles:
+        return []
+    if len(batch.titles) > MAX_BATCH_DOCUMENTS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_DOCUMENTS} documents per batch")
+    template = await load_template(batch.template_id, batch.template_version)
+    doc_dicts = [new_document(title, batch.created_by, template) for title in batch.titles]
+    await mongo_db.documents.insert_many(doc_dicts)
+    await members.sync_documents(mongo_db, doc_dicts)
+    for d in doc_dicts:
+        activity_log.record(d['id'], 'document.created', batch.created_by, template_id=template.template_id)
+    return [document_response(d) for d in doc_dicts]
+
+@api.get("/api/documents", response_model=List[Document])
+async def list_documents(user_id: Optional[str] = None, principal: Optional[auth.Principal] = Depends(authenticate)):
+    user_id = auth.acting_user(principal, user_id)
+    docs = await store.list_documents(user_id)
     result = []
     for doc in docs:
         doc['created_at'] = datetime.fromisoformat(doc['created_at'])
@@ -153,30 +435,321 @@ async def list_documents(user_id: Optional[str] = None):
         result.append(Document(**doc))
     return result
 
-@app.get("/api/documents/{doc_id}", response_model=Document)
-async def get_document(doc_id: str):
-    doc = await mongo_db.documents.find_one({'id': doc_id}, {'_id': 0})
+@api.get("/api/dashboard/{user_id}", response_model=DashboardSummary)
+async def get_dashboard(user_id: str, principal: Optional[auth.Principal] = Depends(authenticate)):
+    return await dashboard.summary(mongo_db, auth.acting_user(principal, user_id))
+
+@api.get("/api/documents/{doc_id}", response_model=Document)
+async def get_document(doc_id: str, principal: Optional[auth.Principal] = Depends(authenticate)):
+    await require_document_access(doc_id, principal)
+    doc = await mongo_db.documents.find_one({'id': doc_id, **LIVE}, {'_id': 0})
+    if doc and doc.get('archived'):
+        doc = await archiver.restore(doc_id)
     if not doc:
         raise HTTPException(status_code=404, detail="Document not found")
     doc['created_at'] = datetime.fromisoformat(doc['created_at'])
     doc['updated_at'] = datetime.fromisoformat(doc['updated_at'])
     return Document(**doc)
 
-@app.patch("/api/documents/{doc_id}")
-async def update_document(doc_id: str, updates: DocumentUpdate):
-    update_data = {k: v for k, v in updates.model_dump().items() if v is not None}
+@api.patch("/api/documents/{doc_id}", dependencies=[admission("update")])
+async def update_document(doc_id: str, updates: DocumentUpdate, principal: Optional[auth.Principal] = Depends(authenticate)):
+    actor = auth.acting_user(principal, updates.updated_by)
+    await require_document_access(doc_id, principal)
+    update_data = {k: v for k, v in updates.model_dump(exclude={'updated_by'}).items() if v is not None}
     update_data['updated_at'] = datetime.utcnow().isoformat()
-    await mongo_db.documents.update_one({'id': doc_id}, {'$set': update_data})
+    if updates.sections is not None:
+        update_data['section_digests'] = section_digests(updates.sections)
+    projection = {'_id': 0, 'status': 1, 'title': 1, 'section_digests': 1, 'collaborators': 1}
+    previous = await mongo_db.documents.find_one_and_update({'id': doc_id, **LIVE, **HOT}, {'$set': update_data}, projection=projection)
+    if not previous and await restore_if_archived(doc_id):
+        previous = await mongo_db.documents.find_one_and_update({'id': doc_id, **LIVE, **HOT}, {'$set': update_data}, projection=projection)
+    if not previous:
+        raise HTTPException(status_code=404, detail="Document not found")
+
+    changes = {}
+    if updates.title is not None and updates.title != previous.get('title'):
+        changes['title'] = {'from': previous.get('title'), 'to': updates.title}
+    status_changed = updates.status is not None and updates.status.value != previous.get('status')
+    if status_changed:
+        changes['status'] = {'from': previous.get('status'), 'to': updates.status.value}
+    sections = changed_sections(previous.get('section_digests'), update_data.get('section_digests', {}))
+    if changes or sections:
+        activity_log.record(doc_id, 'document.updated', actor, changes=changes, sections=sections)
+        firestore_mirror.note(
+            doc_id,
+            {k: update_data[k] for k in ('title', 'status', 'updated_at') if k in update_data},
+            {s['section_id']: s for s in updates.sections or [] if s.get('section_id') in sections},
+        )
+        update_notifier.note(
+            doc_id, updates.title or previous.get('title', ''), previous.get('collaborators', []),
+            sections=sections, actor=actor,
+        )
+
+    if status_changed and updates.status == DocumentStatus.IN_REVIEW:
+        # Baseline for the next "changes since last review" redline
+        await redline.snapshot(mongo_db, doc_id, redline.REVIEW, actor)
+
+    if changes:
+        await members.update_document_fields(mongo_db, doc_id, update_data, previous.get('collaborators', []))
+    dashboard.invalidate(previous.get('collaborators', []))
+
+    if status_changed and updates.status.value in export_cache.PRERENDER_STATUSES:
+        export_cache.prerender.schedule(doc_id, lambda: export_source(doc_id))
     return {"message": "Document updated successfully"}
 
-@app.delete("/api/documents/{doc_id}")
-async def delete_document(doc_id: str):
-    await mongo_db.documents.delete_one({'id': doc_id})
+@api.get("/api/documents/{doc_id}/activity")
+async def get_document_activity(doc_id: str, limit: int = 50, before: Optional[str] = None, before_id: Optional[str] = None,
+                                principal: Optional[auth.Principal] = Depends(authenticate)):
+    """Newest first; pass next_before and next_before_id back for the following page"""
+    await require_document_access(doc_id, principal)
+    limit = max(1, min(limit, 200))
+    events = await activity_log.page(doc_id, limit, before, before_id)
+    last = events[-1] if len(events) == limit else None
+    return {'events': events, 'next_before': last and last['created_at'], 'next_before_id': last and last['id']}
+
+# Revisions: snapshots taken on entering review (or on request), compared by the redline export
+@api.get("/api/documents/{doc_id}/revisions")
+async def list_document_revisions(doc_id: str, principal: Optional[auth.Principal] = Depends(authenticate)):
+    await require_document_access(doc_id, principal)
+    return await redline.list_revisions(mongo_db, doc_id)
+
+@api.post("/api/documents/{doc_id}/revisions")
+async def create_document_revision(doc_id: str, principal: Optional[auth.Principal] = Depends(authenticate)):
+    await require_document_access(doc_id, principal)
+    await restore_if_archived(doc_id)
+    revision_id = await redline.snapshot(mongo_db, doc_id, 'manual', principal.uid if principal else None)
+    if not revision_id:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return {"message": "Revision saved", "id": revision_id}
+
+@api.delete("/api/documents/{doc_id}")
+async def delete_document(doc_id: str, principal: Optional[auth.Principal] = Depends(authenticate)):
+    await require_document_owner(doc_id, principal)
+    actor = principal.uid if principal else None
+    result = await mongo_db.documents.update_one(
+        {'id': doc_id, **LIVE}, {'$set': {'deleted_at': datetime.utcnow().isoformat(), 'deleted_by': actor}}
+    )
+    if result.modified_count:
+        # Dashboards read document_members, so drop those now; the reaper handles the rest
+        await members.remove_document(mongo_db, doc_id)
+        activity_log.record(doc_id, 'document.deleted', actor)
     return {"message": "Document deleted successfully"}
 
+@api.get("/api/reaper/stats")
+async def reaper_stats():
+    return await reaper.stats()
+
+# Cold storage (see archive.py); stubs are restored transparently when opened
+@api.post("/api/documents/{doc_id}/archive")
+async def archive_document(doc_id: str, principal: Optional[auth.Principal] = Depends(authenticate)):
+    await require_document_owner(doc_id, principal)
+    doc = await mongo_db.documents.find_one({'id': doc_id, **LIVE}, {'_id': 0, 'status': 1, 'archived': 1})
+    if not doc:
+        raise HTTPException(status_code=404, detail="Document not found")
+    if doc.get('status') != DocumentStatus.ARCHIVED.value:
+        raise HTTPException(status_code=400, detail="Only archived documents can be moved to cold storage")
+    if not doc.get('archived') and not await archiver.archive(doc_id):
+        raise HTTPException(status_code=409, detail="Document changed while archiving; try again")
+    return {"message": "Document moved to cold storage"}
+
+@api.post("/api/documents/{doc_id}/restore")
+async def restore_document(doc_id: str, principal: Optional[auth.Principal] = Depends(authenticate)):
+    await require_document_access(doc_id, principal)
+    if not await restore_if_archived(doc_id):
+        raise HTTPException(status_code=404, detail="No archived document with this id")
+    return {"message": "Document restored"}
+
+@api.get("/api/archive/stats")
+async def archive_stats():
+    return archiver.stats()
+
+@api.post("/api/documents/{doc_id}/clone", dependencies=[admission("import")])
+async def clone_document(doc_id: str, clone: DocumentClone, principal: Optional[auth.Principal] = Depends(authenticate)):
+    """Copy a document (and optionally its comments) entirely inside MongoDB"""
+    auth.acting_user(principal, clone.created_by)
+    await require_document_access(doc_id, principal)
+    await restore_if_archived(doc_id)
+    new_id = str(uuid.uuid4())
+    now = datetime.utcnow().isoformat()
+    if clone.keep_collaborators:
+        remap = '$$c'
+        if clone.collaborator_map:
+            remap = {'$switch': {
+                'branches': [{'case': {'$eq': ['$$c', {'$literal': old}]}, 'then': {'$literal': new}}
+                             for old, new in clone.collaborator_map.items()],
+                'default': '$$c',
+            }}
+        collaborators = {'$setUnion': [[{'$literal': clone.created_by}], {'$map': {'input': '$collaborators', 'as': 'c', 'in': remap}}]}
+    else:
+        collaborators = [{'$literal': clone.created_by}]
+    title = {'$literal': clone.title} if clone.title else {'$concat': ['$title', ' (copy)']}
+    await mongo_db.documents.aggregate([
+        {'$match': {'id': doc_id, **LIVE}},
+        {'$set': {
+            'id': new_id,
+            'title': title,
+            'status': DocumentStatus.DRAFT.value,
+            'created_by': {'$literal': clone.created_by},
+            'created_at': now,
+            'updated_at': now,
+            'version': 1,
+            'cloned_from': {'$literal': doc_id},
+            'collaborators': collaborators,
+            'sections': {'$map': {'input': '$sections', 'as': 's', 'in': {'$cond': [
+                {'$in': ['$$s.section_id', {'$literal': clone.reset_sections}]},
+                {'$mergeObjects': ['$$s', {'content': {'$literal': {}}}]},
+                '$$s',
+            ]}}},
+        }},
+        {'$unset': '_id'},
+        {'$merge': {'into': 'documents', 'whenMatched': 'fail', 'whenNotMatched': 'insert'}},
+    ]).to_list(None)
+    created = await mongo_db.documents.find_one(
+        {'id': new_id}, {'_id': 0, 'id': 1, 'title': 1, 'status': 1, 'created_by': 1, 'collaborators': 1, 'sections': 1}
+    )
+    if not created:
+        raise HTTPException(status_code=404, detail="Document not found")
+    # The source's digests describe its own sections, not the reset copies
+    await mongo_db.documents.update_one(
+        {'id': new_id}, {'$set': {'section_digests': section_digests(created.pop('sections', None) or [])}}
+    )
+    await members.sync_documents(mongo_db, [created])
+
+    if clone.keep_comments:
+        # Comment ids are derived from the originals so reply threads stay linked
+        await mongo_db.comments.aggregate([
+            {'$match': {'document_id': doc_id}},
+            {'$set': {
+                'id': {'$concat': [new_id, ':', '$id']},
+                'document_id': new_id,
+                'parent_id': {'$cond': [
+                    {'$ifNull': ['$parent_id', False]},
+                    {'$concat': [new_id, ':', '$parent_id']},
+                    None,
+                ]},
+            }},
+            {'$unset': '_id'},
+            {'$merge': {'into': 'comments', 'whenMatched': 'fail', 'whenNotMatched': 'insert'}},
+        ]).to_list(None)
+    # Clones share the GridFS files; only the references are copied
+    await attachment_store.copy_document(doc_id, new_id, skip_sections=clone.reset_sections)
+    activity_log.record(new_id, 'document.cloned', clone.created_by, source_id=doc_id)
+    return {"message": "Document cloned successfully", "id": new_id}
+
+# Collaborators and per-user document lists (document_members, see members.py)
+@api.post("/api/documents/{doc_id}/collaborators")
+async def add_collaborator(doc_id: str, body: CollaboratorAdd, principal: Optional[auth.Principal] = Depends(authenticate)):
+    await require_document_owner(doc_id, principal)
+    if not await members.add(mongo_db, doc_id, body.user_id, body.role.value):
+        raise HTTPException(status_code=404, detail="Document not found")
+    activity_log.record(doc_id, 'collaborator.added', principal.uid if principal else None, user_id=body.user_id)
+    return {"message": "Collaborator added successfully"}
+
+@api.delete("/api/documents/{doc_id}/collaborators/{user_id}")
+async def remove_collaborator(doc_id: str, user_id: str, principal: Optional[auth.Principal] = Depends(authenticate)):
+    if principal is None or principal.uid != user_id:
+        await require_document_owner(doc_id, principal)
+    if not await members.remove(mongo_db, doc_id, user_id):
+        if await mongo_db.documents.find_one({'id': doc_id, **LIVE}, {'_id': 1}):
+            raise HTTPException(status_code=400, detail="The owner cannot be removed")
+        raise HTTPException(status_code=404, detail="Document not found")
+    activity_log.record(doc_id, 'collaborator.removed', principal.uid if principal else None, user_id=user_id)
+    return {"message": "Collaborator removed successfully"}
+
+@api.patch("/api/documents/{doc_id}/members/{user_id}")
+async def update_membership(doc_id: str, user_id: str, body: MembershipUpdate,
+                            principal: Optional[auth.Principal] = Depends(authenticate)):
+    user_id = auth.acting_user(principal, user_id)
+    if not await members.touch(mongo_db, doc_id, user_id, pinned=body.pinned, opened=body.opened):
+        raise HTTPException(status_code=404, detail="Not a member of this document")
+    return {"message": "Membership updated successfully"}
+
+@api.get("/api/members/{user_id}", response_model=List[DocumentMembership])
+async def list_memberships(user_id: str, view: str = 'recent', limit: int = 20,
+                           principal: Optional[auth.Principal] = Depends(authenticate)):
+    if view not in ('recent', 'pinned', 'all'):
+        raise HTTPException(status_code=400, detail="view must be recent, pinned or all")
+    user_id = auth.acting_user(principal, user_id)
+    return await members.list_for_user(mongo_db, user_id, view, max(1, min(limit, 500)))
+
+# Attachments (GridFS, see attachments.py); documents only hold references
+async def touch_document(doc_id: str):
+    """Bump updated_at so cached exports of the document are rendered again"""
+    await mongo_db.documents.update_one({'id': doc_id}, {'$set': {'updated_at': datetime.utcnow().isoformat()}})
+
+@api.post("/api/documents/{doc_id}/sections/{section_id}/attachments", response_model=Attachment,
+          dependencies=[admission("import")])
+async def upload_attachment(doc_id: str, section_id: str, filename: str, request: Request, uploaded_by: Optional[str] = None,
+                            principal: Optional[auth.Principal] = Depends(authenticate)):
+    """Raw request body is the file; it is streamed into GridFS without being buffered"""
+    actor = auth.acting_user(principal, uploaded_by)
+    await require_document_access(doc_id, principal)
+    filename = Path(filename).name
+    if not filename:
+        raise HTTPException(status_code=400, detail="filename is required")
+    declared = request.headers.get('content-length')
+    if declared and declared.isdigit() and int(declared) > attachment_store.max_bytes:
+        raise HTTPException(status_code=413, detail=f"Attachments are limited to {attachment_store.max_bytes} bytes")
+    await restore_if_archived(doc_id)
+    if not await mongo_db.documents.find_one({'id': doc_id, 'sections.section_id': section_id, **LIVE}, {'_id': 1}):
+        raise HTTPException(status_code=404, detail="Section not found")
+    try:
+        record = await attachment_store.upload(
+            doc_id, section_id, filename, request.headers.get('content-type'), request.stream(), actor
+        )
+    except AttachmentTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    await touch_document(doc_id)
+    activity_log.record(doc_id, 'attachment.added', actor, attachment_id=record['id'], filename=filename, sections=[section_id])
+    return Attachment(**record)
+
+@api.get("/api/documents/{doc_id}/attachments", response_model=List[Attachment])
+async def list_attachments(doc_id: str, section_id: Optional[str] = None,
+                           principal: Optional[auth.Principal] = Depends(authenticate)):
+    await require_document_access(doc_id, principal)
+    return [Attachment(**a) for a in await attachment_store.list_for_document(doc_id, section_id)]
+
+@api.get("/api/attachments/{attachment_id}", dependencies=[admission("export")])
+async def download_attachment(attachment_id: str, request: Request,
+                              principal: Optional[auth.Principal] = Depends(authenticate)):
+    record = await attachment_store.get(attachment_id)
+    if not record or not await mongo_db.documents.find_one({'id': record['document_id'], **LIVE}, {'_id': 1}):
+        raise HTTPException(status_code=404, detail="Attachment not found")
+    await require_document_access(record['document_id'], principal)
+    return http_ranges.ranged_response(
+        request, record['length'],
+        lambda start, end: attachment_store.chunks(record, start, end),
+        record['content_type'],
+        etag=f'"{record["sha256"]}"',
+        headers={'Content-Disposition': f"attachment; filename*=UTF-8''{quote(record['filename'])}"},
+    )
+
+@api.delete("/api/attachments/{attachment_id}")
+async def delete_attachment(attachment_id: str, principal: Optional[auth.Principal] = Depends(authenticate)):
+    """The uploader or the document owner may remove an attachment"""
+    record = await attachment_store.get(attachment_id)
+    if not record:
+        raise HTTPException(status_code=404, detail="Attachment not found")
+    if principal is None or record.get('uploaded_by') != principal.uid:
+        await require_document_owner(record['document_id'], principal)
+    if not await attachment_store.delete(attachment_id):
+        raise HTTPException(status_code=404, detail="Attachment not found")
+    await touch_document(record['document_id'])
+    activity_log.record(record['document_id'], 'attachment.removed', principal.uid if principal else None,
+                        attachment_id=attachment_id, filename=record['filename'], sections=[record['section_id']])
+    return {"message": "Attachment deleted successfully"}
+
 # Comments
-@app.post("/api/comments", response_model=Comment)
-async def create_comment(comment_data: CommentCreate):
+@api.post("/api/comments", response_model=Comment, dependencies=[admission("comment")])
+async def create_comment(comment_data: CommentCreate, idempotency_key: Optional[str] = Header(None),
+                         principal: Optional[auth.Principal] = Depends(authenticate)):
+    auth.acting_user(principal, comment_data.user_id)
+    await require_document_access(comment_data.document_id, principal)
+    return await run_idempotent(
+        idempotency_key, f"comments:{comment_data.user_id}", comment_data, lambda: insert_comment(comment_data)
+    )
+
+async def insert_comment(comment_data: CommentCreate) -> Comment:
     comment_id = str(uuid.uuid4())
     comment_dict = {
         'id': comment_id,
@@ -185,34 +758,49 @@ async def create_comment(comment_data: CommentCreate):
         'edited': False
     }
     await mongo_db.comments.insert_one(comment_dict)
+    activity_log.record(
+        comment_data.document_id, 'comment.created', comment_data.user_id,
+        comment_id=comment_id, sections=[comment_data.section_id] if comment_data.section_id else [],
+    )
     
     if comment_data.mentions:
-        doc = await mongo_db.documents.find_one({'id': comment_data.document_id}, {'_id': 0})
+        mentioned = await user_directory.resolve(set(comment_data.mentions))
+        doc = await mongo_db.documents.find_one({'id': comment_data.document_id}, {'_id': 0, 'title': 1})
         doc_title = doc.get('title', 'Untitled') if doc else 'Document'
-        for email in comment_data.mentions:
-            notif_dict = {
-                'id': str(uuid.uuid4()),
-                'user_id': email,
-                'type': 'mention',
-                'title': 'New Mention',
-                'message': f"{comment_data.user_name} mentioned you",
-                'document_id': comment_data.document_id,
-                'read': False,
-                'created_at': datetime.utcnow().isoformat()
-            }
-            await mongo_db.notifications.insert_one(notif_dict)
-            try:
-                await send_comment_notification(email, comment_data.user_name, comment_data.text, doc_title, comment_data.document_id)
-            except:
-                pass
+        now = datetime.utcnow().isoformat()
+        recipients = {u['uid']: u for u in mentioned.values() if u['uid'] != comment_data.user_id}
+        if recipients:
+            await mongo_db.notifications.insert_many([
+                {
+                    'id': str(uuid.uuid4()),
+                    'user_id': uid,
+                    'type': 'mention',
+                    'title': 'New Mention',
+                    'message': f"{comment_data.user_name} mentioned you",
+                    'document_id': comment_data.document_id,
+                    'read': False,
+                    'created_at': now
+                }
+                for uid in recipients
+            ])
+            results = await asyncio.gather(*(
+                send_comment_notification(u['email'], comment_data.user_name, comment_data.text, doc_title, comment_data.document_id)
+                for u in recipients.values()
+            ), return_exceptions=True)
+            for user, result in zip(recipients.values(), results):
+                if isinstance(result, Exception):
+                    logger.warning("Mention email to %s failed: %s", user['email'], result)
     
     comment_dict['created_at'] = datetime.fromisoformat(comment_dict['created_at'])
     return Comment(**comment_dict)
 
-@app.get("/api/comments", response_model=List[Comment])
-async def list_comments(document_id: Optional[str] = None):
-    query = {'document_id': document_id} if document_id else {}
-    comments = await mongo_db.comments.find(query, {'_id': 0}).to_list(1000)
+@api.get("/api/comments", response_model=List[Comment])
+async def list_comments(document_id: Optional[str] = None, principal: Optional[auth.Principal] = Depends(authenticate)):
+    if document_id:
+        await require_document_access(document_id, principal)
+    elif principal is not None and not principal.is_admin:
+        raise HTTPException(status_code=400, detail="document_id is required")
+    comments = await store.list_comments(document_id)
     result = []
     for c in comments:
         c['created_at'] = datetime.fromisoformat(c['created_at'])
@@ -220,43 +808,199 @@ async def list_comments(document_id: Optional[str] = None):
     return result
 
 # Notifications
-@app.get("/api/notifications/{user_id}", response_model=List[Notification])
-async def get_notifications(user_id: str):
-    notifs = await mongo_db.notifications.find({'user_id': user_id}, {'_id': 0}).to_list(100)
+@api.get("/api/notifications/{user_id}", response_model=List[Notification])
+async def get_notifications(user_id: str, principal: Optional[auth.Principal] = Depends(authenticate)):
+    auth.acting_user(principal, user_id)
+    notifs = await store.list_notifications(user_id)
+    names = await user_directory.display_names({uid for n in notifs for uid in n.get('editors', [])})
     result = []
     for n in notifs:
+        n['message'] = notifier.message(n, names)
         n['created_at'] = datetime.fromisoformat(n['created_at'])
         result.append(Notification(**n))
     return result
 
-@app.patch("/api/notifications/{notif_id}/read")
-async def mark_notification_read(notif_id: str):
-    await mongo_db.notifications.update_one({'id': notif_id}, {'$set': {'read': True}})
+@api.patch("/api/notifications/{notif_id}/read")
+async def mark_notification_read(notif_id: str, principal: Optional[auth.Principal] = Depends(authenticate)):
+    owner = principal.uid if principal is not None and not principal.is_admin else None
+    if not await store.mark_notification_read(notif_id, owner):
+        raise HTTPException(status_code=404, detail="Notification not found")
     return {"message": "Marked as read"}
 
 # Export
-@app.post("/api/export/{doc_id}")
-async def export_document(doc_id: str, format: str):
-    doc = await mongo_db.documents.find_one({'id': doc_id}, {'_id': 0})
+async def export_source(doc_id: str) -> Optional[Dict[str, Any]]:
+    """The full document with each section's attachment manifest, as every export renders it"""
+    doc = await mongo_db.documents.find_one({'id': doc_id, **LIVE}, {'_id': 0})
+    if doc and doc.get('archived'):
+        doc = await archiver.restore(doc_id)
+    return await attachment_store.annotate(doc) if doc else None
+
+FILE_EXPORTS = {ExportFormat.PDF: 'pdf', ExportFormat.DOCX: 'docx', ExportFormat.BUNDLE: 'zip'}
+
+async def cached_export(doc: Dict[str, Any], fmt: str):
+    """Path of the rendered artifact, rendering it on a cache miss, plus diagnostic headers"""
+    path = export_cache.lookup(doc, fmt)
+    headers = {'X-Export-Cache': 'hit' if path else 'miss'}
+    if path:
+        return path, headers
+    if fmt == 'zip':
+        return await export_cache.render_bundle(doc, attachment_store.write_bundle), headers
+    stats = {}
+    path = await run_in_threadpool(profiled(export_cache.render), doc, fmt, **({'stats': stats} if fmt == 'pdf' else {}))
+    if stats:
+        headers['X-Fragment-Cache'] = f"hits={stats['hits']}, misses={stats['misses']}"
+    return path, headers
+
+@api.post("/api/export/{doc_id}", dependencies=[admission("export")])
+async def export_document(doc_id: str, format: ExportFormat, principal: Optional[auth.Principal] = Depends(authenticate)):
+    await require_document_access(doc_id, principal)
+    doc = await export_source(doc_id)
     if not doc:
         raise HTTPException(status_code=404, detail="Document not found")
     
-    if format == "json":
+    if format == ExportFormat.JSON:
         return JSONResponse(content=doc)
     
-    return {"message": f"{format} export available - download ready"}
+    if format == ExportFormat.COMPILED:
+        return {
+            "html_url": f"/api/download/{doc_id}.html",
+            "txt_url": f"/api/download/{doc_id}.txt"
+        }
+    
+    if format in FILE_EXPORTS:
+        fmt = FILE_EXPORTS[format]
+        path, headers = await cached_export(doc, fmt)
+        return FileResponse(
+            path=str(path),
+            filename=f"{doc['title']}.{fmt}",
+            media_type=export_cache.MEDIA_TYPES[fmt],
+            headers=headers,
+        )
+    
+    raise HTTPException(status_code=400, detail="Invalid export format")
+
+# Resumable downloads: a signed, short-lived URL for one cached artifact, served with Range and ETag
+@api.post("/api/export/{doc_id}/link", dependencies=[admission("export")])
+async def export_link(doc_id: str, format: ExportFormat, principal: Optional[auth.Principal] = Depends(authenticate)):
+    await require_document_access(doc_id, principal)
+    if format not in FILE_EXPORTS:
+        raise HTTPException(status_code=400, detail="Only PDF, DOCX and bundle exports have download links")
+    doc = await export_source(doc_id)
+    if not doc:
+        raise HTTPException(status_code=404, detail="Document not found")
+    path, _ = await cached_export(doc, FILE_EXPORTS[format])
+    url, expires = signed_urls.sign(f"/api/exports/{doc_id}/{path.name}")
+    await run_in_threadpool(export_cache.mark_linked, path)
+    return {
+        "url": url,
+        "expires_at": datetime.utcfromtimestamp(expires).isoformat(),
+        "etag": await export_cache.content_etag(path),
+        "size": path.stat().st_size,
+    }
+
+@app.get("/api/exports/{doc_id}/{name}")
+async def download_export(doc_id: str, name: str, expires: int, signature: str, request: Request):
+    """No Authorization needed: the signature is the credential, so plain browser downloads can resume"""
+    remaining = signed_urls.verify(request.url.path, expires, signature)
+    doc = await mongo_db.documents.find_one({'id': doc_id, **LIVE}, {'_id': 0, 'title': 1})
+    path = export_cache.find_artifact(doc_id, name) if doc else None
+    if not path:
+        raise HTTPException(status_code=404, detail="Export is no longer available; request a new link")
+    fmt = path.suffix[1:]
+    return http_ranges.ranged_response(
+        request, path.stat().st_size, http_ranges.file_chunks(path), export_cache.MEDIA_TYPES[fmt],
+        etag=await export_cache.content_etag(path),
+        headers={
+            # The artifact never changes, but it is the document's content: only the browser may keep it
+            'Cache-Control': f"private, max-age={remaining}, immutable",
+            'Content-Disposition': f"attachment; filename*=UTF-8''{quote(doc['title'] + '.' + fmt)}",
+        },
+    )
+
+@api.post("/api/export/{doc_id}/redline", dependencies=[admission("export")])
+async def export_redline(doc_id: str, format: ExportFormat = ExportFormat.PDF, base: Optional[str] = None,
+                         target: Optional[str] = None, principal: Optional[auth.Principal] = Depends(authenticate)):
+    """Changed sections only, from base (default: the last review) to target (default: now)"""
+    await require_document_access(doc_id, principal)
+    if format not in (ExportFormat.PDF, ExportFormat.DOCX, ExportFormat.JSON):
+        raise HTTPException(status_code=400, detail="Redlines are available as PDF, DOCX or JSON")
+    doc = await mongo_db.documents.find_one({'id': doc_id, **LIVE}, {'_id': 0})
+    if doc and doc.get('archived'):
+        doc = await archiver.restore(doc_id)
+    if not doc:
+        raise HTTPException(status_code=404, detail="Document not found")
+    newer = await redline.get_revision(mongo_db, doc_id, target) if target else doc
+    older = await redline.get_revision(mongo_db, doc_id, base) if base else await redline.last_review(mongo_db, doc)
+    if not newer or (base and not older):
+        raise HTTPException(status_code=404, detail="Revision not found")
+    if not older:
+        raise HTTPException(status_code=404, detail="No earlier review to compare against")
+
+    fmt = format.value
+    if fmt != 'json':
+        path = export_cache.redline_path(doc_id, older['id'], target or doc['updated_at'], fmt)
+        if path.is_file():
+            return FileResponse(path=str(path), filename=f"{doc['title']} (redline).{fmt}",
+                                media_type=export_cache.MEDIA_TYPES[fmt], headers={'X-Export-Cache': 'hit'})
+    result = await run_in_threadpool(profiled(redline.diff_documents), older, newer)
+    if fmt == 'json':
+        return result
+    await run_in_threadpool(profiled(export_cache.render_redline), result, path)
+    return FileResponse(path=str(path), filename=f"{doc['title']} (redline).{fmt}",
+                        media_type=export_cache.MEDIA_TYPES[fmt], headers={'X-Export-Cache': 'miss'})
+
+COMPILED_RENDERERS = {
+    'html': (iter_html, "text/html; charset=utf-8"),
+    'txt': (iter_txt, "text/plain; charset=utf-8"),
+}
+
+@api.get("/api/download/{filename}", dependencies=[admission("export")])
+async def download_compiled(filename: str, principal: Optional[auth.Principal] = Depends(authenticate)):
+    doc_id, _, ext = filename.rpartition('.')
+    if ext not in COMPILED_RENDERERS:
+        raise HTTPException(status_code=404, detail="File not found")
+    await require_document_access(doc_id, principal)
+    doc = await export_source(doc_id)
+    if not doc:
+        raise HTTPException(status_code=404, detail="Document not found")
+    render, media_type = COMPILED_RENDERERS[ext]
+    return StreamingResponse(
+        render(doc),
+        media_type=media_type,
+        headers={'Content-Disposition': f'attachment; filename="{doc_id}.{ext}"'},
+    )
 
 # Import
-@app.post("/api/import/{user_id}")
-async def import_document(user_id: str, document_data: Dict[str, Any]):
-    doc_id = str(uuid.uuid4())
-    document_data['id'] = doc_id
-    document_data['created_by'] = user_id
-    document_data['created_at'] = datetime.utcnow().isoformat()
-    document_data['updated_at'] = datetime.utcnow().isoformat()
-    await mongo_db.documents.insert_one(document_data)
-    return {"message": "Imported successfully", "id": doc_id}
+@api.post("/api/import/{user_id}", dependencies=[admission("import")])
+async def import_document(user_id: str, document_data: Dict[str, Any], idempotency_key: Optional[str] = Header(None),
+                          principal: Optional[auth.Principal] = Depends(authenticate)):
+    auth.acting_user(principal, user_id)
+    async def insert():
+        doc_id = str(uuid.uuid4())
+        doc = {k: v for k, v in document_data.items() if k not in ('deleted_at', 'deleted_by', 'reap')}
+        # Attachment manifests in a JSON export describe the source's files, not this copy's
+        if isinstance(doc.get('sections'), list):
+            doc['sections'] = [{k: v for k, v in s.items() if k != 'attachments'} if isinstance(s, dict) else s
+                               for s in doc['sections']]
+        doc.update({'id': doc_id, 'created_by': user_id})
+        doc['created_at'] = datetime.utcnow().isoformat()
+        doc['updated_at'] = datetime.utcnow().isoformat()
+        await mongo_db.documents.insert_one(doc)
+        await members.sync_documents(mongo_db, [doc])
+        activity_log.record(doc_id, 'document.imported', user_id)
+        return {"message": "Imported successfully", "id": doc_id}
+    return await run_idempotent(idempotency_key, f"import:{user_id}", document_data, insert)
+
+app.include_router(api)
 
 if __name__ == "__main__":
+    # Multi-worker deployments should prefer gunicorn -c gunicorn.conf.py (preloaded app)
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8001)
+    workers = cache.default_workers()
+    uvicorn.run(
+        "server:app" if workers > 1 else app,
+        host="0.0.0.0",
+        port=int(os.environ.get('PORT', '8001')),
+        workers=workers,
+        timeout_graceful_shutdown=int(os.environ.get('GRACEFUL_TIMEOUT', '30')),
+    )
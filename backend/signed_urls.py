@@ -0,0 +1,53 @@
+"""Short-lived HMAC-signed download URLs.
+
+A signed URL is ``{path}?expires=<unix time>&signature=<hex>`` where the
+signature is HMAC-SHA256 over the path and expiry, keyed with
+DOWNLOAD_URL_SECRET. Whoever holds the URL may fetch that one path until it
+expires, without an Authorization header, so browsers and download managers
+can resume it and the browser can cache it. Every worker must share the
+secret, so it is required with more than one worker; a single worker
+without one uses a random key, and its links stop working on restart.
+"""
+import hashlib
+import hmac
+import logging
+import os
+import secrets
+import time
+from typing import Optional, Tuple
+from urllib.parse import urlencode
+
+from fastapi import HTTPException
+
+from cache import default_workers
+
+logger = logging.getLogger(__name__)
+
+DOWNLOAD_URL_TTL = int(os.environ.get('DOWNLOAD_URL_TTL', '900'))
+
+_secret = os.environ.get('DOWNLOAD_URL_SECRET', '').encode()
+if not _secret:
+    if default_workers() > 1:
+        raise RuntimeError("DOWNLOAD_URL_SECRET must be set when running more than one worker")
+    logger.warning("DOWNLOAD_URL_SECRET is not set; signed download URLs stop working when the server restarts")
+    _secret = secrets.token_bytes(32)
+
+
+def signature(path: str, expires: int) -> str:
+    return hmac.new(_secret, f"{path}\n{expires}".encode(), hashlib.sha256).hexdigest()
+
+
+def sign(path: str, ttl: Optional[int] = None) -> Tuple[str, int]:
+    """(url, expires) for path, valid for ttl seconds"""
+    expires = int(time.time()) + (ttl or DOWNLOAD_URL_TTL)
+    return f"{path}?{urlencode({'expires': expires, 'signature': signature(path, expires)})}", expires
+
+
+def verify(path: str, expires: int, given: str) -> int:
+    """Seconds the URL stays valid; 403 for a bad signature or an expired URL"""
+    if not hmac.compare_digest(signature(path, expires), given):
+        raise HTTPException(status_code=403, detail="Invalid download signature")
+    remaining = expires - int(time.time())
+    if remaining <= 0:
+        raise HTTPException(status_code=403, detail="Download link has expired")
+    return remaining
@@ -0,0 +1,432 @@
+"""Storage engines for the core records: users, documents, comments, notifications.
+
+``StorageEngine`` is the interface; ``MongoStorage`` runs it on Motor (what
+the API uses), ``MemoryStorage`` keeps everything in dicts for hermetic tests,
+and ``SQLiteStorage`` stores JSON rows in a WAL-mode SQLite file for a
+single-node deployment. Records are plain dicts shaped like the Mongo
+documents (without ``_id``). Document reads skip soft-deleted documents.
+
+Mongo-specific features (aggregation clones, ``$facet`` dashboards, change
+streams, membership indexes) stay on the Motor database; this interface only
+covers what every engine can do, so the API server always uses
+``MongoStorage``. ``open_storage`` picks an engine from STORAGE_ENGINE /
+STORAGE_PATH for tests, benchmarks and tools.
+"""
+import abc
+import asyncio
+import copy
+import json
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional
+
+STORAGE_ENGINE = os.environ.get('STORAGE_ENGINE', 'mongo')
+STORAGE_PATH = os.environ.get('STORAGE_PATH', '/tmp/im.sqlite3')
+
+Record = Dict[str, Any]
+
+
+def _live(doc: Optional[Record]) -> Optional[Record]:
+    return doc if doc and 'deleted_at' not in doc else None
+
+
+class StorageEngine(abc.ABC):
+    name = 'base'
+
+    # Users
+    @abc.abstractmethod
+    async def get_user(self, uid: str) -> Optional[Record]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def upsert_user(self, user: Record, defaults: Optional[Record] = None) -> Record:
+        """Set user's fields, plus defaults only if the user is new; returns the stored user"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def list_users(self, limit: int = 1000) -> List[Record]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def set_user_role(self, uid: str, role: str) -> bool:
+        raise NotImplementedError
+
+    # Documents
+    @abc.abstractmethod
+    async def insert_documents(self, docs: List[Record]):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def get_document(self, doc_id: str) -> Optional[Record]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def list_documents(self, user_id: Optional[str] = None, limit: int = 1000) -> List[Record]:
+        """Live documents, optionally only those user_id collaborates on"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def update_document(self, doc_id: str, fields: Record) -> Optional[Record]:
+        """Set fields on a live document; returns the document as it was before, or None"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def delete_document(self, doc_id: str) -> bool:
+        raise NotImplementedError
+
+    # Comments
+    @abc.abstractmethod
+    async def insert_comment(self, comment: Record):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def list_comments(self, document_id: Optional[str] = None, limit: int = 1000) -> List[Record]:
+        raise NotImplementedError
+
+    # Notifications
+    @abc.abstractmethod
+    async def insert_notifications(self, notifications: List[Record]):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def list_notifications(self, user_id: str, limit: int = 100) -> List[Record]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def mark_notification_read(self, notif_id: str, user_id: Optional[str] = None) -> bool:
+        """Mark one notification read; with user_id, only if it belongs to that user"""
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class MongoStorage(StorageEngine):
+    name = 'mongo'
+
+    def __init__(self, get_db):
+        self.get_db = get_db
+
+    async def get_user(self, uid):
+        return await self.get_db().users.find_one({'uid': uid}, {'_id': 0})
+
+    async def upsert_user(self, user, defaults=None):
+        update = {'$set': user}
+        if defaults:
+            update['$setOnInsert'] = {k: v for k, v in defaults.items() if k not in user}
+        return await self.get_db().users.find_one_and_update(
+            {'uid': user['uid']}, update, projection={'_id': 0}, upsert=True, return_document=True
+        )
+
+    async def list_users(self, limit=1000):
+        return await self.get_db().users.find({}, {'_id': 0}).to_list(limit)
+
+    async def set_user_role(self, uid, role):
+        result = await self.get_db().users.update_one({'uid': uid}, {'$set': {'role': role}})
+        return bool(result.matched_count)
+
+    async def insert_documents(self, docs):
+        # insert_many adds _id to the dicts it is given
+        await self.get_db().documents.insert_many([dict(d) for d in docs])
+
+    async def get_document(self, doc_id):
+        return await self.get_db().documents.find_one({'id': doc_id, 'deleted_at': {'$exists': False}}, {'_id': 0})
+
+    async def list_documents(self, user_id=None, limit=1000):
+        query: Record = {'deleted_at': {'$exists': False}}
+        if user_id:
+            query['collaborators'] = user_id
+        return await self.get_db().documents.find(query, {'_id': 0}).to_list(limit)
+
+    async def update_document(self, doc_id, fields):
+        return await self.get_db().documents.find_one_and_update(
+            {'id': doc_id, 'deleted_at': {'$exists': False}}, {'$set': fields}, projection={'_id': 0}
+        )
+
+    async def delete_document(self, doc_id):
+        return bool((await self.get_db().documents.delete_one({'id': doc_id})).deleted_count)
+
+    async def insert_comment(self, comment):
+        await self.get_db().comments.insert_one(dict(comment))
+
+    async def list_comments(self, document_id=None, limit=1000):
+        query = {'document_id': document_id} if document_id else {}
+        return await self.get_db().comments.find(query, {'_id': 0}).to_list(limit)
+
+    async def insert_notifications(self, notifications):
+        if notifications:
+            await self.get_db().notifications.insert_many([dict(n) for n in notifications])
+
+    async def list_notifications(self, user_id, limit=100):
+        return await self.get_db().notifications.find({'user_id': user_id}, {'_id': 0}).to_list(limit)
+
+    async def mark_notification_read(self, notif_id, user_id=None):
+        query = {'id': notif_id, **({'user_id': user_id} if user_id is not None else {})}
+        result = await self.get_db().notifications.update_one(query, {'$set': {'read': True}})
+        return bool(result.matched_count)
+
+
+class MemoryStorage(StorageEngine):
+    """Dict-backed engine; records are copied in and out so callers cannot alias them"""
+
+    name = 'memory'
+
+    def __init__(self):
+        self.users: Dict[str, Record] = {}
+        self.documents: Dict[str, Record] = {}
+        self.comments: Dict[str, Record] = {}
+        self.notifications: Dict[str, Record] = {}
+
+    async def get_user(self, uid):
+        return copy.deepcopy(self.users.get(uid))
+
+    async def upsert_user(self, user, defaults=None):
+        if user['uid'] not in self.users:
+            self.users[user['uid']] = copy.deepcopy(defaults or {})
+        self.users[user['uid']].update(copy.deepcopy(user))
+        return copy.deepcopy(self.users[user['uid']])
+
+    async def list_users(self, limit=1000):
+        return copy.deepcopy(list(self.users.values())[:limit])
+
+    async def set_user_role(self, uid, role):
+        if uid not in self.users:
+            return False
+        self.users[uid]['role'] = role
+        return True
+
+    async def insert_documents(self, docs):
+        for doc in docs:
+            self.documents[doc['id']] = copy.deepcopy(doc)
+
+    async def get_document(self, doc_id):
+        return copy.deepcopy(_live(self.documents.get(doc_id)))
+
+    async def list_documents(self, user_id=None, limit=1000):
+        docs = [d for d in self.documents.values()
+                if _live(d) and (not user_id or user_id in d.get('collaborators', []))]
+        return copy.deepcopy(docs[:limit])
+
+    async def update_document(self, doc_id, fields):
+        doc = _live(self.documents.get(doc_id))
+        if doc is None:
+            return None
+        previous = copy.deepcopy(doc)
+        doc.update(copy.deepcopy(fields))
+        return previous
+
+    async def delete_document(self, doc_id):
+        return self.documents.pop(doc_id, None) is not None
+
+    async def insert_comment(self, comment):
+        self.comments[comment['id']] = copy.deepcopy(comment)
+
+    async def list_comments(self, document_id=None, limit=1000):
+        comments = [c for c in self.comments.values() if not document_id or c['document_id'] == document_id]
+        return copy.deepcopy(comments[:limit])
+
+    async def insert_notifications(self, notifications):
+        for notif in notifications:
+            self.notifications[notif['id']] = copy.deepcopy(notif)
+
+    async def list_notifications(self, user_id, limit=100):
+        return copy.deepcopy([n for n in self.notifications.values() if n['user_id'] == user_id][:limit])
+
+    async def mark_notification_read(self, notif_id, user_id=None):
+        notif = self.notifications.get(notif_id)
+        if not notif or (user_id is not None and notif['user_id'] != user_id):
+            return False
+        self.notifications[notif_id]['read'] = True
+        return True
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (uid TEXT PRIMARY KEY, data TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS documents (
+    id TEXT PRIMARY KEY, created_by TEXT, updated_at TEXT, deleted INTEGER NOT NULL DEFAULT 0, data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS document_collaborators (
+    document_id TEXT NOT NULL, user_id TEXT NOT NULL, PRIMARY KEY (user_id, document_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS document_collaborators_document ON document_collaborators (document_id);
+CREATE TABLE IF NOT EXISTS comments (id TEXT PRIMARY KEY, document_id TEXT, data TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS comments_document ON comments (document_id);
+CREATE TABLE IF NOT EXISTS notifications (id TEXT PRIMARY KEY, user_id TEXT, data TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS notifications_user ON notifications (user_id);
+"""
+
+
+class SQLiteStorage(StorageEngine):
+    """JSON rows in SQLite (WAL journal); all statements run on one dedicated thread"""
+
+    name = 'sqlite'
+
+    def __init__(self, path: str = STORAGE_PATH):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sqlite')
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(SCHEMA)
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _rows(self, sql: str, params: Iterable[Any] = ()) -> List[Record]:
+        return [json.loads(row[0]) for row in self._conn.execute(sql, tuple(params))]
+
+    def _write(self, statements: List[tuple]):
+        with self._transaction():
+            for sql, params in statements:
+                self._conn.execute(sql, params)
+
+    @contextmanager
+    def _transaction(self):
+        self._conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except BaseException:
+            self._conn.execute('ROLLBACK')
+            raise
+        self._conn.execute('COMMIT')
+
+    # Users
+    async def get_user(self, uid):
+        rows = await self._run(self._rows, 'SELECT data FROM users WHERE uid = ?', (uid,))
+        return rows[0] if rows else None
+
+    def _upsert_user(self, user, defaults):
+        with self._transaction():
+            row = self._conn.execute('SELECT data FROM users WHERE uid = ?', (user['uid'],)).fetchone()
+            merged = {**(json.loads(row[0]) if row else defaults or {}), **user}
+            self._conn.execute('INSERT OR REPLACE INTO users (uid, data) VALUES (?, ?)',
+                               (user['uid'], json.dumps(merged, default=str)))
+        return merged
+
+    async def upsert_user(self, user, defaults=None):
+        return await self._run(self._upsert_user, user, defaults)
+
+    async def list_users(self, limit=1000):
+        return await self._run(self._rows, 'SELECT data FROM users LIMIT ?', (limit,))
+
+    def _set_user_role(self, uid, role):
+        cursor = self._conn.execute(
+            "UPDATE users SET data = json_set(data, '$.role', ?) WHERE uid = ?", (role, uid)
+        )
+        return cursor.rowcount > 0
+
+    async def set_user_role(self, uid, role):
+        return await self._run(self._set_user_role, uid, role)
+
+    # Documents
+    @staticmethod
+    def _document_statements(doc: Record) -> List[tuple]:
+        statements = [
+            ('INSERT OR REPLACE INTO documents (id, created_by, updated_at, deleted, data) VALUES (?, ?, ?, ?, ?)',
+             (doc['id'], doc.get('created_by'), doc.get('updated_at'), int('deleted_at' in doc),
+              json.dumps(doc, default=str))),
+            ('DELETE FROM document_collaborators WHERE document_id = ?', (doc['id'],)),
+        ]
+        statements += [
+            ('INSERT OR IGNORE INTO document_collaborators (document_id, user_id) VALUES (?, ?)', (doc['id'], uid))
+            for uid in doc.get('collaborators', [])
+        ]
+        return statements
+
+    async def insert_documents(self, docs):
+        await self._run(self._write, [s for doc in docs for s in self._document_statements(doc)])
+
+    async def get_document(self, doc_id):
+        rows = await self._run(self._rows, 'SELECT data FROM documents WHERE id = ? AND deleted = 0', (doc_id,))
+        return rows[0] if rows else None
+
+    async def list_documents(self, user_id=None, limit=1000):
+        if user_id:
+            return await self._run(
+                self._rows,
+                'SELECT d.data FROM document_collaborators c JOIN documents d ON d.id = c.document_id '
+                'WHERE c.user_id = ? AND d.deleted = 0 LIMIT ?',
+                (user_id, limit),
+            )
+        return await self._run(self._rows, 'SELECT data FROM documents WHERE deleted = 0 LIMIT ?', (limit,))
+
+    def _update_document(self, doc_id, fields):
+        with self._transaction():
+            row = self._conn.execute('SELECT data FROM documents WHERE id = ? AND deleted = 0', (doc_id,)).fetchone()
+            if row is None:
+                return None
+            previous = json.loads(row[0])
+            updated = {**previous, **fields}
+            if 'collaborators' in fields:
+                statements = self._document_statements(updated)
+            else:
+                statements = [('UPDATE documents SET updated_at = ?, deleted = ?, data = ? WHERE id = ?',
+                               (updated.get('updated_at'), int('deleted_at' in updated),
+                                json.dumps(updated, default=str), doc_id))]
+            for sql, params in statements:
+                self._conn.execute(sql, params)
+            return previous
+
+    async def update_document(self, doc_id, fields):
+        return await self._run(self._update_document, doc_id, fields)
+
+    async def delete_document(self, doc_id):
+        def delete():
+            with self._transaction():
+                self._conn.execute('DELETE FROM document_collaborators WHERE document_id = ?', (doc_id,))
+                return self._conn.execute('DELETE FROM documents WHERE id = ?', (doc_id,)).rowcount > 0
+        return await self._run(delete)
+
+    # Comments
+    async def insert_comment(self, comment):
+        await self._run(self._write, [(
+            'INSERT INTO comments (id, document_id, data) VALUES (?, ?, ?)',
+            (comment['id'], comment['document_id'], json.dumps(comment, default=str)),
+        )])
+
+    async def list_comments(self, document_id=None, limit=1000):
+        if document_id:
+            return await self._run(self._rows, 'SELECT data FROM comments WHERE document_id = ? LIMIT ?',
+                                   (document_id, limit))
+        return await self._run(self._rows, 'SELECT data FROM comments LIMIT ?', (limit,))
+
+    # Notifications
+    async def insert_notifications(self, notifications):
+        await self._run(self._write, [
+            ('INSERT INTO notifications (id, user_id, data) VALUES (?, ?, ?)',
+             (n['id'], n['user_id'], json.dumps(n, default=str)))
+            for n in notifications
+        ])
+
+    async def list_notifications(self, user_id, limit=100):
+        return await self._run(self._rows, 'SELECT data FROM notifications WHERE user_id = ? LIMIT ?',
+                               (user_id, limit))
+
+    def _mark_read(self, notif_id, user_id):
+        sql = "UPDATE notifications SET data = json_set(data, '$.read', json('true')) WHERE id = ?"
+        params = (notif_id,)
+        if user_id is not None:
+            sql += ' AND user_id = ?'
+            params += (user_id,)
+        return self._conn.execute(sql, params).rowcount > 0
+
+    async def mark_notification_read(self, notif_id, user_id=None):
+        return await self._run(self._mark_read, notif_id, user_id)
+
+    async def close(self):
+        await self._run(self._conn.close)
+        self._executor.shutdown(wait=True)
+
+
+def open_storage(engine: str = STORAGE_ENGINE, get_db=None, path: str = STORAGE_PATH) -> StorageEngine:
+    if engine == 'mongo':
+        if get_db is None:
+            raise ValueError("The mongo engine needs a database")
+        return MongoStorage(get_db)
+    if engine == 'memory':
+        return MemoryStorage()
+    if engine == 'sqlite':
+        return SQLiteStorage(path)
+    raise ValueError(f"Unknown storage engine {engine!r}")
@@ -15,6 +15,30 @@ const ExportDialog = ({ documentId, isOpen, onClose }) => {
   const handleExport = async () => {
     setExporting(true);
     try {
+      if (['pdf', 'docx', 'bundle'].includes(format)) {
+        // Signed, resumable link; the browser downloads it natively
+        const { data } = await axios.post(`${API_URL}/api/export/${documentId}/link?format=${format}`);
+        window.location.assign(`${API_URL}${data.url}`);
+        onClose();
+        return;
+      }
+
+      if (format === 'redline') {
+        // Only the sections changed since the last review, marked up
+        const { data } = await axios.post(`${API_URL}/api/export/${documentId}/redline?format=pdf`, {}, {
+          responseType: 'blob'
+        });
+        const url = window.URL.createObjectURL(data);
+        const a = document.createElement('a');
+        a.href = url;
+        a.download = `document_${documentId}_redline.pdf`;
+        a.click();
+        window.URL.revokeObjectURL(url);
+        toast.success('Redline exported successfully');
+        onClose();
+        return;
+      }
+
       const response = await axios.post(`${API_URL}/api/export/${documentId}?format=${format}`, {}, {
         responseType: format === 'json' ? 'json' : 'blob'
       });
@@ -97,6 +121,32 @@ const ExportDialog = ({ documentId, isOpen, onClose }) => {
               </Label>
             </div>
 
+            <div className="flex items-center space-x-3 p-3 border border-border rounded-sm hover:bg-muted transition-colors">
+              <RadioGroupItem value="bundle" id="bundle" />
+              <Label htmlFor="bundle" className="flex-1 cursor-pointer">
+                <div className="flex items-center gap-3">
+                  <File size={24} className="text-primary" />
+                  <div>
+                    <div className="font-medium">PDF + Attachments (ZIP)</div>
+                    <div className="text-xs text-muted-foreground">Memorandum with every section attachment</div>
+                  </div>
+                </div>
+              </Label>
+            </div>
+
+            <div className="flex items-center space-x-3 p-3 border border-border rounded-sm hover:bg-muted transition-colors">
+              <RadioGroupItem value="redline" id="redline" />
+              <Label htmlFor="redline" className="flex-1 cursor-pointer">
+                <div className="flex items-center gap-3">
+                  <FileText size={24} className="text-primary" />
+                  <div>
+                    <div className="font-medium">Redline (PDF)</div>
+                    <div className="text-xs text-muted-foreground">Only what changed since the last review</div>
+                  </div>
+                </div>
+              </Label>
+            </div>
+
             <div className="flex items-center space-x-3 p-3 border border-border rounded-sm hover:bg-muted transition-colors">
               <RadioGroupItem value="compiled" id="compiled" />
               <Label htmlFor="compiled" className="flex-1 cursor-pointer">
@@ -21,6 +21,18 @@ export const AuthProvider = ({ children }) => {
 
   const API_URL = process.env.REACT_APP_BACKEND_URL;
 
+  // Send the Firebase ID token with every API call; the SDK refreshes it when it nears expiry
+  useEffect(() => {
+    const interceptor = axios.interceptors.request.use(async (config) => {
+      if (auth.currentUser && config.url?.startsWith(API_URL)) {
+        const token = await auth.currentUser.getIdToken();
+        config.headers.Authorization = `Bearer ${token}`;
+      }
+      return config;
+    });
+    return () => axios.interceptors.request.eject(interceptor);
+  }, [API_URL]);
+
   useEffect(() => {
   const unsubscribe = onAuthStateChanged(auth, async (firebaseUser) => {
     try {
@@ -30,8 +30,9 @@ const Dashboard = () => {
 
   const fetchDocuments = async () => {
     try {
-      const response = await axios.get(`${API_URL}/api/documents?user_id=${user?.uid}`);
-      setDocuments(response.data);
+      // Membership records carry title/status, so the list never loads document bodies
+      const response = await axios.get(`${API_URL}/api/members/${user?.uid}?view=all&limit=500`);
+      setDocuments(response.data.map(m => ({ ...m, id: m.document_id })));
     } catch (error) {
       toast.error('Failed to load documents');
     } finally {
@@ -186,7 +187,7 @@ const Dashboard = () => {
                 </div>
                 <h3 className="font-semibold mb-2 line-clamp-2">{doc.title}</h3>
                 <p className="text-sm text-muted-foreground">
-                  Updated {new Date(doc.updated_at).toLocaleDateString()}
+                  {doc.last_opened ? `Opened ${new Date(doc.last_opened).toLocaleDateString()}` : 'Not opened yet'}
                 </p>
               </div>
             ))}
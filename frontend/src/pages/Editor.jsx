@@ -53,6 +53,8 @@ const Editor = () => {
     try {
       const response = await axios.get(`${API_URL}/api/documents/${id}`);
       setDocument(response.data);
+      // Keeps the dashboard's recent list ordered by last open
+      axios.patch(`${API_URL}/api/documents/${id}/members/${user?.uid}`, { opened: true }).catch(() => {});
       if (response.data.sections.length > 0) {
         setActiveSection(response.data.sections[0].section_id);
       }
@@ -68,11 +70,14 @@ const Editor = () => {
     const docRef = doc(db, 'documents', id);
     const unsubscribe = onSnapshot(docRef, (snapshot) => {
       if (snapshot.exists()) {
-        const data = snapshot.data();
+        // The backend mirrors changed sections into section_map, keyed by section_id
+        const { section_map: sectionMap = {}, sections, ...data } = snapshot.data();
         setDocument(prev => ({
           ...prev,
           ...data,
-          sections: data.sections || prev?.sections || []
+          sections: (sections || prev?.sections || []).map(s =>
+            sectionMap[s.section_id] ? { ...s, ...sectionMap[s.section_id] } : s
+          )
         }));
       }
     }, (error) => {
@@ -97,18 +102,13 @@ const Editor = () => {
     
     setSaving(true);
     try {
+      // The backend mirrors the changed sections to Firestore for real-time sync
       await axios.patch(`${API_URL}/api/documents/${id}`, {
         sections: document.sections,
-        title: document.title
+        title: document.title,
+        updated_by: user?.uid
       });
       
-      // Update Firestore for real-time sync
-      const docRef = doc(db, 'documents', id);
-      await docRef.set({
-        sections: document.sections,
-        updated_at: new Date().toISOString()
-      }, { merge: true });
-      
       setUnsavedChanges(false);
       toast.success('Document saved');
     } catch (error) {
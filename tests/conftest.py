@@ -0,0 +1,68 @@
+import asyncio
+import os
+import shutil
+import socket
+import sys
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+import httpx
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+# The backend modules import each other as top-level modules (uvicorn runs from backend/)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'test')
+
+
+class TokenIsUid:
+    """Stands in for Firebase: the bearer token is the uid"""
+
+    async def verify(self, token):
+        return {'sub': token}
+
+
+@pytest.fixture(scope='session')
+def mongod_url(tmp_path_factory):
+    """URL of a real one-member replica set, for what mongomock can't run ($merge, change streams)"""
+    if not shutil.which('mongod'):
+        pytest.skip("mongod is not installed")
+    import replset
+
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    proc, url = replset.start_replset(port=port, dbpath=str(tmp_path_factory.mktemp('mongod')))
+    yield url
+    proc.terminate()
+    proc.wait()
+
+
+@pytest.fixture
+def server(monkeypatch):
+    """The API on a fresh mongomock database, with auth required and fake tokens"""
+    import server
+
+    monkeypatch.setattr(server, 'mongo_db', AsyncMongoMockClient()['api'])
+    monkeypatch.setattr(server.authenticate, 'verifier', TokenIsUid())
+    monkeypatch.setattr(server.authenticate, 'required', True)
+    server.authenticate.roles.invalidate()
+    server.user_directory.invalidate()
+    asyncio.run(server.ensure_indexes())
+    return server
+
+
+@asynccontextmanager
+async def _client(app, uid):
+    headers = {'Authorization': f'Bearer {uid}'} if uid else {}
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://test',
+                                 headers=headers) as http:
+        yield http
+
+
+@pytest.fixture
+def client(server):
+    """``async with client('alice') as http`` calls the API as alice (no token without a uid)"""
+    return lambda uid=None: _client(server.app, uid)
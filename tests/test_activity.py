@@ -0,0 +1,31 @@
+import asyncio
+
+from mongomock_motor import AsyncMongoMockClient
+
+from activity import ActivityLog
+
+
+def event(n, created_at):
+    return {'id': f"e{n:02d}", 'document_id': 'd1', 'type': 'document.updated', 'created_at': created_at}
+
+
+def test_pages_merge_buffered_and_stored_events_without_duplicates():
+    db = AsyncMongoMockClient()['activity']
+    log = ActivityLog(lambda: db)
+    # Several events share a timestamp; e05 is both stored and still buffered (mid-flush)
+    stored = [event(n, f"2026-01-01T00:00:0{n // 3}") for n in range(6)]
+    buffered = [stored[5], event(6, '2026-01-01T00:00:02'), event(7, '2026-01-01T00:00:03')]
+
+    async def scenario():
+        await db.activity.insert_many([dict(e) for e in stored])
+        log._buffer.extend(buffered)
+        pages, before, before_id = [], None, None
+        while True:
+            events = await log.page('d1', 3, before, before_id)
+            pages.append([e['id'] for e in events])
+            if len(events) < 3:
+                return pages
+            before, before_id = events[-1]['created_at'], events[-1]['id']
+
+    pages = asyncio.run(scenario())
+    assert pages == [['e07', 'e06', 'e05'], ['e04', 'e03', 'e02'], ['e01', 'e00']]
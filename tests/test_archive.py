@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+import archive
+
+SECTIONS = [{'section_id': 's1', 'section_number': '1', 'title': 'Summary', 'content': {'text': 'revenue ' * 200}}]
+
+
+def seed(db):
+    async def main():
+        await db.documents.insert_many([
+            {'id': 'd1', 'title': 'Oak', 'status': 'archived', 'created_by': 'alice', 'collaborators': ['alice'],
+             'created_at': '2026-01-01T00:00:00', 'updated_at': '2026-01-02T00:00:00', 'sections': SECTIONS},
+            {'id': 'd2', 'title': 'Elm', 'status': 'draft', 'created_by': 'alice', 'collaborators': ['alice'],
+             'created_at': '2026-01-01T00:00:00', 'updated_at': '2026-01-02T00:00:00', 'sections': SECTIONS},
+        ])
+        await db.comments.insert_many([
+            {'id': 'c1', 'document_id': 'd1', 'content': 'Why?', 'parent_id': None},
+            {'id': 'c2', 'document_id': 'd1', 'content': 'Because', 'parent_id': 'c1'},
+        ])
+    asyncio.run(main())
+
+
+@pytest.fixture(params=['zstd', 'zlib'])
+def codec(request, monkeypatch):
+    if request.param == 'zstd':
+        pytest.importorskip('zstandard')
+    else:
+        monkeypatch.setattr(archive, 'zstandard', None)
+    return request.param
+
+
+@pytest.mark.parametrize('store', ['mongo', 'file'])
+def test_archive_and_restore_round_trip(codec, store, tmp_path):
+    db = AsyncMongoMockClient()['api']
+    seed(db)
+    blobs = archive.FileArchiveStore(tmp_path) if store == 'file' else archive.MongoArchiveStore(lambda: db)
+    archiver = archive.Archiver(lambda: db, store=blobs, after=0)
+
+    async def main():
+        original = await db.documents.find_one({'id': 'd1'}, {'_id': 0})
+        swept = await archiver.sweep()
+        stub = await db.documents.find_one({'id': 'd1'}, {'_id': 0})
+        blob = await blobs.get('d1')
+        left = await db.comments.count_documents({'document_id': 'd1'})
+        await db.documents.update_one({'id': 'd1'}, {'$push': {'collaborators': 'bob'}})
+        restored = await archiver.restore('d1')
+        comments = await db.comments.find({'document_id': 'd1'}, {'_id': 0}).sort('id', 1).to_list(None)
+        return original, swept, stub, blob, left, restored, comments, await blobs.get('d1')
+
+    original, swept, stub, blob, left, restored, comments, after = asyncio.run(main())
+    assert swept == 1 and left == 0
+    assert stub['archived'] is True and stub['sections'] == [] and stub['title'] == 'Oak'
+    assert blob[:1] == (archive.ZSTD_MAGIC if codec == 'zstd' else archive.ZLIB_MAGIC)
+    assert archiver.stats()['codec'] == codec and archiver.bytes_out < archiver.bytes_in
+    assert restored['sections'] == original['sections'] and 'archived' not in restored
+    assert restored['collaborators'] == ['alice', 'bob']
+    assert [(c['id'], c['parent_id']) for c in comments] == [('c1', None), ('c2', 'c1')]
+    assert after is None and archiver.restored == 1
+
+
+def test_zlib_archives_stay_readable_with_zstd_installed(monkeypatch):
+    pytest.importorskip('zstandard')
+    data = b'{"document": {}}' * 100
+    with monkeypatch.context() as m:
+        m.setattr(archive, 'zstandard', None)
+        zlib_blob = archive.compress(data)
+    zstd_blob = archive.compress(data)
+    assert archive.decompress(zlib_blob) == archive.decompress(zstd_blob) == data
+
+    monkeypatch.setattr(archive, 'zstandard', None)
+    with pytest.raises(RuntimeError, match='zstandard is not installed'):
+        archive.decompress(zstd_blob)
+
+
+def test_an_edit_during_archiving_keeps_the_document_hot():
+    db = AsyncMongoMockClient()['api']
+    seed(db)
+    blobs = archive.MongoArchiveStore(lambda: db)
+
+    class EditingStore:
+        async def put(self, doc_id, blob):
+            await blobs.put(doc_id, blob)
+            await db.documents.update_one({'id': doc_id}, {'$set': {'updated_at': '2026-02-01T00:00:00'}})
+
+        get = blobs.get
+        delete = blobs.delete
+
+    archiver = archive.Archiver(lambda: db, store=EditingStore(), after=0)
+
+    async def main():
+        return (await archiver.archive('d1'), await db.documents.find_one({'id': 'd1'}),
+                await blobs.get('d1'), await db.comments.count_documents({'document_id': 'd1'}))
+
+    archived, doc, blob, comments = asyncio.run(main())
+    assert archived is False and 'archived' not in doc and doc['sections'] == SECTIONS
+    assert blob is None and comments == 2
@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+
+import cache
+
+
+class FakeStream:
+    def __init__(self, changes):
+        self.changes = changes
+        self.resume_token = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.changes:
+            raise asyncio.CancelledError
+        self.resume_token = len(self.changes)
+        return self.changes.pop(0)
+
+
+class FakeDb:
+    def __init__(self, changes):
+        self.changes = changes
+        self.pipelines = []
+
+    def watch(self, pipeline, **kwargs):
+        self.pipelines.append(pipeline)
+        return FakeStream(self.changes)
+
+
+def test_watches_only_subscribed_collections(monkeypatch):
+    monkeypatch.setattr(cache, '_subscribers', {})
+    seen = []
+    cache.subscribe('users', lambda key: seen.append(('users', key)))
+    cache.subscribe('templates', lambda key: seen.append(('templates', key)))
+    db = FakeDb([
+        {'ns': {'coll': 'users'}, 'fullDocument': {'uid': 'alice'}},
+        {'ns': {'coll': 'templates'}},  # a delete: no document, so drop everything
+    ])
+
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(cache.watch_invalidations(db))
+    assert db.pipelines[0][0] == {'$match': {'ns.coll': {'$in': ['users', 'templates']}}}
+    assert seen == [('users', 'alice'), ('templates', None)]
+
+
+def test_nothing_to_watch_without_subscribers(monkeypatch):
+    monkeypatch.setattr(cache, '_subscribers', {})
+    db = FakeDb([])
+    asyncio.run(cache.watch_invalidations(db))
+    assert db.pipelines == []
+
+
+def test_unknown_collections_cannot_be_subscribed(monkeypatch):
+    monkeypatch.setattr(cache, '_subscribers', {})
+    with pytest.raises(ValueError):
+        cache.subscribe('documents', lambda key: None)
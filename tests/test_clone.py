@@ -0,0 +1,49 @@
+import asyncio
+import uuid
+
+from activity import section_digests
+
+SECTIONS = [
+    {'section_id': 's1', 'section_number': '1', 'title': 'Summary', 'content': {'text': 'Keep me'}},
+    {'section_id': 's2', 'section_number': '2', 'title': 'Financials', 'content': {'text': 'Reset me'}},
+]
+
+
+def test_clone_remaps_comments_and_recomputes_digests(server, client, mongod_url, monkeypatch):
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    async def main():
+        monkeypatch.setattr(server, 'mongo_db', AsyncIOMotorClient(mongod_url)[f'clone_{uuid.uuid4().hex}'])
+        db = server.mongo_db
+        await db.users.insert_many([{'uid': uid, 'email': f'{uid}@example.com', 'role': 'editor'}
+                                    for uid in ('alice', 'bob', 'carol')])
+        await db.documents.insert_one({
+            'id': 'd1', 'title': 'Oak', 'status': 'approved', 'created_by': 'alice',
+            'created_at': '2026-01-01T00:00:00', 'updated_at': '2026-01-01T00:00:00',
+            'collaborators': ['alice', 'bob'], 'sections': SECTIONS, 'section_digests': section_digests(SECTIONS),
+        })
+        await db.comments.insert_many([
+            {'id': 'c1', 'document_id': 'd1', 'section_id': 's1', 'user_id': 'bob', 'content': 'Why?', 'parent_id': None},
+            {'id': 'c2', 'document_id': 'd1', 'section_id': 's1', 'user_id': 'alice', 'content': 'Because', 'parent_id': 'c1'},
+        ])
+        async with client('alice') as http:
+            response = await http.post('/api/documents/d1/clone', json={
+                'created_by': 'alice', 'reset_sections': ['s2'], 'keep_comments': True,
+                'collaborator_map': {'bob': 'carol'},
+            })
+        new_id = response.json()['id']
+        clone = await db.documents.find_one({'id': new_id}, {'_id': 0})
+        comments = await db.comments.find({'document_id': new_id}, {'_id': 0}).sort('id', 1).to_list(None)
+        source = await db.documents.find_one({'id': 'd1'}, {'_id': 0})
+        return response, clone, comments, source
+
+    response, clone, comments, source = asyncio.run(main())
+    new_id = clone['id']
+    assert response.status_code == 200
+    assert clone['title'] == 'Oak (copy)' and clone['status'] == 'draft' and clone['cloned_from'] == 'd1'
+    assert sorted(clone['collaborators']) == ['alice', 'carol']
+    assert clone['sections'][0]['content'] == {'text': 'Keep me'} and clone['sections'][1]['content'] == {}
+    assert clone['section_digests'] == section_digests(clone['sections'])
+    assert clone['section_digests']['s1'] == source['section_digests']['s1']
+    assert clone['section_digests']['s2'] != source['section_digests']['s2']
+    assert [(c['id'], c['parent_id']) for c in comments] == [(f'{new_id}:c1', None), (f'{new_id}:c2', f'{new_id}:c1')]
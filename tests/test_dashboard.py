@@ -0,0 +1,24 @@
+import asyncio
+
+
+def test_saves_invalidate_collaborators_dashboards(server, client):
+    async def main():
+        await server.mongo_db.documents.insert_one({
+            'id': 'd1', 'title': 'Oak', 'status': 'draft', 'created_by': 'alice', 'collaborators': ['alice', 'bob'],
+            'created_at': '2026-01-01T00:00:00', 'updated_at': '2026-01-01T00:00:00',
+            'sections': [{'section_id': 'summary', 'content': {}}],
+        })
+        async with client('alice') as alice, client('bob') as bob:
+            before = (await bob.get('/api/dashboard/bob')).json()
+            await alice.patch('/api/documents/d1', json={
+                'sections': [{'section_id': 'summary', 'content': {'text': 'Growth'}}]})
+            after_save = (await bob.get('/api/dashboard/bob')).json()
+            await alice.patch('/api/documents/d1', json={'status': 'archived'})
+            after_status = (await bob.get('/api/dashboard/bob')).json()
+        return before, after_save, after_status
+
+    before, after_save, after_status = asyncio.run(main())
+    assert before['average_completion'] == 0 and before['counts'] == {'draft': 1}
+    assert after_save['average_completion'] == 1
+    assert after_save['recent'][0]['updated_at'] > before['recent'][0]['updated_at']
+    assert after_status['counts'] == {'archived': 1}
@@ -0,0 +1,72 @@
+import asyncio
+
+from mongomock_motor import AsyncMongoMockClient
+
+from directory import UserDirectory
+
+USERS = [
+    {'uid': 'u1', 'email': 'Ann.Lee@example.com', 'display_name': 'Ann Lee'},
+    {'uid': 'u2', 'email': 'anna@example.com', 'display_name': 'Anna Karenina'},
+    {'uid': 'u3', 'email': 'bob@example.com', 'display_name': 'Bob Annandale'},
+    {'uid': 'u4', 'email': 'zed@example.com'},
+]
+
+
+def directory_with(users):
+    db = AsyncMongoMockClient()['api']
+    asyncio.run(db.users.insert_many([dict(u) for u in users]))
+    return db, UserDirectory(lambda: db)
+
+
+def uids(users):
+    return [u['uid'] for u in users]
+
+
+def test_prefix_matches_emails_and_name_words_exact_first():
+    db, directory = directory_with(USERS)
+
+    async def main():
+        return [uids(await directory.search(q)) for q in ('ann', 'ANN ', 'anna', 'lee', 'zed@', 'x', '')]
+
+    ann, upper, anna, lee, zed, none, empty = asyncio.run(main())
+    assert ann[0] == 'u1' and sorted(ann) == ['u1', 'u2', 'u3']
+    assert upper == ann
+    assert anna[0] == 'u2' and sorted(anna) == ['u2', 'u3']
+    assert lee == ['u1'] and zed == ['u4'] and none == [] and empty == []
+
+
+def test_limit_and_one_result_per_user():
+    db, directory = directory_with([{'uid': f'u{i}', 'email': f'sam{i}@example.com', 'display_name': f'Sam {i}'}
+                                    for i in range(20)])
+    results = asyncio.run(directory.search('sam', limit=5))
+    assert len(results) == len(set(uids(results))) == 5
+
+
+def test_invalidated_users_are_reindexed_on_next_lookup():
+    db, directory = directory_with(USERS)
+
+    async def main():
+        await directory.search('ann')
+        await db.users.update_one({'uid': 'u1'}, {'$set': {'display_name': 'Zoe Lee', 'email': 'zoe@example.com'}})
+        await db.users.insert_one({'uid': 'u5', 'email': 'annie@example.com', 'display_name': 'Annie'})
+        stale = uids(await directory.search('ann'))
+        directory.invalidate('u1')
+        directory.invalidate('u5')
+        return stale, uids(await directory.search('ann')), uids(await directory.search('zoe')), \
+            await directory.resolve(['ann.lee@example.com', 'ZOE@example.com'])
+
+    stale, ann, zoe, resolved = asyncio.run(main())
+    assert 'u1' in stale and 'u5' not in stale
+    assert sorted(ann) == ['u2', 'u3', 'u5'] and zoe == ['u1']
+    assert list(resolved) == ['ZOE@example.com']
+
+
+def test_search_endpoint_caps_the_limit(server, client):
+    async def main():
+        await server.mongo_db.users.insert_many([{'uid': f'u{i}', 'email': f'kim{i}@example.com'} for i in range(60)])
+        async with client('u1') as http:
+            return await http.get('/api/users/search', params={'q': 'kim', 'limit': 500})
+
+    response = asyncio.run(main())
+    assert response.status_code == 200 and len(response.json()) == 50
+    assert set(response.json()[0]) == {'uid', 'email', 'display_name', 'avatar_url'}
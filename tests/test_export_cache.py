@@ -0,0 +1,68 @@
+import asyncio
+import os
+
+import export_cache
+
+DOC = {'id': 'd1', 'title': 'Oak', 'updated_at': '2026-01-01T00:00:00', 'sections': []}
+
+
+def recording_renderer(monkeypatch, tmp_path):
+    monkeypatch.setattr(export_cache, 'CACHE_DIR', tmp_path)
+    rendered = []
+
+    def render(doc, output_path):
+        rendered.append(doc['updated_at'])
+        with open(output_path, 'w') as handle:
+            handle.write(doc['title'])
+    monkeypatch.setitem(export_cache.RENDERERS, 'pdf', render)
+    return rendered
+
+
+def test_artifacts_are_keyed_by_id_and_updated_at(tmp_path, monkeypatch):
+    monkeypatch.setattr(export_cache, 'CACHE_DIR', tmp_path)
+    path = export_cache.artifact_path(DOC, 'pdf')
+    assert path.parent == tmp_path / 'd1' and export_cache.ARTIFACT_NAME.fullmatch(path.name)
+    assert export_cache.artifact_path({**DOC, 'title': 'Renamed', 'sections': [{}]}, 'pdf') == path
+    assert export_cache.artifact_path({**DOC, 'updated_at': '2026-01-02T00:00:00'}, 'pdf') != path
+    assert export_cache.artifact_path({**DOC, 'id': 'd2'}, 'pdf').name != path.name
+
+
+def test_quick_successive_transitions_render_once(tmp_path, monkeypatch):
+    rendered = recording_renderer(monkeypatch, tmp_path)
+    loads = []
+
+    async def load():
+        loads.append(DOC['id'])
+        return DOC
+
+    async def main():
+        scheduler = export_cache.PrerenderScheduler(delay=0.05)
+        for _ in range(3):
+            scheduler.schedule('d1', load, formats=['pdf'])
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.2)
+        scheduler.schedule('d1', load, formats=['pdf'])
+        await asyncio.sleep(0.2)
+        return scheduler.stats()
+
+    stats = asyncio.run(main())
+    assert loads == ['d1', 'd1'] and rendered == [DOC['updated_at']]
+    assert stats == {'pending': 0, 'rendered': 1, 'superseded': 2}
+    assert export_cache.lookup(DOC, 'pdf').read_text() == 'Oak'
+
+
+def test_a_new_revision_replaces_unlinked_older_ones(tmp_path, monkeypatch):
+    rendered = recording_renderer(monkeypatch, tmp_path)
+    edited = {**DOC, 'updated_at': '2026-01-02T00:00:00'}
+    later = {**DOC, 'updated_at': '2026-01-03T00:00:00'}
+    old = export_cache.render(DOC, 'pdf')
+    stale = old.stat().st_mtime - export_cache.DOWNLOAD_URL_TTL - 1
+    os.utime(old, (stale, stale))
+    current = export_cache.render(edited, 'pdf')
+    export_cache.mark_linked(current)
+    newest = export_cache.render(later, 'pdf')
+
+    assert rendered == [DOC['updated_at'], edited['updated_at'], later['updated_at']]
+    assert not old.exists() and current.exists() and newest.exists()
+    assert sorted(p.name for p in (tmp_path / 'd1').iterdir()) == sorted([current.name, newest.name])
+    assert export_cache.purge('d1') == 2 and not (tmp_path / 'd1').exists()
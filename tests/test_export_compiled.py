@@ -0,0 +1,23 @@
+from export_compiled import iter_html, iter_txt
+
+DOC = {
+    'id': 'd1',
+    'title': 1234,
+    'status': 'draft',
+    'created_at': '2026-01-01T00:00:00',
+    'sections': [
+        {'section_id': 's1', 'section_number': 1, 'title': '<b>Overview</b>', 'content': {'amount': 5, 'open': True}},
+        {'section_id': 's2', 'section_number': 2.1, 'title': 99, 'content': {}},
+    ],
+}
+
+
+def test_html_accepts_non_string_fields_and_escapes():
+    html = ''.join(iter_html(DOC))
+    assert '1234' in html and '2.1' in html and '99' in html
+    assert '&lt;b&gt;Overview&lt;/b&gt;' in html and '<b>Overview</b>' not in html
+
+
+def test_txt_accepts_non_string_fields():
+    txt = ''.join(iter_txt(DOC))
+    assert '1234' in txt and '<b>Overview</b>' in txt
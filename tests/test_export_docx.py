@@ -0,0 +1,35 @@
+from docx import Document
+
+import export_docx
+
+
+def sample():
+    return {
+        'title': 'Project Oak', 'status': 'draft',
+        'created_at': '2026-01-01T00:00:00', 'updated_at': '2026-01-02T00:00:00',
+        'sections': [{
+            'section_id': 'summary', 'section_number': 1, 'title': 'Summary',
+            'instructions': 'Keep it short', 'content': {'key_points': 'Growth'},
+        }],
+    }
+
+
+def test_styles_are_applied_by_id(tmp_path):
+    path = tmp_path / 'im.docx'
+    export_docx.generate_docx(sample(), str(path))
+    paragraphs = Document(str(path)).paragraphs
+
+    styles = [(p.text, p.style.name) for p in paragraphs if p.text]
+    assert ('Redwood Partners Investment Memorandum', 'Title') in styles
+    assert ('1. Summary', 'IM TOC Entry') in styles
+    assert ('1. Summary', 'Heading 1') in styles
+    assert ('Instructions: Keep it short', 'IM Instructions') in styles
+    field = next(p for p in paragraphs if p.text.startswith('Key Points'))
+    assert [(r.text, r.style.name) for r in field.runs] == [('Key Points: ', 'IM Label'), ('Growth', 'Default Paragraph Font')]
+
+
+def test_exports_do_not_share_state(tmp_path):
+    first, second = tmp_path / 'a.docx', tmp_path / 'b.docx'
+    export_docx.generate_docx(sample(), str(first))
+    export_docx.generate_docx(sample(), str(second))
+    assert len(Document(str(first)).paragraphs) == len(Document(str(second)).paragraphs)
@@ -0,0 +1,118 @@
+import re
+import time
+
+import pytest
+from pypdf import PdfReader
+
+import export_pdf
+
+
+def section(section_id, number, fields=1, words=400):
+    return {
+        'section_id': section_id, 'section_number': number, 'title': section_id.replace('_', ' ').title(),
+        'content': {f'field_{i}': ' '.join(['revenue'] * words) for i in range(fields)},
+    }
+
+
+def sample(annexures=3):
+    sections = [section('summary', 1), section('risks', 2, fields=4)]
+    sections += [section(f'annexure_{i}', 3 + i, fields=2) for i in range(1, annexures + 1)]
+    return {'title': 'Project Oak', 'status': 'draft', 'created_by': 'alice',
+            'created_at': '2026-01-01T00:00:00', 'updated_at': '2026-01-02T00:00:00', 'sections': sections}
+
+
+def toc_and_headings(path):
+    pages = [page.extract_text() for page in PdfReader(str(path)).pages]
+    toc = dict(re.findall(r'^\d+\. (.+)\n (\d+)$', pages[1], re.M))
+    headings = {}
+    for number, text in enumerate(pages, start=1):
+        for title in toc:
+            if number > 2 and title not in headings and re.search(rf'^\d+\. {re.escape(title)}$', text, re.M):
+                headings[title] = number
+    return pages, {title: int(page) for title, page in toc.items()}, headings
+
+
+def test_plan_chunks_keeps_core_together_and_groups_annexures():
+    sections = sample(annexures=5)['sections']
+    chunks = export_pdf.plan_chunks(sections, annexures_per_chunk=2)
+    assert [[s['section_id'] for s in chunk] for chunk in chunks] == [
+        ['summary', 'risks'], ['annexure_1', 'annexure_2'], ['annexure_3', 'annexure_4'], ['annexure_5'],
+    ]
+    assert export_pdf.plan_chunks([]) == []
+    assert len(export_pdf.plan_chunks(sections[2:], annexures_per_chunk=2)) == 3
+
+
+def test_serial_render_numbers_the_toc(tmp_path):
+    path = tmp_path / 'serial.pdf'
+    export_pdf.generate_pdf(sample(), str(path), cache=None, parallel=False)
+    pages, toc, headings = toc_and_headings(path)
+
+    assert len(toc) == 5
+    assert toc == headings
+    assert all(f'Page {number}' in text for number, text in enumerate(pages, start=1))
+
+
+def test_parallel_render_numbers_the_toc(tmp_path):
+    path = tmp_path / 'parallel.pdf'
+    try:
+        export_pdf.generate_pdf_parallel(sample(), str(path))
+    finally:
+        export_pdf._discard_pool(export_pdf._get_pool())
+    pages, toc, headings = toc_and_headings(path)
+
+    # Each chunk starts on a fresh page, so the numbers differ from a serial render
+    assert len(toc) == 5
+    assert toc == headings
+    assert all(f'Page {number}' in text for number, text in enumerate(pages, start=1))
+
+
+def test_discarding_a_pool_kills_stuck_workers():
+    pool = export_pdf._get_pool()
+    future = pool.submit(time.sleep, 60)
+    deadline = time.monotonic() + 30
+    while not future.running() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    processes = list(pool._processes.values())
+
+    export_pdf._discard_pool(pool)
+    for process in processes:
+        process.join(10)
+    assert processes and not any(p.is_alive() for p in processes)
+    assert export_pdf._get_pool() is not pool
+    export_pdf._discard_pool(export_pdf._get_pool())
+
+
+def test_fragment_cache_key_follows_content_and_style():
+    key = export_pdf.SectionFragmentCache.key
+    base = section('summary', 1)
+    reordered = dict(reversed(list(base.items())))
+    assert key(base) == key(reordered)
+    assert key(base) != key({**base, 'title': 'Other'})
+    assert key(base) != key(base, style_key='restyled')
+
+
+def test_fragment_cache_evicts_least_recently_used_and_hands_out_copies():
+    cache = export_pdf.SectionFragmentCache(maxsize=2)
+    cache.put('a', export_pdf.render_section(section('a', 1)))
+    cache.put('b', export_pdf.render_section(section('b', 2)))
+    first = cache.get('a')
+    cache.put('c', export_pdf.render_section(section('c', 3)))
+    assert cache.get('b') is None and cache.get('a') is not None
+    assert cache.stats() == {'size': 2, 'hits': 2, 'misses': 1}
+    assert all(copy is not original for copy, original in zip(first, cache._entries['a']))
+
+
+def test_repeated_exports_render_only_changed_sections(tmp_path):
+    cache = export_pdf.SectionFragmentCache()
+    doc = sample(annexures=2)
+    first, second, edited = {}, {}, {}
+    export_pdf.generate_pdf(doc, str(tmp_path / 'first.pdf'), cache=cache, stats=first, parallel=False)
+    export_pdf.generate_pdf(doc, str(tmp_path / 'second.pdf'), cache=cache, stats=second, parallel=False)
+    doc['sections'][1]['content']['field_0'] = 'Revised'
+    export_pdf.generate_pdf(doc, str(tmp_path / 'edited.pdf'), cache=cache, stats=edited, parallel=False)
+
+    assert (first['hits'], first['misses']) == (0, 4)
+    assert (second['hits'], second['misses']) == (4, 0)
+    assert (edited['hits'], edited['misses']) == (3, 1)
+    assert toc_and_headings(tmp_path / 'first.pdf')[0] == toc_and_headings(tmp_path / 'second.pdf')[0]
+    assert 'Revised' in ''.join(toc_and_headings(tmp_path / 'edited.pdf')[0])
@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+from http_ranges import byte_range, file_chunks, ranged_response
+
+
+@pytest.mark.parametrize('header, expected', [
+    (None, None),
+    ('bytes=0-99', (0, 99)),
+    ('bytes=100-', (100, 999)),
+    ('bytes=-200', (800, 999)),
+    ('bytes=-5000', (0, 999)),
+    ('bytes=900-5000', (900, 999)),
+    ('bytes=0-0', (0, 0)),
+    ('BYTES = 10-19', (10, 19)),
+    ('items=0-10', None),
+    ('bytes=0-10,20-30', None),
+    ('bytes=abc-', None),
+    ('bytes=10-5', None),
+    ('bytes=5', None),
+])
+def test_byte_range(header, expected):
+    assert byte_range(header, 1000) == expected
+
+
+@pytest.mark.parametrize('header', ['bytes=1000-', 'bytes=5000-6000', 'bytes=-0'])
+def test_unsatisfiable_range(header):
+    with pytest.raises(HTTPException) as e:
+        byte_range(header, 1000)
+    assert e.value.status_code == 416
+    assert e.value.headers['Content-Range'] == 'bytes */1000'
+
+
+def make_request(**headers):
+    return Request({
+        'type': 'http',
+        'headers': [(k.replace('_', '-').encode(), v.encode()) for k, v in headers.items()],
+    })
+
+
+def body(response):
+    async def collect():
+        return b''.join([chunk async for chunk in response.body_iterator])
+    return asyncio.run(collect())
+
+
+@pytest.fixture
+def content(tmp_path):
+    path = tmp_path / 'artifact.bin'
+    path.write_bytes(bytes(range(256)) * 4)
+    return path
+
+
+def respond(path, **headers):
+    return ranged_response(make_request(**headers), path.stat().st_size, file_chunks(path, chunk_bytes=100),
+                           'application/octet-stream', etag='"v1"')
+
+
+def test_full_response(content):
+    response = respond(content)
+    assert response.status_code == 200
+    assert response.headers['content-length'] == '1024' and response.headers['accept-ranges'] == 'bytes'
+    assert body(response) == content.read_bytes()
+
+
+def test_partial_response(content):
+    response = respond(content, range='bytes=250-509')
+    assert response.status_code == 206
+    assert response.headers['content-range'] == 'bytes 250-509/1024'
+    assert response.headers['content-length'] == '260'
+    assert body(response) == content.read_bytes()[250:510]
+
+
+def test_if_range_mismatch_sends_everything(content):
+    response = respond(content, range='bytes=0-9', if_range='"v0"')
+    assert response.status_code == 200 and len(body(response)) == 1024
+    assert respond(content, range='bytes=0-9', if_range='"v1"').status_code == 206
+
+
+@pytest.mark.parametrize('if_none_match', ['"v1"', 'W/"v1"', '"v0", "v1"', '*'])
+def test_if_none_match_is_not_modified(content, if_none_match):
+    response = respond(content, if_none_match=if_none_match)
+    assert response.status_code == 304 and response.headers['etag'] == '"v1"'
@@ -0,0 +1,88 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+from mongomock_motor import AsyncMongoMockClient
+
+from idempotency import IdempotencyStore, fingerprint
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def new_store(**kwargs):
+    db = AsyncMongoMockClient()['idempotency']
+    return IdempotencyStore(lambda: db, **kwargs), db
+
+
+def test_first_request_claims_and_retry_replays():
+    store, _ = new_store()
+    print_ = fingerprint({'title': 'A'})
+
+    async def scenario():
+        assert await store.begin('documents:k1', print_, 'lease-1') is None
+        await store.complete('documents:k1', print_, {'id': 'doc-1'})
+        store.front.invalidate()  # force the replay through Mongo
+        return await store.begin('documents:k1', print_, 'lease-2')
+
+    assert run(scenario()) == {'id': 'doc-1'}
+
+
+def test_different_payload_is_rejected():
+    store, _ = new_store()
+
+    async def scenario():
+        await store.begin('documents:k1', fingerprint({'title': 'A'}))
+        await store.begin('documents:k1', fingerprint({'title': 'B'}))
+
+    with pytest.raises(HTTPException) as e:
+        run(scenario())
+    assert e.value.status_code == 422
+
+
+def test_retry_during_lease_conflicts():
+    store, _ = new_store()
+    print_ = fingerprint({'title': 'A'})
+
+    async def scenario():
+        await store.begin('documents:k1', print_, 'lease-1')
+        await store.begin('documents:k1', print_, 'lease-2')
+
+    with pytest.raises(HTTPException) as e:
+        run(scenario())
+    assert e.value.status_code == 409
+
+
+def test_expired_lease_is_taken_over():
+    store, db = new_store()
+    print_ = fingerprint({'title': 'A'})
+
+    async def scenario():
+        await store.begin('documents:k1', print_, 'lease-1')
+        # The first request crashed without completing or abandoning the key
+        await db.idempotency_keys.update_one(
+            {'_id': 'documents:k1'}, {'$set': {'pending_until': datetime.utcnow() - timedelta(seconds=1)}}
+        )
+        claimed = await store.begin('documents:k1', print_, 'lease-2')
+        # The crashed request's late cleanup must not release the new claim
+        await store.abandon('documents:k1', 'lease-1')
+        return claimed, await db.idempotency_keys.find_one({'_id': 'documents:k1'})
+
+    claimed, record = run(scenario())
+    assert claimed is None
+    assert record['lease'] == 'lease-2'
+    assert record['pending_until'] > datetime.utcnow()
+
+
+def test_abandon_releases_the_key():
+    store, _ = new_store()
+    print_ = fingerprint({'title': 'A'})
+
+    async def scenario():
+        await store.begin('documents:k1', print_, 'lease-1')
+        await store.abandon('documents:k1', 'lease-1')
+        return await store.begin('documents:k1', print_, 'lease-2')
+
+    assert run(scenario()) is None
@@ -0,0 +1,67 @@
+import asyncio
+
+from mongomock_motor import AsyncMongoMockClient
+
+from im_templates import DEFAULT_TEMPLATE_ID, TemplateRegistry
+
+SECTIONS = [{'section_id': 'intro', 'section_number': '1', 'title': 'Intro', 'content': {'notes': ['draft']}}]
+
+
+def test_builtin_template_is_version_one_until_a_version_is_published():
+    async def main():
+        db = AsyncMongoMockClient()['api']
+        registry = TemplateRegistry()
+        builtin = await registry.get(db)
+        published = await registry.publish(db, DEFAULT_TEMPLATE_ID, 'Redwood IM v2', SECTIONS)
+        return builtin, published, await registry.get(db), await registry.get(db, version=1)
+
+    builtin, published, latest, pinned = asyncio.run(main())
+    assert builtin.template_id == DEFAULT_TEMPLATE_ID and builtin.version == 1
+    assert published.version == 2 and latest.version == 2
+    assert pinned is builtin and len(pinned.sections) == 23
+
+
+def test_unknown_templates_and_versions_are_missing():
+    async def main():
+        db = AsyncMongoMockClient()['api']
+        registry = TemplateRegistry()
+        return await registry.get(db, 'nope'), await registry.get(db, version=7)
+
+    assert asyncio.run(main()) == (None, None)
+
+
+def test_instantiate_returns_independent_copies():
+    async def main():
+        registry = TemplateRegistry()
+        return await registry.publish(AsyncMongoMockClient()['api'], 'memo', 'Memo', SECTIONS)
+
+    template = asyncio.run(main())
+    first, second = template.instantiate(), template.instantiate()
+    first[0]['content']['notes'].append('edited')
+    first[0]['title'] = 'Changed'
+    assert second[0]['content'] == {'notes': ['draft']} and second[0]['title'] == 'Intro'
+    assert template.sections[0]['content']['notes'] == ['draft']
+
+
+def test_documents_are_seeded_from_the_requested_version(server, client, monkeypatch):
+    monkeypatch.setattr(server, 'template_registry', TemplateRegistry())
+
+    async def main():
+        await server.mongo_db.users.insert_one({'uid': 'root', 'email': 'r@example.com', 'role': 'admin'})
+        async with client('root') as http:
+            published = await http.post('/api/templates', json={'template_id': 'memo', 'name': 'Memo',
+                                                                'sections': SECTIONS})
+            await http.post('/api/templates', json={'template_id': 'memo', 'name': 'Memo v2', 'sections': []})
+            pinned = await http.post('/api/documents', json={'title': 'A', 'created_by': 'root',
+                                                             'template_id': 'memo', 'template_version': 1})
+            batch = await http.post('/api/documents/batch', json={'titles': ['B', 'C'], 'created_by': 'root',
+                                                                  'template_id': 'memo'})
+            missing = await http.post('/api/documents', json={'title': 'D', 'created_by': 'root',
+                                                              'template_id': 'memo', 'template_version': 9})
+        return published, pinned, batch, missing
+
+    published, pinned, batch, missing = asyncio.run(main())
+    assert published.status_code == 200 and published.json()['version'] == 1
+    assert pinned.json()['template_version'] == 1 and pinned.json()['sections'][0]['section_id'] == 'intro'
+    assert [(d['title'], d['template_version'], d['sections']) for d in batch.json()] == [('B', 2, []), ('C', 2, [])]
+    assert missing.status_code == 404
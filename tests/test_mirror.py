@@ -0,0 +1,101 @@
+import asyncio
+
+import pytest
+
+from mirror import FirestoreMirror, MemoryFirestore
+
+
+def mirror_on(firestore, **kwargs):
+    return FirestoreMirror(client_factory=lambda: firestore, enabled=True, **kwargs)
+
+
+def test_notes_coalesce_into_one_write():
+    firestore = MemoryFirestore()
+    mirror = mirror_on(firestore)
+
+    async def main():
+        mirror.note('d1', {'title': 'Draft', 'updated_at': '1'}, {'summary': {'content': {'text': 'a'}}})
+        mirror.note('d1', {'updated_at': '2'}, {'risks': {'content': {'text': 'b'}}})
+        mirror.note('d1', {}, {'summary': {'content': {'text': 'c'}}})
+        mirror.note('d2', {'status': 'in_review'})
+        return await mirror.flush()
+
+    assert asyncio.run(main())
+    assert firestore.commits == 1 and mirror.writes == 2 and mirror.notes == 4
+    assert firestore.documents['documents/d1'] == {
+        'title': 'Draft', 'updated_at': '2',
+        'section_map': {'summary': {'content': {'text': 'c'}}, 'risks': {'content': {'text': 'b'}}},
+    }
+    assert firestore.documents['documents/d2'] == {'status': 'in_review'}
+
+
+def test_changed_sections_replace_whole_and_others_stay():
+    firestore = MemoryFirestore()
+    firestore.documents['documents/d1'] = {
+        'title': 'Old', 'owner': 'alice',
+        'section_map': {'summary': {'content': {'text': 'a', 'extra': 'x'}}, 'risks': {'content': {'text': 'r'}}},
+    }
+    mirror = mirror_on(firestore)
+
+    async def main():
+        mirror.note('d1', {'title': 'New'}, {'summary': {'content': {'text': 'b'}}, 'deal.terms': {'content': {}}})
+        await mirror.flush()
+
+    asyncio.run(main())
+    assert firestore.documents['documents/d1'] == {
+        'title': 'New', 'owner': 'alice',
+        'section_map': {
+            'summary': {'content': {'text': 'b'}},
+            'risks': {'content': {'text': 'r'}},
+            'deal.terms': {'content': {}},
+        },
+    }
+
+
+def test_failed_flush_retries_under_newer_changes():
+    firestore = MemoryFirestore()
+    firestore.fail_next = 1
+    mirror = mirror_on(firestore)
+
+    async def main():
+        mirror.note('d1', {'title': 'First', 'status': 'draft'})
+        failed = await mirror.flush()
+        mirror.note('d1', {'title': 'Second'})
+        return failed, await mirror.flush()
+
+    assert asyncio.run(main()) == (False, True)
+    assert firestore.documents['documents/d1'] == {'title': 'Second', 'status': 'draft'}
+    assert mirror.failures == 1 and mirror.dropped == 0
+
+
+def test_backs_off_and_drops_after_max_attempts(monkeypatch):
+    firestore = MemoryFirestore()
+    firestore.fail_next = 10
+    mirror = mirror_on(firestore, debounce=0.01, max_attempts=3)
+    delays, sleep = [], asyncio.sleep
+
+    async def record(delay):
+        delays.append(delay)
+        await sleep(0)
+
+    async def main():
+        monkeypatch.setattr(asyncio, 'sleep', record)
+        mirror.note('d1', {'title': 'Lost'})
+        await mirror.start()
+        while not mirror.dropped:
+            await sleep(0)
+        await mirror.stop()
+
+    asyncio.run(main())
+    assert delays[:3] == [0.01, 0.02, 0.04]
+    assert mirror.failures == 3 and mirror.stats()['pending'] == 0
+    assert firestore.documents == {}
+
+
+def test_start_fails_without_a_client():
+    def broken():
+        raise RuntimeError("no credentials")
+
+    with pytest.raises(RuntimeError, match="FIRESTORE_MIRROR=0"):
+        asyncio.run(FirestoreMirror(client_factory=broken, enabled=True).start())
+    asyncio.run(FirestoreMirror(client_factory=broken, enabled=False).start())
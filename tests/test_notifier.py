@@ -0,0 +1,30 @@
+import asyncio
+
+import notifier
+
+
+def test_message_uses_display_names():
+    notification = {'type': 'document_updated', 'document_title': 'Oak',
+                    'changed_sections': ['summary', 'risks'], 'editors': ['u1', 'u2']}
+    assert notifier.message(notification, {'u1': 'Bob Smith'}) == 'Bob Smith, u2 updated 2 sections of Oak'
+    assert notifier.message({**notification, 'editors': []}) == 'A collaborator updated 2 sections of Oak'
+    assert notifier.message({'type': 'mention', 'message': 'Hi'}) == 'Hi'
+
+
+def test_notifications_name_their_editors(server, client):
+    async def main():
+        await server.mongo_db.users.insert_many([
+            {'uid': 'alice', 'email': 'alice@example.com', 'display_name': 'Alice', 'role': 'editor'},
+            {'uid': 'bob', 'email': 'bob@example.com', 'display_name': 'Bob Smith', 'role': 'editor'},
+            {'uid': 'carol', 'email': 'carol@example.com', 'display_name': '', 'role': 'editor'},
+        ])
+        await server.mongo_db.notifications.insert_one({
+            'id': 'n1', 'user_id': 'alice', 'type': 'document_updated', 'title': 'Document updated',
+            'document_id': 'd1', 'document_title': 'Oak', 'read': False, 'changed_sections': ['summary'],
+            'editors': ['bob', 'carol'], 'created_at': '2026-01-01T00:00:00',
+        })
+        async with client('alice') as http:
+            return (await http.get('/api/notifications/alice')).json()
+
+    notifications = asyncio.run(main())
+    assert [n['message'] for n in notifications] == ['Bob Smith, carol@example.com updated 1 section of Oak']
@@ -0,0 +1,118 @@
+import asyncio
+import itertools
+import json
+import os
+import time
+from types import SimpleNamespace
+
+import pytest
+from fastapi.concurrency import run_in_threadpool
+
+import profiling
+from profiling import MongoCommandTimer
+
+_ids = itertools.count()
+
+
+def command(timer, collection):
+    """Start and finish one command from the calling context, like a Motor executor thread"""
+    request_id = next(_ids)
+    timer.started(SimpleNamespace(command={'find': collection}, command_name='find', request_id=request_id))
+    timer.succeeded(SimpleNamespace(request_id=request_id, duration_micros=1500))
+
+
+def test_concurrent_sessions_only_see_their_own_commands():
+    timer = MongoCommandTimer()
+
+    async def request(collection):
+        commands = []
+        token = timer.collect(commands)
+        try:
+            for _ in range(3):
+                await asyncio.sleep(0)
+                await asyncio.to_thread(command, timer, collection)
+        finally:
+            timer.stop(token)
+        return commands
+
+    async def scenario():
+        profiled = asyncio.gather(request('documents'), request('comments'))
+        await asyncio.to_thread(command, timer, 'background')  # not part of any profiled request
+        return await profiled
+
+    documents, comments = asyncio.run(scenario())
+    assert [c['collection'] for c in documents] == ['documents'] * 3
+    assert [c['collection'] for c in comments] == ['comments'] * 3
+    assert documents[0]['duration_ms'] == 1.5
+    assert not timer._inflight
+
+
+def test_command_finishing_after_the_request_is_not_left_in_flight():
+    timer = MongoCommandTimer()
+    commands = []
+    token = timer.collect(commands)
+    timer.started(SimpleNamespace(command={'find': 'documents'}, command_name='find', request_id=-1))
+    timer.stop(token)
+    timer.failed(SimpleNamespace(request_id=-1, duration_micros=10))
+    assert not timer._inflight and commands[0]['ok'] is False
+
+
+def test_rotation_keeps_newest_profiles(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, 'PROFILE_DIR', tmp_path)
+    now = time.time()
+    for n in range(5):
+        path = tmp_path / f"p{n}.speedscope.json"
+        path.write_text('{}')
+        os.utime(path, (now - n, now - n))
+    stale = tmp_path / 'old.speedscope.json'
+    stale.write_text('{}')
+    os.utime(stale, (now - 7200, now - 7200))
+    profiling._rotate(keep=3, max_age=3600)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['p0.speedscope.json', 'p1.speedscope.json', 'p2.speedscope.json']
+
+
+def busy(n):
+    return sum(i * i for i in range(n))
+
+
+def test_worker_thread_work_gets_its_own_lane(tmp_path, monkeypatch):
+    pytest.importorskip('pyinstrument')
+    monkeypatch.setattr(profiling, 'PROFILE_DIR', tmp_path)
+
+    async def app(scope, receive, send):
+        await run_in_threadpool(profiling.profiled(busy), 300_000)
+        await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+        await send({'type': 'http.response.body', 'body': b''})
+
+    async def allow(scope):
+        return True
+
+    async def main():
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+        scope = {'type': 'http', 'method': 'GET', 'path': '/x', 'headers': [(b'x-profile', b'1')], 'query_string': b''}
+        await profiling.ProfilingMiddleware(app, allow)(scope, None, send)
+        return dict(sent[0]['headers'])
+
+    headers = asyncio.run(main())
+    speedscope = json.loads(profiling.profile_path(headers[b'x-profile-id'].decode()).read_text())
+    lanes = [p for p in speedscope['profiles'] if p['name'] == 'Worker thread: busy']
+    assert len(lanes) == 1 and lanes[0]['events']
+    frames = speedscope['shared']['frames']
+    assert 'busy' in {frames[e['frame']]['name'] for e in lanes[0]['events']}
+    # Outside a profiled request the wrapper just calls through
+    assert profiling.profiled(busy)(10) == busy(10)
+
+
+def test_user_id_header_does_not_grant_profiling(server, client, monkeypatch):
+    monkeypatch.setattr(server.authenticate, 'required', False)
+
+    async def main():
+        await server.mongo_db.users.insert_one({'uid': 'root', 'email': 'r@example.com', 'display_name': 'Root',
+                                                'role': 'admin', 'created_at': '2026-01-01T00:00:00'})
+        async with client() as http:
+            return await http.get('/api/health', headers={'X-Profile': '1', 'X-User-Id': 'root'})
+
+    assert asyncio.run(main()).status_code == 403
@@ -0,0 +1,49 @@
+import asyncio
+from types import SimpleNamespace
+
+from starlette.requests import Request
+
+from ratelimit import ConcurrencyGate, client_address, request_identity
+
+
+def make_request(headers=(), path_params=None, client=('10.0.0.9', 1234)):
+    request = Request({
+        'type': 'http',
+        'headers': [(k.lower().encode(), v.encode()) for k, v in headers],
+        'client': client,
+        'path_params': path_params or {},
+        'query_string': b'',
+    })
+    request.state.principal = None
+    return request
+
+
+def test_forwarded_for_ignored_without_trusted_proxies():
+    request = make_request([('X-Forwarded-For', '1.2.3.4')])
+    assert client_address(request, trusted_proxies=0) == '10.0.0.9'
+
+
+def test_forwarded_for_read_from_the_right():
+    request = make_request([('X-Forwarded-For', 'spoofed, 203.0.113.7, 10.0.0.2')])
+    assert client_address(request, trusted_proxies=1) == '10.0.0.2'
+    assert client_address(request, trusted_proxies=2) == '203.0.113.7'
+
+
+def test_identity_ignores_client_supplied_user_ids():
+    request = make_request([('X-User-Id', 'someone-else')])
+    assert request_identity(request) == 'ip:10.0.0.9'
+    request.state.principal = SimpleNamespace(uid='alice')
+    assert request_identity(request) == 'user:alice'
+    assert request_identity(make_request(path_params={'user_id': 'bob'})) == 'ip:10.0.0.9'
+
+
+def test_gate_counts_in_flight():
+    async def scenario():
+        gate = ConcurrencyGate(2)
+        assert await gate.acquire(0.1) and await gate.acquire(0.1)
+        full = gate.in_flight
+        timed_out = not await gate.acquire(0.01)
+        gate.release()
+        return full, timed_out, gate.in_flight
+
+    assert asyncio.run(scenario()) == (2, True, 1)
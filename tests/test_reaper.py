@@ -0,0 +1,60 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from mongomock_motor import AsyncMongoMockClient
+
+import export_cache
+from reaper import DEPENDENTS, Reaper
+
+
+def seed(db, doc_id, records=3, **fields):
+    async def main():
+        await db.documents.insert_one({'id': doc_id, 'title': doc_id, **fields})
+        for collection, field in DEPENDENTS.items():
+            await db[collection].insert_many([{field: doc_id, 'n': n} for n in range(records)])
+    return main()
+
+
+def test_reaps_tombstones_and_their_dependents(monkeypatch):
+    purged, hooked = [], []
+    monkeypatch.setattr(export_cache, 'purge', purged.append)
+
+    async def main():
+        db = AsyncMongoMockClient()['reaper']
+        reaper = Reaper(lambda: db, batch_size=2)
+
+        async def hook(doc_id):
+            hooked.append(doc_id)
+        reaper.hooks.append(hook)
+        await reaper.ensure_indexes()
+        await seed(db, 'gone', records=5, deleted_at='2026-01-01T00:00:00')
+        await seed(db, 'kept')
+        reaped = await reaper.run_once()
+        remaining = {c: await db[c].count_documents({}) for c in DEPENDENTS}
+        return reaped, remaining, await db.documents.distinct('id'), reaper
+
+    reaped, remaining, documents, reaper = asyncio.run(main())
+    assert reaped == 1
+    assert documents == ['kept']
+    assert remaining == {c: 3 for c in DEPENDENTS}
+    assert reaper.records_removed == {c: 5 for c in DEPENDENTS}
+    assert purged == hooked == ['gone']
+
+
+def test_skips_tombstones_in_grace_or_leased():
+    async def main():
+        db = AsyncMongoMockClient()['reaper']
+        reaper = Reaper(lambda: db, grace=3600)
+        now = datetime.utcnow()
+        await seed(db, 'recent', deleted_at=now.isoformat())
+        await seed(db, 'leased', deleted_at='2026-01-01T00:00:00',
+                   reap={'lease_until': (now + timedelta(minutes=5)).isoformat()})
+        await seed(db, 'expired', deleted_at='2026-01-01T00:00:00',
+                   reap={'lease_until': (now - timedelta(minutes=5)).isoformat()})
+        reaped = await reaper.run_once()
+        return reaped, sorted(await db.documents.distinct('id')), await reaper.stats()
+
+    reaped, documents, stats = asyncio.run(main())
+    assert reaped == 1
+    assert documents == ['leased', 'recent']
+    assert stats['pending'] == 2 and stats['documents_reaped'] == 1
@@ -0,0 +1,57 @@
+import redline
+from redline import ELLIPSIS, diff_documents, diff_text
+
+
+def changes(segments):
+    return [(op, text) for op, text in segments if op != 'equal']
+
+
+def test_identical_text_has_no_changes():
+    assert changes(diff_text('The same words.', 'The same words.')) == []
+
+
+def test_word_level_replacement():
+    segments = diff_text('Revenue grew 10% in 2024.', 'Revenue grew 12% in 2024.')
+    assert changes(segments) == [('delete', '10%'), ('insert', '12%')]
+    assert ''.join(text for op, text in segments if op != 'insert') == 'Revenue grew 10% in 2024.'
+    assert ''.join(text for op, text in segments if op != 'delete') == 'Revenue grew 12% in 2024.'
+
+
+def test_inserted_and_deleted_lines():
+    assert changes(diff_text('one\ntwo\n', 'one\ntwo\nthree\n')) == [('insert', 'three\n')]
+    assert changes(diff_text('one\ntwo\nthree\n', 'one\nthree\n')) == [('delete', 'two\n')]
+
+
+def test_unchanged_runs_are_shortened_around_changes():
+    words = [f"w{i}" for i in range(100)]
+    old = ' '.join(words)
+    new = ' '.join(words[:50] + ['CHANGED'] + words[51:])
+    segments = diff_text(old, new, context=3)
+    before, after = segments[0][1], segments[-1][1]
+    assert before.startswith(ELLIPSIS) and before.rstrip().endswith('w49')
+    assert len(before.split()) == 4  # ellipsis plus three words of context
+    assert after.lstrip().startswith('w51') and after.endswith(ELLIPSIS)
+    assert changes(segments) == [('delete', 'w50'), ('insert', 'CHANGED')]
+
+
+def test_oversized_blocks_are_replaced_whole(monkeypatch):
+    monkeypatch.setattr(redline, 'REDLINE_MAX_BLOCK_TOKENS', 2)
+    assert changes(diff_text('a b c', 'a x y c')) == [('delete', 'b'), ('insert', 'x y')]
+
+
+def test_documents_report_only_changed_sections():
+    old = {'id': 'rev', 'document_id': 'd1', 'title': 'Memo', 'sections': [
+        {'section_id': 's1', 'section_number': '1', 'title': 'Overview', 'content': {'summary': 'Old text'}},
+        {'section_id': 's2', 'section_number': '2', 'title': 'Team', 'content': {'lead': 'Ana'}},
+        {'section_id': 's3', 'section_number': '3', 'title': 'Risks', 'content': {'notes': 'None'}},
+    ]}
+    new = {'id': 'd1', 'title': 'Memo', 'updated_at': '2026-01-02', 'sections': [
+        {'section_id': 's1', 'section_number': '1', 'title': 'Overview', 'content': {'summary': 'New text'}},
+        {'section_id': 's2', 'section_number': '2', 'title': 'Team', 'content': {'lead': 'Ana'}},
+        {'section_id': 's4', 'section_number': '4', 'title': 'Exit', 'content': {'plan': 'IPO'}},
+    ]}
+    result = diff_documents(old, new)
+    assert [(s['section_id'], s['change']) for s in result['sections']] == [
+        ('s1', 'changed'), ('s4', 'added'), ('s3', 'removed')]
+    assert result['unchanged_sections'] == 1
+    assert result['base']['revision_id'] == 'rev' and result['target']['reason'] == 'current'
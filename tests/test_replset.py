@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+from pymongo.errors import OperationFailure, ServerSelectionTimeoutError
+
+import cache
+import replset
+
+
+class FakeProcess:
+    returncode = None
+
+    def __init__(self, args, **kwargs):
+        self.args = args
+        self.terminated = False
+
+    def poll(self):
+        return self.returncode
+
+    def terminate(self):
+        self.terminated = True
+
+
+class FakeAdmin:
+    def __init__(self, replies):
+        self.replies = replies
+        self.calls = []
+
+    def command(self, name, *args):
+        self.calls.append(name)
+        reply = self.replies[name].pop(0)
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+
+def fake_mongo(monkeypatch, replies):
+    admin = FakeAdmin(replies)
+    processes = []
+
+    def popen(args, **kwargs):
+        processes.append(FakeProcess(args))
+        return processes[-1]
+    monkeypatch.setattr(replset.shutil, 'which', lambda name: '/usr/bin/mongod')
+    monkeypatch.setattr(replset.subprocess, 'Popen', popen)
+    monkeypatch.setattr(replset, 'MongoClient', lambda *a, **k: type('Client', (), {'admin': admin, 'close': lambda self: None})())
+    monkeypatch.setattr(replset.time, 'sleep', lambda seconds: None)
+    return admin, processes
+
+
+def test_waits_for_a_primary(monkeypatch, tmp_path):
+    admin, processes = fake_mongo(monkeypatch, {
+        'replSetInitiate': [ServerSelectionTimeoutError('starting'), OperationFailure('already', code=23)],
+        'hello': [{'isWritablePrimary': False}, {'isWritablePrimary': True}],
+    })
+    proc, url = replset.start_replset(port=27099, dbpath=str(tmp_path))
+    assert url == 'mongodb://127.0.0.1:27099/?replicaSet=rs0'
+    assert proc is processes[0] and '--replSet' in proc.args and not proc.terminated
+    assert admin.calls == ['replSetInitiate', 'replSetInitiate', 'hello', 'hello']
+
+
+def test_gives_up_when_mongod_exits(monkeypatch, tmp_path):
+    admin, processes = fake_mongo(monkeypatch, {})
+    FakeProcess.returncode = 100
+    try:
+        with pytest.raises(RuntimeError, match='exited with 100'):
+            replset.start_replset(dbpath=str(tmp_path))
+    finally:
+        FakeProcess.returncode = None
+
+
+def test_requires_mongod(monkeypatch):
+    monkeypatch.setattr(replset.shutil, 'which', lambda name: None)
+    with pytest.raises(RuntimeError, match='mongod not found'):
+        replset.start_replset()
+
+
+def test_change_stream_invalidates_other_workers(mongod_url, monkeypatch):
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    monkeypatch.setattr(cache, '_subscribers', {})
+    seen = []
+    cache.subscribe('users', seen.append)
+
+    async def main():
+        db = AsyncIOMotorClient(mongod_url)['replset_test']
+        watcher = asyncio.create_task(cache.watch_invalidations(db))
+        await asyncio.sleep(1)
+        await db.users.insert_one({'uid': 'alice'})
+        await db.users.update_one({'uid': 'alice'}, {'$set': {'role': 'admin'}})
+        for _ in range(100):
+            if len(seen) >= 2:
+                break
+            await asyncio.sleep(0.05)
+        watcher.cancel()
+        await asyncio.gather(watcher, return_exceptions=True)
+
+    asyncio.run(main())
+    assert seen[:2] == ['alice', 'alice']
@@ -0,0 +1,144 @@
+import asyncio
+
+
+def seed(server, users=(), documents=()):
+    async def main():
+        for uid, role in users:
+            await server.mongo_db.users.insert_one({'uid': uid, 'email': f'{uid}@example.com',
+                                                    'display_name': uid.title(), 'role': role,
+                                                    'created_at': '2026-01-01T00:00:00'})
+        for doc_id, owner, collaborators, fields in documents:
+            await server.mongo_db.documents.insert_one({
+                'id': doc_id, 'title': doc_id, 'status': 'draft', 'created_by': owner,
+                'created_at': '2026-01-01T00:00:00', 'updated_at': '2026-01-01T00:00:00',
+                'collaborators': [owner, *collaborators], 'sections': [], **fields,
+            })
+    asyncio.run(main())
+
+
+def test_requests_without_a_token_are_rejected(client):
+    async def main():
+        async with client() as http:
+            return await http.get('/api/documents/d1')
+
+    assert asyncio.run(main()).status_code == 401
+
+
+def test_self_registration_cannot_choose_a_role(server, client):
+    async def main():
+        async with client('mallory') as http:
+            created = await http.post('/api/users', json={'uid': 'mallory', 'email': 'm@example.com',
+                                                          'display_name': 'Mallory', 'role': 'admin'})
+            promoted = await http.patch('/api/users/mallory/role', params={'role': 'admin'})
+            again = await http.post('/api/users', json={'uid': 'mallory', 'email': 'm@example.com',
+                                                        'display_name': 'Mallory', 'role': 'admin'})
+            other = await http.post('/api/users', json={'uid': 'alice', 'email': 'a@example.com',
+                                                        'display_name': 'Alice'})
+        return created, promoted, again, other, await server.store.get_user('mallory')
+
+    created, promoted, again, other, stored = asyncio.run(main())
+    assert created.status_code == 200 and created.json()['role'] == 'editor'
+    assert promoted.status_code == 403
+    assert again.json()['role'] == 'editor'
+    assert other.status_code == 403
+    assert stored['role'] == 'editor'
+
+
+def test_registering_again_keeps_an_admin_granted_role(server, client):
+    seed(server, users=[('root', 'admin')])
+
+    async def main():
+        body = {'uid': 'alice', 'email': 'a@example.com', 'display_name': 'Alice'}
+        async with client('alice') as alice, client('root') as root:
+            await alice.post('/api/users', json=body)
+            promoted = await root.patch('/api/users/alice/role', params={'role': 'viewer'})
+            again = await alice.post('/api/users', json={**body, 'display_name': 'Alice B'})
+        return promoted, again
+
+    promoted, again = asyncio.run(main())
+    assert promoted.status_code == 200
+    assert again.json()['role'] == 'viewer' and again.json()['display_name'] == 'Alice B'
+
+
+def test_documents_are_limited_to_collaborators(server, client):
+    seed(server, users=[('alice', 'editor'), ('bob', 'editor'), ('eve', 'editor'), ('root', 'admin')],
+         documents=[('d1', 'alice', ['bob'], {})])
+
+    async def main():
+        results = {}
+        for uid in ('alice', 'bob', 'eve', 'root'):
+            async with client(uid) as http:
+                results[uid] = (
+                    (await http.get('/api/documents/d1')).status_code,
+                    (await http.get('/api/documents/d1/activity')).status_code,
+                    (await http.get('/api/comments', params={'document_id': 'd1'})).status_code,
+                )
+        return results
+
+    results = asyncio.run(main())
+    assert results['alice'] == results['bob'] == results['root'] == (200, 200, 200)
+    assert results['eve'] == (403, 403, 403)
+
+
+def test_only_the_owner_deletes(server, client):
+    seed(server, users=[('alice', 'editor'), ('bob', 'editor')],
+         documents=[('d1', 'alice', ['bob'], {})])
+
+    async def main():
+        async with client('bob') as bob, client('alice') as alice:
+            by_collaborator = await bob.delete('/api/documents/d1')
+            by_owner = await alice.delete('/api/documents/d1')
+        return by_collaborator, by_owner
+
+    by_collaborator, by_owner = asyncio.run(main())
+    assert by_collaborator.status_code == 403
+    assert by_owner.status_code == 200
+
+
+def test_collaborator_roles_are_validated(server, client):
+    seed(server, users=[('alice', 'editor'), ('bob', 'editor'), ('carol', 'editor')],
+         documents=[('d1', 'alice', [], {})])
+
+    async def main():
+        async with client('alice') as alice:
+            owner = await alice.post('/api/documents/d1/collaborators', json={'user_id': 'bob', 'role': 'owner'})
+            viewer = await alice.post('/api/documents/d1/collaborators', json={'user_id': 'carol', 'role': 'viewer'})
+        return owner, viewer, await server.mongo_db.document_members.find_one({'user_id': 'carol'})
+
+    owner, viewer, membership = asyncio.run(main())
+    assert owner.status_code == 422
+    assert viewer.status_code == 200 and membership['role'] == 'viewer'
+
+
+def test_deleted_documents_are_not_found(server, client):
+    seed(server, users=[('alice', 'editor'), ('eve', 'editor'), ('root', 'admin')],
+         documents=[('gone', 'alice', [], {'deleted_at': '2026-01-02T00:00:00'})])
+
+    async def main():
+        results = {}
+        for uid in ('alice', 'eve'):
+            async with client(uid) as http:
+                results[uid] = [
+                    (await http.get('/api/documents/gone/activity')).status_code,
+                    (await http.get('/api/documents/gone/revisions')).status_code,
+                    (await http.get('/api/documents/gone/attachments')).status_code,
+                    (await http.get('/api/comments', params={'document_id': 'gone'})).status_code,
+                    (await http.get('/api/documents/missing/activity')).status_code,
+                ]
+        return results
+
+    results = asyncio.run(main())
+    assert results['alice'] == results['eve'] == [404] * 5
+
+
+def test_metrics_are_admin_only(server, client):
+    seed(server, users=[('alice', 'editor'), ('root', 'admin')])
+
+    async def main():
+        statuses = []
+        for uid in (None, 'alice', 'root'):
+            async with client(uid) as http:
+                statuses.append((await http.get('/api/metrics')).status_code)
+        return statuses
+
+    assert asyncio.run(main()) == [401, 403, 200]
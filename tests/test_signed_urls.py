@@ -0,0 +1,41 @@
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+from fastapi import HTTPException
+
+import signed_urls
+
+
+def split(url):
+    parts = urlsplit(url)
+    query = parse_qs(parts.query)
+    return parts.path, int(query['expires'][0]), query['signature'][0]
+
+
+def test_signed_url_verifies():
+    url, expires = signed_urls.sign('/api/exports/doc-1/0123456789abcdef.pdf', ttl=60)
+    path, query_expires, signature = split(url)
+    assert path == '/api/exports/doc-1/0123456789abcdef.pdf' and query_expires == expires
+    assert 0 < signed_urls.verify(path, expires, signature) <= 60
+
+
+@pytest.mark.parametrize('tamper', ['path', 'expires', 'signature'])
+def test_tampered_url_is_rejected(tamper):
+    path, expires, signature = split(signed_urls.sign('/api/exports/doc-1/0123456789abcdef.pdf', ttl=60)[0])
+    if tamper == 'path':
+        path = '/api/exports/doc-2/0123456789abcdef.pdf'
+    elif tamper == 'expires':
+        expires += 3600
+    else:
+        signature = signature[:-1] + ('0' if signature[-1] != '0' else '1')
+    with pytest.raises(HTTPException) as e:
+        signed_urls.verify(path, expires, signature)
+    assert e.value.status_code == 403 and e.value.detail == "Invalid download signature"
+
+
+def test_expired_url_is_rejected(monkeypatch):
+    path, expires, signature = split(signed_urls.sign('/api/exports/doc-1/0123456789abcdef.pdf', ttl=60)[0])
+    monkeypatch.setattr(signed_urls.time, 'time', lambda: expires + 1)
+    with pytest.raises(HTTPException) as e:
+        signed_urls.verify(path, expires, signature)
+    assert e.value.status_code == 403 and e.value.detail == "Download link has expired"
@@ -0,0 +1,127 @@
+import asyncio
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from storage import StorageEngine, open_storage
+
+ENGINES = ['memory', 'sqlite', 'mongo']
+
+
+@pytest.fixture(params=ENGINES)
+def engine(request, tmp_path):
+    if request.param == 'mongo':
+        db = AsyncMongoMockClient()['storage']
+        return lambda: open_storage('mongo', get_db=lambda: db)
+    return lambda: open_storage(request.param, path=str(tmp_path / 'im.sqlite3'))
+
+
+def run(engine, scenario):
+    async def main():
+        store = engine()
+        try:
+            return await scenario(store)
+        finally:
+            await store.close()
+    return asyncio.run(main())
+
+
+def document(doc_id, collaborators, **fields):
+    return {'id': doc_id, 'title': doc_id.upper(), 'status': 'draft', 'created_by': collaborators[0],
+            'created_at': '2026-01-01T00:00:00', 'updated_at': '2026-01-01T00:00:00',
+            'collaborators': collaborators, 'sections': [], **fields}
+
+
+def test_engines_implement_the_whole_interface():
+    with pytest.raises(TypeError):
+        type('Partial', (StorageEngine,), {})()
+
+
+def test_users(engine):
+    async def scenario(store):
+        await store.upsert_user({'uid': 'u1', 'email': 'a@example.com', 'role': 'editor'})
+        await store.upsert_user({'uid': 'u1', 'email': 'b@example.com', 'role': 'editor'})
+        changed = await store.set_user_role('u1', 'admin')
+        missing = await store.set_user_role('nobody', 'admin')
+        return await store.get_user('u1'), await store.list_users(), changed, missing
+
+    user, users, changed, missing = run(engine, scenario)
+    assert user['email'] == 'b@example.com' and user['role'] == 'admin'
+    assert [u['uid'] for u in users] == ['u1']
+    assert changed and not missing
+
+
+def test_user_defaults_only_apply_on_insert(engine):
+    async def scenario(store):
+        defaults = {'role': 'editor', 'created_at': '2026-01-01T00:00:00'}
+        created = await store.upsert_user({'uid': 'u1', 'email': 'a@example.com'}, defaults=defaults)
+        await store.set_user_role('u1', 'admin')
+        again = await store.upsert_user({'uid': 'u1', 'email': 'b@example.com'},
+                                        defaults={**defaults, 'created_at': '2026-02-01T00:00:00'})
+        return created, again
+
+    created, again = run(engine, scenario)
+    assert created == {'uid': 'u1', 'email': 'a@example.com', 'role': 'editor', 'created_at': '2026-01-01T00:00:00'}
+    assert again == {'uid': 'u1', 'email': 'b@example.com', 'role': 'admin', 'created_at': '2026-01-01T00:00:00'}
+
+
+def test_documents(engine):
+    async def scenario(store):
+        await store.insert_documents([document('d1', ['alice', 'bob']), document('d2', ['carol']),
+                                      document('gone', ['alice'], deleted_at='2026-01-02T00:00:00')])
+        previous = await store.update_document('d1', {'title': 'Renamed', 'collaborators': ['alice']})
+        return (
+            previous,
+            await store.get_document('d1'),
+            await store.get_document('gone'),
+            sorted(d['id'] for d in await store.list_documents()),
+            [d['id'] for d in await store.list_documents('alice')],
+            await store.list_documents('bob'),
+            await store.update_document('gone', {'title': 'x'}),
+            await store.delete_document('d2'),
+            await store.get_document('d2'),
+        )
+
+    previous, current, deleted, live, alice, bob, update_deleted, removed, after_delete = run(engine, scenario)
+    assert previous['title'] == 'D1' and current['title'] == 'Renamed'
+    assert deleted is None and update_deleted is None
+    assert live == ['d1', 'd2']
+    assert alice == ['d1'] and bob == []
+    assert removed and after_delete is None
+
+
+def test_records_are_not_aliased(engine):
+    async def scenario(store):
+        doc = document('d1', ['alice'])
+        await store.insert_documents([doc])
+        doc['title'] = 'changed by caller'
+        fetched = await store.get_document('d1')
+        fetched['collaborators'].append('mallory')
+        return await store.get_document('d1')
+
+    stored = run(engine, scenario)
+    assert stored['title'] == 'D1' and stored['collaborators'] == ['alice']
+
+
+def test_comments_and_notifications(engine):
+    async def scenario(store):
+        await store.insert_comment({'id': 'c1', 'document_id': 'd1', 'text': 'one'})
+        await store.insert_comment({'id': 'c2', 'document_id': 'd2', 'text': 'two'})
+        await store.insert_notifications([
+            {'id': 'n1', 'user_id': 'alice', 'read': False},
+            {'id': 'n2', 'user_id': 'bob', 'read': False},
+        ])
+        return (
+            [c['id'] for c in await store.list_comments('d1')],
+            sorted(c['id'] for c in await store.list_comments()),
+            await store.mark_notification_read('n1', 'bob'),
+            await store.mark_notification_read('n1', 'alice'),
+            await store.mark_notification_read('n2'),
+            await store.mark_notification_read('missing'),
+            await store.list_notifications('alice'),
+        )
+
+    d1, everything, wrong_user, own, any_user, missing, alice = run(engine, scenario)
+    assert d1 == ['c1'] and everything == ['c1', 'c2']
+    assert not wrong_user and own and any_user and not missing
+    assert [(n['id'], n['read']) for n in alice] == [('n1', True)]